@@ -0,0 +1,519 @@
+# backup.py
+# Backup files for Settings: export in two formats, and a streaming,
+# resumable import of either.
+#
+# Formats (the importer tells them apart by their first bytes):
+#   ndjson.gz  gzip'd lines: a header, then one [key, value] per top-level key
+#              and one [ledger, record] per ledger record
+#                {"format": "balls-logistics-backup", "version": 1, "created": .., "records": {"log": n, ..}}
+#                ["baseline", 100000.0]
+#                ["log", {"timestamp": .., "type": "Trip", ..}]
+#              "records" lets the importer tell a file cut short at a line
+#              break from a complete one. Files from a newer format version
+#              are refused.
+#   json       the original pretty-printed {"baseline": .., "log": [..], ..}
+#              (indent=2), still accepted and still offered; it is byte for
+#              byte what json.dumps() wrote before.
+# Both are produced by generators a record at a time, and only when the user
+# asks for a backup; benchmarks/backup_bench.py compares them.
+#
+# Import: the file is read in IMPORT_CHUNK pieces (gunzipped on the way) and
+# decoded one value at a time, so a ledger record is parsed, checked and
+# written without the rest of the file ever being held as Python objects:
+# memory stays at one chunk, one batch and the running totals, whatever the
+# size of the backup.
+#
+# Every ledger record is checked for what would break the database: it must
+# be an object, numbers must be finite and keys legal Firebase keys. Records
+# that fail are skipped and reported; nothing malformed is written. Values
+# that don't fit their column (legacy string amounts, "2024/01/02" dates) are
+# taken as they are, the way LedgerTable keeps them (columnar.py).
+# Of the other keys only baseline and total_cost are taken from the file. The
+# aggregates, rollups, trip totals and event snapshot are rebuilt from the
+# records as they stream past.
+#
+# The file is read twice. The first pass only parses, checks and hashes it,
+# so a truncated file or one that isn't a backup never replaces anything.
+# The second pass writes the records in batches of IMPORT_BATCH, in the
+# app's partitioned layout (persistence.py), but under a fresh staging node
+# /users/<uid>/parts-<stamp> that nothing reads yet. A record goes in the
+# partition of its own month, or the newest one if that is later, the same
+# rule LedgerTable uses. The first write only adds a marker to /app
+#   /app/import   {"id": <sha256 of the file>, "size": n, "root": "parts-<stamp>",
+#                  "done": {kind: records written}}
+# and each batch moves "done" forward in the same update() as its records.
+# The last write is the switch: one multi-path update() replaces /app with
+# the rebuilt keys, the part index and parts_root = the staging node, and
+# deletes the old partitions. Until then the user's data is untouched; if
+# it never happens (a crash, a timeout, the tab closed), the marker is left
+# behind and load_data() reports the interrupted import. Uploading the same
+# file again resumes it: everything is parsed again, but records already
+# written are only counted. Another file starts over and drops the staged
+# records of the abandoned import.
+import codecs
+import gzip
+import hashlib
+import json
+import math
+import re
+import time
+import zlib
+
+from columnar import LEDGER_KEYS, LEDGER_SCHEMAS
+from doccache import new_version, stamp
+from events import CORRECTIONS, EVENT_SEQ, SNAPSHOT
+from ledger import TRIP_TOTALS, _round, empty_aggregates, fold_record
+from persistence import PARTS_ROOT, parts_root
+
+IMPORT_KEY = "import"           # /app/import while an import is unfinished
+IMPORT_CHUNK = 256 * 1024       # bytes read from the file at a time
+IMPORT_BATCH = 500              # records per update()
+IMPORT_MAX_VALUE = 8 * 1024 * 1024  # characters one value may span before the file is rejected
+IMPORT_MAX_ERRORS = 20          # skipped records described in the result; the rest are only counted
+NUMBER_KEYS = ("baseline", "total_cost")  # taken from the file; everything else is rebuilt
+REBUILT_KEYS = (*TRIP_TOTALS, "aggregates", "rollups", EVENT_SEQ, SNAPSHOT, CORRECTIONS)
+
+BACKUP_FORMAT = "balls-logistics-backup"
+BACKUP_VERSION = 1
+EXPORT_KEYS = ("baseline", "last_mileage", "total_miles", "total_cost", "total_gallons",
+               "last_trip_summary", "log", "expenses", "earnings")
+EXPORT_FORMATS = {  # name -> (file name, mime type)
+    "ndjson.gz": ("balls_logistics_backup.ndjson.gz", "application/gzip"),
+    "json": ("balls_logistics_backup.json", "application/json"),
+}
+EXPORT_CHUNK = 64 * 1024        # characters handed to the encoder at a time
+EXPORT_GZIP_LEVEL = 6
+
+_FORBIDDEN_KEY_CHARS = re.compile(r"[.$#\[\]/]")
+_FIELDS = {k: dict(schema) for k, schema in LEDGER_SCHEMAS.items()}
+_DATES = {k: next(n for n, t in schema if t in ("ts", "d")) for k, schema in LEDGER_SCHEMAS.items()}
+_SPACE = re.compile(r"[ \t\r\n]*")
+_NDJSON_HEAD = re.compile(r'\{\s*"format"\s*:')
+_PRETTY = json.JSONEncoder(indent=2).encode
+_COMPACT = json.JSONEncoder(separators=(",", ":")).encode
+
+
+# ------------------------- Export -------------------------
+def _chunks(pieces):
+    # strings -> bytes of about EXPORT_CHUNK
+    buf, n = [], 0
+    for p in pieces:
+        buf.append(p)
+        n += len(p)
+        if n >= EXPORT_CHUNK:
+            yield "".join(buf).encode("utf-8")
+            buf, n = [], 0
+    if buf:
+        yield "".join(buf).encode("utf-8")
+
+
+def _pretty_record(r):
+    # _PRETTY(r) at the depth of a ledger record; flat records skip the pure-Python encoder
+    if not r or any(isinstance(v, (dict, list)) for v in r.values()):
+        return _PRETTY(r).replace("\n", "\n    ")
+    return "{\n      " + ",\n      ".join(f"{_COMPACT(k)}: {_COMPACT(v)}" for k, v in r.items()) + "\n    }"
+
+
+def _json_pieces(state):
+    # json.dumps({k: ..}, indent=2) one record at a time
+    for i, k in enumerate(EXPORT_KEYS):
+        yield ("{\n  " if i == 0 else ",\n  ") + json.dumps(k) + ": "
+        v = state.get(k)
+        if k not in LEDGER_KEYS:
+            yield _PRETTY(v).replace("\n", "\n  ")
+        elif not len(v or []):
+            yield "[]"
+        else:
+            for j, r in enumerate(v):
+                yield ("[\n    " if j == 0 else ",\n    ") + _pretty_record(r)
+            yield "\n  ]"
+    yield "\n}"
+
+
+def _ndjson_pieces(state):
+    header = {"format": BACKUP_FORMAT, "version": BACKUP_VERSION,
+              "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "records": {k: len(state.get(k) or []) for k in LEDGER_KEYS}}
+    yield _COMPACT(header) + "\n"
+    for k in EXPORT_KEYS:
+        v = state.get(k)
+        if k not in LEDGER_KEYS:
+            yield _COMPACT([k, v]) + "\n"
+            continue
+        for r in v or []:
+            yield _COMPACT([k, r]) + "\n"
+
+
+def export_backup(state, fmt="ndjson.gz"):
+    # the backup as a stream of bytes; iterating the ledgers loads their older partitions
+    if fmt == "json":
+        yield from _chunks(_json_pieces(state))
+        return
+    z = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in _chunks(_ndjson_pieces(state)):
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+# ------------------------- Reading -------------------------
+class _Reader:
+    # JSON values one at a time from a binary file
+    def __init__(self, f, chunk=IMPORT_CHUNK):
+        self.f = f
+        self.chunk = chunk
+        self.decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.json = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+
+    def _more(self):
+        # append the next chunk; -> False at the end of the file
+        if self.eof:
+            return False
+        data = self.f.read(self.chunk)
+        self.bytes_read += len(data)
+        if not data:
+            self.eof = True
+        text = self.decoder.decode(data, final=not data)
+        if len(self.buf) - self.pos > IMPORT_MAX_VALUE:
+            raise ValueError(f"unreadable value near byte {self.bytes_read}")
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return bool(data) or bool(text)
+
+    def peek(self):
+        # next character that isn't whitespace; "" at the end of the file
+        while True:
+            self.pos = _SPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._more():
+                return ""
+
+    def ahead(self, n):
+        # the next `n` characters (fewer at the end of the file), without consuming them
+        self.peek()
+        while len(self.buf) - self.pos < n and self._more():
+            pass
+        return self.buf[self.pos:self.pos + n]
+
+    def expect(self, chars):
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError(f"expected {' or '.join(repr(x) for x in chars)} near byte {self.bytes_read}")
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                v, end = self.json.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as ex:
+                if self._more():
+                    continue
+                at = self.bytes_read - len(self.buf) + ex.pos
+                raise ValueError(f"not valid JSON near byte {at} ({ex.msg.lower()})") from None
+            if end == len(self.buf) and self._more():
+                continue  # a number may go on in the next chunk
+            self.pos = end
+            return v
+
+
+def _items(reader):
+    # ("key", name, value) for top-level keys, ("record", kind, value) per ledger record
+    if _NDJSON_HEAD.match(reader.ahead(64)):
+        yield from _ndjson_items(reader)
+        return
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.pos += 1
+    else:
+        while True:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise ValueError("backup keys must be strings")
+            reader.expect(":")
+            if key in LEDGER_KEYS and reader.peek() == "[":
+                reader.pos += 1
+                if reader.peek() == "]":
+                    reader.pos += 1
+                else:
+                    while True:
+                        yield "record", key, reader.value()
+                        if reader.expect(",]") == "]":
+                            break
+            else:
+                yield "key", key, reader.value()
+            if reader.expect(",}") == "}":
+                break
+    if reader.peek():
+        raise ValueError("unexpected data after the backup")
+
+
+def _ndjson_items(reader):
+    header = reader.value()
+    if not isinstance(header, dict) or header.get("format") != BACKUP_FORMAT:
+        raise ValueError("not a backup file")
+    version = header.get("version")
+    if not isinstance(version, int) or version > BACKUP_VERSION:
+        raise ValueError(f"backup format version {version} is newer than this app can read")
+    seen = dict.fromkeys(LEDGER_KEYS, 0)
+    while reader.peek():
+        line = reader.value()
+        if not (isinstance(line, list) and len(line) == 2 and isinstance(line[0], str)):
+            raise ValueError(f"malformed backup line near byte {reader.bytes_read}")
+        name, v = line
+        if name in LEDGER_KEYS:
+            seen[name] += 1
+            yield "record", name, v
+        else:
+            yield "key", name, v
+    counts = header.get("records") or {}
+    for k in LEDGER_KEYS:
+        if isinstance(counts.get(k), int) and seen[k] < counts[k]:
+            raise ValueError(f"the backup is cut short: {seen[k]} of {counts[k]} {k} records")
+
+
+class _Counted:
+    # a binary file that counts and hashes what is read from it (progress; resume marker)
+    def __init__(self, f):
+        self.f = f
+        self.sha = hashlib.sha256()
+        self.size = 0
+
+    def read(self, n):
+        data = self.f.read(n)
+        self.sha.update(data)
+        self.size += len(data)
+        return data
+
+
+# ------------------------- Validation -------------------------
+def _num(v):
+    try:
+        return float(v or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _bad_key(k):
+    return not isinstance(k, str) or not k or _FORBIDDEN_KEY_CHARS.search(k) is not None
+
+
+def _bad_value(v):
+    # nested keys Firebase would refuse, or numbers JSON can't carry; -> problem or None
+    if isinstance(v, float) and not math.isfinite(v):
+        return "is not a finite number"
+    if isinstance(v, dict):
+        for k, x in v.items():
+            if _bad_key(k):
+                return f"has an illegal key {k!r}"
+            problem = _bad_value(x)
+            if problem:
+                return problem
+    elif isinstance(v, list):
+        for x in v:
+            problem = _bad_value(x)
+            if problem:
+                return problem
+    return None
+
+
+def _is_number(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v)
+
+
+def check_record(kind, rec):
+    # -> why `rec` can't go into ledger `kind`, or None if it can
+    if not isinstance(rec, dict):
+        return "is not an object"
+    fields = _FIELDS[kind]
+    for k, v in rec.items():
+        if k not in fields and _bad_key(k):
+            return f"has an illegal key {k!r}"
+        problem = _bad_value(v)  # anything else fits: LedgerTable keeps odd values verbatim
+        if problem:
+            return f"{k} {problem}"
+    seq = rec.get("seq") if kind == "log" else None
+    if seq is not None and (not isinstance(seq, int) or isinstance(seq, bool)):
+        return "seq is not an integer"  # event numbers are compared (events.py)
+    return None
+
+
+# ------------------------- Import -------------------------
+def _wire(v):
+    return None if v is None or v == [] or v == {} else v
+
+
+def _month(date):
+    # the month LedgerTable files a record under (columnar.py), odd dates included
+    if isinstance(date, str) and len(date) >= 7 and date[4] == "-" and date[:4].isdigit() and date[5:7].isdigit():
+        return date[:7]
+    return None
+
+
+class _Partitions:
+    # where the next record of one ledger goes, without holding the records
+    def __init__(self):
+        self.counts = []  # [[month, n], ...] oldest first
+
+    def place(self, rec, date_field):
+        # -> (month, slot)
+        newest = self.counts[-1][0] if self.counts else None
+        mk = _month(rec.get(date_field)) or newest or time.strftime("%Y-%m")
+        if newest is None or mk > newest:
+            self.counts.append([mk, 0])
+        self.counts[-1][1] += 1
+        return self.counts[-1][0], self.counts[-1][1] - 1
+
+
+class ImportResult:
+    def __init__(self):
+        self.records = {k: 0 for k in LEDGER_KEYS}  # valid records in the file
+        self.written = 0       # records sent by this run (fewer than the total when resuming)
+        self.resumed = False
+        self.skipped = 0
+        self.errors = []       # the first IMPORT_MAX_ERRORS problems, as text
+        self.ignored = []      # top-level keys the app doesn't know
+
+    def problem(self, text):
+        self.skipped += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append(text)
+
+
+class _Scan:
+    # one pass over a backup: checks every record and keeps what the final write needs
+    def __init__(self, result, gz=False):
+        self.result = result
+        self.gz = gz
+        self.parts = {k: _Partitions() for k in LEDGER_KEYS}
+        self.agg, self.roll = empty_aggregates(), {}
+        self.values = {}
+        self.miles = self.gallons = 0.0
+        self.last_trip, self.top_seq = {}, 0
+        self.reader = None
+
+    def run(self, f, write=None):
+        # write(kind, n, month, slot, record) for the n-th valid record of each ledger
+        result = self.result
+        self.reader = _Reader(gzip.GzipFile(fileobj=f, mode="rb") if self.gz else f)
+        positions = {k: 0 for k in LEDGER_KEYS}
+        for what, key, v in _items(self.reader):
+            if what == "key":
+                if key in LEDGER_KEYS and v is None:
+                    continue  # an empty ledger
+                if key in NUMBER_KEYS and (v is None or _is_number(v)):
+                    self.values[key] = v
+                elif key in NUMBER_KEYS or key in LEDGER_KEYS:
+                    result.problem(f"{key} is not {'a number' if key in NUMBER_KEYS else 'a list'}")
+                elif key not in REBUILT_KEYS:
+                    result.ignored.append(key)
+                continue
+            pos = positions[key]
+            positions[key] += 1
+            problem = check_record(key, v)
+            if problem:
+                result.problem(f"{key}[{pos}]: {problem}")
+                continue
+            mk, slot = self.parts[key].place(v, _DATES[key])
+            n = result.records[key]
+            result.records[key] = n + 1
+            if key == "log":
+                if v.get("type") == "Trip":
+                    self.miles += _num(v.get("distance"))
+                    self.gallons += _num(v.get("gallons"))
+                    self.last_trip = v
+                self.top_seq = max(self.top_seq, v.get("seq") or 0)
+            else:
+                fold_record(self.agg, self.roll, key, v)
+            if write is not None:
+                write(key, n, mk, slot, v)
+
+    def final(self, root):
+        # the new /app: rebuilt keys, the part index and where the partitions are
+        baseline = self.values.get("baseline")
+        miles, gallons = _round(self.miles), _round(self.gallons)
+        derived = {"total_miles": miles, "total_gallons": gallons,
+                   "last_mileage": None if baseline is None else _round(_num(baseline) + miles),
+                   "last_trip_summary": self.last_trip}
+        index = {}
+        for k in LEDGER_KEYS:
+            for mk, n in self.parts[k].counts:
+                index.setdefault(mk, {})[k] = n
+        app = {k: _wire(self.values.get(k)) for k in NUMBER_KEYS}
+        app.update({k: _wire(v) for k, v in derived.items()})
+        app.update({"aggregates": self.agg, "rollups": _wire(self.roll), "part_index": _wire(index),
+                    EVENT_SEQ: self.top_seq or None, SNAPSHOT: {"seq": self.top_seq, **derived},
+                    PARTS_ROOT: root})
+        return {k: v for k, v in app.items() if v is not None}
+
+
+def import_backup(f, users, token, batch=IMPORT_BATCH, progress=None):
+    # Stream backup file `f` (binary, seekable) into `users` (the /users/<uid> ref).
+    # token() -> current ID token; progress(fraction) after every batch. -> ImportResult
+    # A dry run first: a file that doesn't parse (truncated, not a backup) raises
+    # ValueError before anything is replaced. It also hashes the file for the resume marker.
+    gz = f.read(2) == b"\x1f\x8b"
+    f.seek(0)
+    counted = _Counted(f)
+    try:
+        _Scan(ImportResult(), gz).run(counted)
+    except (EOFError, OSError, zlib.error) as ex:
+        raise ValueError(f"the file is damaged ({ex})") from None
+    f.seek(0)
+    fid, size = counted.sha.hexdigest(), counted.size
+
+    result = ImportResult()
+    marker = users.child("app").child(IMPORT_KEY).get(token()).val()
+    current = parts_root({PARTS_ROOT: users.child("app").child(PARTS_ROOT).get(token()).val()})
+    marker = marker if isinstance(marker, dict) else {}
+    done = {}
+    root = marker.get("root")
+    if marker.get("id") == fid and root and root != current:
+        done = {k: int(n or 0) for k, n in (marker.get("done") or {}).items()}
+        result.resumed = True
+    else:
+        first = {f"app/{IMPORT_KEY}": None}
+        if root and root != current:
+            first[root] = None  # staged records of an import that was abandoned
+        root = f"parts-{new_version()}"
+        first[f"app/{IMPORT_KEY}"] = {"id": fid, "size": size, "at": round(time.time(), 3), "root": root}
+        first.update(stamp(new_version(), [f"app/{IMPORT_KEY}"]))
+        users.update(first, token())
+
+    scan = _Scan(result, gz)
+    counted = _Counted(f)
+    pending = {}
+
+    def send():
+        if pending:
+            for k in LEDGER_KEYS:
+                if result.records[k] > done.get(k, 0):
+                    pending[f"app/{IMPORT_KEY}/done/{k}"] = result.records[k]
+            pending.update(stamp(new_version(), [f"app/{IMPORT_KEY}"]))
+            users.update(dict(pending), token())
+            pending.clear()
+        if progress is not None:
+            progress(min(1.0, counted.size / size) if size else 1.0)
+
+    def write(kind, n, mk, slot, rec):
+        if n >= done.get(kind, 0):
+            pending[f"{root}/{mk}/{kind}/{slot}"] = rec
+            result.written += 1
+            if len(pending) >= batch:
+                send()
+
+    scan.run(counted, write)
+    send()
+    # the switch: the new /app and the old partitions gone, in one update()
+    switch = {"app": scan.final(root), current: None, **stamp(new_version())}
+    users.update(switch, token())
+    if progress is not None:
+        progress(1.0)
+    return result
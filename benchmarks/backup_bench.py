@@ -0,0 +1,107 @@
+# benchmarks/backup_bench.py
+# Backup export/import: the original pretty JSON against the formats in
+# backup.py, on synthetic ledgers of 1k/10k/100k entries.
+#
+# For each size the ledger is built with ledger_bench.synthetic_state() and
+# every format is measured on it:
+#   json (before)  json.dumps({..}, indent=2) of the whole state, as Settings
+#                  built it on every render before backups became on-demand
+#   json           the same bytes, streamed by backup.export_backup()
+#   ndjson.gz      gzip'd newline-delimited records
+# export_s is the median of a few exports; peak_mb is the largest Python
+# allocation during one (tracemalloc); import_s is backup.import_backup()
+# into the in-memory backend, dry run included.
+#
+#   python benchmarks/backup_bench.py                       # 1k, 10k, 100k
+#   python benchmarks/backup_bench.py --sizes 10000 --out b.json
+import argparse
+import io
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from backup import EXPORT_KEYS, export_backup, import_backup  # noqa: E402
+from columnar import to_plain  # noqa: E402
+from ledger_bench import SIZES, _git_rev, synthetic_state  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+
+REPEATS = 3
+FORMATS = ("json (before)", "json", "ndjson.gz")
+
+
+def _export(state, fmt):
+    if fmt == "json (before)":
+        return json.dumps({k: to_plain(state[k]) for k in EXPORT_KEYS}, indent=2).encode("utf-8")
+    return b"".join(export_backup(state, fmt))
+
+
+def _peak_mb(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def measure(n, seed=0):
+    state = synthetic_state(n, seed)
+    out = {"entries": n, "formats": {}}
+    for fmt in FORMATS:
+        times = []
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            data = _export(state, fmt)
+            times.append(time.perf_counter() - start)
+        users = MemoryStorage().child("users").child("bench")
+        start = time.perf_counter()
+        import_backup(io.BytesIO(data), users, lambda: None)
+        import_s = time.perf_counter() - start
+        out["formats"][fmt] = {"export_s": statistics.median(times), "bytes": len(data),
+                               "peak_mb": _peak_mb(lambda: _export(state, fmt)), "import_s": import_s}
+    return out
+
+
+def _print_run(r):
+    base = r["formats"]["json (before)"]
+    for fmt, v in r["formats"].items():
+        print(f"{r['entries']:>7}  {fmt:<14} export {v['export_s'] * 1000:>8.1f} ms  "
+              f"{v['bytes'] / 1e6:>7.2f} MB ({v['bytes'] / base['bytes'] * 100:>5.1f}%)  "
+              f"peak {v['peak_mb']:>6.1f} MB  import {v['import_s']:>6.2f} s")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="*", default=list(SIZES))
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="results file (default: benchmarks/results/backup-<time>.json)")
+    args = ap.parse_args(argv)
+
+    runs = []
+    for n in args.sizes:
+        r = measure(n, args.seed)
+        _print_run(r)
+        runs.append(r)
+    result = {
+        "benchmark": "backup", "created": datetime.now().isoformat(timespec="seconds"), "git": _git_rev(),
+        "python": platform.python_version(), "platform": platform.platform(), "seed": args.seed, "runs": runs,
+    }
+    path = Path(args.out) if args.out else RESULTS_DIR / f"backup-{datetime.now():%Y%m%d-%H%M%S}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(result, indent=2))
+    print(f"wrote {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
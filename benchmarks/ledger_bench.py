@@ -0,0 +1,319 @@
+# benchmarks/ledger_bench.py
+# Synthetic-ledger benchmark: persistence, pages and charts at 1k/10k/100k entries.
+#
+# For each size a fresh interpreter:
+#   1. builds a realistic ledger (trips with an increasing odometer, typed
+#      expenses, earnings) through ledger.py, exactly as the app would, and
+#      seeds it in the app's partitioned layout into the SQLite stand-in (a
+#      temp file: the app's cached clients can't be reached from outside a
+#      script run, a shared file can);
+#   2. signs in through the login form with Streamlit's AppTest (bootstrap +
+#      load_data), then visits every nav page: first render and the median
+#      of a few warm reruns;
+#   3. records a trip, an expense and an earning and measures the rerun and
+#      the bytes save_data() hands to the backend for each;
+#   4. reports peak RSS and the instrument.py section timings (p50/p95).
+# Results go to a JSON file so runs can be diffed with --compare.
+#
+#   python benchmarks/ledger_bench.py                       # 1k, 10k, 100k
+#   python benchmarks/ledger_bench.py --sizes 1000 --out a.json
+#   python benchmarks/ledger_bench.py --compare before.json after.json
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+APP = ROOT / "streamlit_app.py"
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+SIZES = (1_000, 10_000, 100_000)
+PAGES = ("mileage", "expenses", "earnings", "log", "upload", "settings")
+WARM_RUNS = 3
+WRITE_WAIT = 10.0  # seconds to wait for the write-behind queue to send
+
+EMAIL, PASSWORD = "bench@example.com", "bench-pass"
+# same list as APP_KEYS in streamlit_app.py
+APP_KEYS = ["baseline", "last_mileage", "total_miles", "total_cost", "total_gallons",
+            "last_trip_summary", "log", "expenses", "earnings", "aggregates", "rollups",
+            "event_seq", "snapshot", "corrections"]
+EXPENSE_TYPES = ["Fuel", "Repair", "Certificates", "Insurance", "Trailer Rent", "IFTA", "Reefer Fuel", "Other"]
+EXPENSE_WEIGHTS = [50, 10, 2, 4, 6, 3, 20, 5]
+MIX = (("Trip", 0.6), ("Expense", 0.3), ("Income", 0.1))  # share of log entries
+ENTRIES_PER_DAY = 8
+
+
+# ------------------------- Synthetic ledgers -------------------------
+def synthetic_state(n, seed=0, end=None):
+    # -> app state dict with `n` log entries ending at `end` (default: now)
+    from columnar import ledger_table
+    from ledger import add_earning, add_expense, add_trip, build_aggregates, build_rollups
+
+    rng = random.Random(seed)
+    end = end or datetime.now().replace(microsecond=0)
+    step = timedelta(days=1) / ENTRIES_PER_DAY
+    start = end - step * n
+    baseline = 100_000.0 + rng.randint(0, 50_000)
+    state = {
+        "baseline": baseline, "last_mileage": baseline, "total_miles": 0.0, "total_cost": 0.0,
+        "total_gallons": 0.0, "last_trip_summary": {},
+        "log": ledger_table("log"), "expenses": ledger_table("expenses"), "earnings": ledger_table("earnings"),
+        "aggregates": build_aggregates([], []), "rollups": build_rollups([], []),
+    }
+    kinds, weights = zip(*MIX)
+    next_id = int(start.timestamp() * 1000)
+    expenses_total = 0.0
+    for i in range(n):
+        t = start + step * i
+        ts, day = t.strftime("%Y-%m-%d %H:%M:%S"), t.strftime("%Y-%m-%d")
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "Trip":
+            distance = round(rng.uniform(40, 650), 1)
+            gallons = round(distance / rng.uniform(5.5, 8.5), 2)
+            add_trip(state, {"timestamp": ts, "type": "Trip", "distance": distance, "gallons": gallons,
+                             "mpg": distance / gallons, "note": "Mileage + Fuel"})
+        elif kind == "Expense":
+            etype = rng.choices(EXPENSE_TYPES, EXPENSE_WEIGHTS)[0]
+            amount = round(rng.uniform(20, 900 if etype != "Insurance" else 2500), 2)
+            description = f"{etype.lower()} #{i}" if rng.random() < 0.5 else ""
+            next_id = max(next_id + 1, int(t.timestamp() * 1000))
+            expenses_total += amount
+            add_expense(state, {"id": next_id, "date": day, "type": etype, "description": description,
+                                "amount": amount},
+                        {"timestamp": ts, "type": "Expense", "amount": amount,
+                         "note": f"{etype}: {description}", "expense_id": next_id})
+        else:
+            worker, owner = round(rng.uniform(300, 1500), 2), round(rng.uniform(1500, 6000), 2)
+            net = owner - expenses_total
+            add_earning(state, {"date": day, "worker": worker, "owner": owner, "net_owner": net},
+                        {"timestamp": ts, "type": "Income", "amount": owner,
+                         "note": f"Worker ${worker:.2f}, Owner Net ${net:.2f}"})
+    return state
+
+
+def seed_user(db, uid, state):
+    # write the state the way save_data() would after a full migration; -> bytes written
+    from events import take_snapshot
+    from persistence import build_delta, mark_all_dirty
+    take_snapshot(state)
+    mark_all_dirty(state, APP_KEYS)
+    delta = build_delta(state, APP_KEYS)
+    db.child("users").child(uid).update(delta)
+    return len(json.dumps(delta, separators=(",", ":"), default=str))
+
+
+# ------------------------- One size (child process) -------------------------
+def _rss_mb():
+    # peak resident set size of this process (ru_maxrss is KiB on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _run(at):
+    start = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return elapsed
+
+
+def _click(at, label_prefix):
+    btn = next(b for b in at.button if (b.label or "").startswith(label_prefix) and not b.disabled)
+    btn.click()
+    return _run(at)
+
+
+def _nav(at, page):
+    at.session_state["nav_page_sel"] = page
+    at.session_state["page"] = page
+    return _run(at)
+
+
+class _PayloadMeter:
+    # wraps SQLiteStorage.patch (every instance, incl. the app's) to size what is sent for one uid
+    def __init__(self, uid):
+        from storage import SQLiteStorage
+        self.sizes = []
+        prefix = f"users/{uid}"
+        orig = SQLiteStorage.patch
+        sizes = self.sizes
+
+        def patch(self, path, data, token=None):
+            if str(path).strip("/").startswith(prefix):
+                sizes.append(len(json.dumps(data, separators=(",", ":"), default=str)))
+            return orig(self, path, data, token)
+        SQLiteStorage.patch = patch
+
+    def wait(self, seen):
+        deadline = time.monotonic() + WRITE_WAIT
+        while len(self.sizes) <= seen and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return sum(self.sizes[seen:]) if len(self.sizes) > seen else None
+
+
+def measure(n, seed=0):
+    workdir = Path(tempfile.mkdtemp(prefix="bl-bench-"))
+    try:
+        return _measure(n, seed, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _measure(n, seed, workdir):
+    os.environ["BL_STORAGE_BACKEND"] = "sqlite"
+    os.environ["BL_SQLITE_PATH"] = str(workdir / f"bench-{n}.db")
+    os.environ["BL_JOURNAL_DIR"] = str(workdir / "journal")
+    sys.path.insert(0, str(ROOT))
+    from streamlit.testing.v1 import AppTest
+    from storage import LocalAuth, SQLiteStorage
+
+    out = {"entries": n, "backend": "sqlite"}
+    at = AppTest.from_file(str(APP), default_timeout=600)
+    at.secrets["cookie_password"] = "bench"
+    at.session_state["allow_cookie_fallback"] = True
+    out["login_page_s"] = _run(at)
+    out["rss_app_mb"] = _rss_mb()
+
+    db = SQLiteStorage(os.environ["BL_SQLITE_PATH"])
+    uid = LocalAuth(db).create_user_with_email_and_password(EMAIL, PASSWORD)["localId"]
+    start = time.perf_counter()
+    state = synthetic_state(n, seed)
+    out["generate_s"] = time.perf_counter() - start
+    out["ledger_rows"] = {k: len(state[k]) for k in ("log", "expenses", "earnings")}
+    out["seed_bytes"] = seed_user(db, uid, state)
+    last_mileage = state["last_mileage"]
+    del state
+    out["rss_seeded_mb"] = _rss_mb()
+
+    meter = _PayloadMeter(uid)
+    at.text_input(key="login_email").set_value(EMAIL)
+    at.text_input(key="login_password").set_value(PASSWORD)
+    out["sign_in_s"] = _click(at, "Login")
+
+    pages = out["pages"] = {}
+    for page in PAGES:
+        first = _nav(at, page)
+        warm = statistics.median(_run(at) for _ in range(WARM_RUNS))
+        pages[page] = {"first_s": first, "warm_s": warm}
+
+    saves = out["saves"] = {}
+    _nav(at, "mileage")
+    seen = len(meter.sizes)
+    at.text_input[0].set_value(f"{last_mileage + 321.5:.1f}")
+    at.text_input[1].set_value("47.3")
+    _run(at)
+    saves["trip"] = {"rerun_s": _click(at, "✅"), "payload_bytes": meter.wait(seen)}
+    _nav(at, "expenses")
+    seen = len(meter.sizes)
+    at.text_input[1].set_value("123.45")
+    _run(at)
+    saves["expense"] = {"rerun_s": _click(at, "✅"), "payload_bytes": meter.wait(seen)}
+    _nav(at, "earnings")
+    seen = len(meter.sizes)
+    at.text_input[0].set_value("800")
+    at.text_input[1].set_value("3200")
+    _run(at)
+    saves["earning"] = {"rerun_s": _click(at, "✅"), "payload_bytes": meter.wait(seen)}
+
+    from instrument import METRICS
+    out["sections"] = {r["section"]: {k: r[k] for k in ("count", "p50", "p95", "max")} for r in METRICS.summary()}
+    out["rss_peak_mb"] = _rss_mb()
+    return out
+
+
+# ------------------------- Driver -------------------------
+def _child(n, seed):
+    proc = subprocess.run([sys.executable, __file__, "--child", str(n), "--seed", str(seed)],
+                          capture_output=True, text=True, cwd=str(ROOT))
+    if proc.returncode != 0:
+        tail = (proc.stderr or proc.stdout).strip().splitlines()[-3:]
+        return {"entries": n, "error": " | ".join(tail)}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=str(ROOT)).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _print_run(r):
+    if "error" in r:
+        print(f"{r['entries']:>7}  error: {r['error']}")
+        return
+    pages = "  ".join(f"{p} {v['first_s'] * 1000:.0f}/{v['warm_s'] * 1000:.0f}" for p, v in r["pages"].items())
+    saves = "  ".join(f"{k} {v['rerun_s'] * 1000:.0f} ms {v['payload_bytes'] or 0} B" for k, v in r["saves"].items())
+    print(f"{r['entries']:>7}  sign-in {r['sign_in_s'] * 1000:.0f} ms  seed {r['seed_bytes'] / 1e6:.1f} MB  "
+          f"peak RSS {r['rss_peak_mb']:.0f} MB")
+    print(f"{'':>7}  pages first/warm ms: {pages}")
+    print(f"{'':>7}  saves: {saves}")
+
+
+def _flatten(r):
+    # comparable scalar metrics of one run
+    flat = {"sign_in_s": r.get("sign_in_s"), "rss_peak_mb": r.get("rss_peak_mb")}
+    for p, v in (r.get("pages") or {}).items():
+        flat[f"{p}.first_s"], flat[f"{p}.warm_s"] = v["first_s"], v["warm_s"]
+    for k, v in (r.get("saves") or {}).items():
+        flat[f"save.{k}.rerun_s"], flat[f"save.{k}.payload_bytes"] = v["rerun_s"], v["payload_bytes"]
+    return flat
+
+
+def compare(before_path, after_path):
+    before = {r["entries"]: r for r in json.loads(Path(before_path).read_text())["runs"]}
+    after = {r["entries"]: r for r in json.loads(Path(after_path).read_text())["runs"]}
+    for n in sorted(set(before) & set(after)):
+        a, b = _flatten(before[n]), _flatten(after[n])
+        print(f"--- {n} entries")
+        for k in a:
+            if a[k] and b.get(k) is not None:
+                print(f"  {k:<28} {a[k]:>12.4g} -> {b[k]:>12.4g}  ({(b[k] / a[k] - 1) * 100:+.1f}%)")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    ap.add_argument("--sizes", type=int, nargs="*", default=list(SIZES))
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="results file (default: benchmarks/results/ledger-<time>.json)")
+    ap.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    args = ap.parse_args(argv)
+
+    if args.child is not None:
+        print(json.dumps(measure(args.child, args.seed)))
+        return 0
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    runs = []
+    for n in args.sizes:
+        r = _child(n, args.seed)
+        _print_run(r)
+        runs.append(r)
+    result = {
+        "benchmark": "ledger", "created": datetime.now().isoformat(timespec="seconds"), "git": _git_rev(),
+        "python": platform.python_version(), "platform": platform.platform(), "seed": args.seed, "runs": runs,
+    }
+    path = Path(args.out) if args.out else RESULTS_DIR / f"ledger-{datetime.now():%Y%m%d-%H%M%S}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(result, indent=2))
+    print(f"wrote {path}")
+    return 1 if any("error" in r for r in runs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+# benchmarks/startup_budget.py
+# Cold-start and warm-rerun budget for the login page and every nav page.
+#
+# Each page is measured in a fresh interpreter so "cold" really is the first
+# script run a new server process serves for it (module imports, cached
+# resources, first render). "warm" is the median of a few reruns of the same
+# page afterwards. Runs against the in-memory backend; no network needed.
+#
+#   python benchmarks/startup_budget.py             # table, exit 1 if over budget
+#   python benchmarks/startup_budget.py --json out.json
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+APP = ROOT / "streamlit_app.py"
+
+PAGES = ("login", "mileage", "expenses", "earnings", "log", "upload", "settings")
+WARM_RUNS = 5
+
+# seconds; cold includes the page's first-use imports. AppTest itself adds
+# ~0.3 s to every run, so warm budgets sit above that floor.
+BUDGETS = {
+    "login": {"cold": 2.5, "warm": 0.6},
+    "mileage": {"cold": 1.5, "warm": 0.5},
+    "expenses": {"cold": 2.5, "warm": 0.6},
+    "earnings": {"cold": 2.5, "warm": 0.6},
+    "log": {"cold": 1.5, "warm": 0.5},
+    "upload": {"cold": 1.5, "warm": 0.5},
+    "settings": {"cold": 1.5, "warm": 0.5},
+}
+
+
+def _app():
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(str(APP), default_timeout=60)
+    at.secrets["cookie_password"] = "bench"
+    at.session_state["allow_cookie_fallback"] = True
+    return at
+
+
+def _timed_run(at):
+    start = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return elapsed
+
+
+def _measure(page):
+    # runs in the child interpreter
+    os.environ["BL_STORAGE_BACKEND"] = "memory"
+    sys.path.insert(0, str(ROOT))
+    at = _app()
+    cold = _timed_run(at)
+    if page != "login":
+        at.radio[0].set_value("Register").run()
+        at.text_input[0].set_value("bench@example.com")
+        at.text_input[1].set_value("bench-pass")
+        at.text_input[2].set_value("bench-pass")
+        at.button[0].click().run()
+        at.session_state["nav_page_sel"] = page
+        at.session_state["page"] = page
+        cold = _timed_run(at)
+    warm = statistics.median(_timed_run(at) for _ in range(WARM_RUNS))
+    return {"page": page, "cold": cold, "warm": warm}
+
+
+def _child(page):
+    proc = subprocess.run([sys.executable, __file__, "--child", page], capture_output=True, text=True,
+                          cwd=str(ROOT))
+    if proc.returncode != 0:
+        return {"page": page, "error": (proc.stderr or proc.stdout).strip().splitlines()[-1:]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--pages", nargs="*", default=list(PAGES))
+    args = ap.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(_measure(args.child)))
+        return 0
+
+    results, over = [], []
+    print(f"{'page':<10} {'cold s':>8} {'budget':>7} {'warm s':>8} {'budget':>7}")
+    for page in args.pages:
+        r = _child(page)
+        r["budget"] = BUDGETS.get(page, {})
+        results.append(r)
+        if "error" in r:
+            over.append(page)
+            print(f"{page:<10} error: {r['error']}")
+            continue
+        for kind in ("cold", "warm"):
+            if r[kind] > r["budget"].get(kind, float("inf")):
+                over.append(f"{page}.{kind}")
+        print(f"{page:<10} {r['cold']:>8.3f} {r['budget'].get('cold', 0):>7.2f} "
+              f"{r['warm']:>8.3f} {r['budget'].get('warm', 0):>7.2f}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"results": results, "over_budget": over}, indent=2))
+    if over:
+        print("over budget:", ", ".join(over))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+# bootstrap.py
+# Runs independent sign-in round trips side by side on a shared thread pool.
+#
+# run_steps({"app": fn, "profile": fn, ...}) submits every step at once and
+# waits for all of them, so the wait is the slowest call rather than the sum.
+# A step that raises or times out comes back as its exception; callers decide
+# whether to retry it inline. Steps must not touch st.session_state (they run
+# outside the script thread): compute what they need first and close over it.
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+BOOTSTRAP_WORKERS = 8
+BOOTSTRAP_TIMEOUT = 20.0  # seconds for the whole batch
+
+_pool = ThreadPoolExecutor(max_workers=BOOTSTRAP_WORKERS, thread_name_prefix="bootstrap")
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    try:
+        result = fn()
+    except Exception as ex:
+        result = ex
+    return result, time.perf_counter() - start
+
+
+def run_steps(steps, timeout=BOOTSTRAP_TIMEOUT):
+    # -> ({name: result | Exception}, {name: seconds, ..., "total": seconds})
+    start = time.perf_counter()
+    deadline = start + timeout
+    futures = {name: _pool.submit(_timed, fn) for name, fn in steps.items()}
+    results, timings = {}, {}
+    for name, fut in futures.items():
+        try:
+            results[name], timings[name] = fut.result(timeout=max(0.0, deadline - time.perf_counter()))
+        except FutureTimeout as ex:
+            results[name], timings[name] = ex, None
+    timings["total"] = time.perf_counter() - start
+    return results, timings
@@ -0,0 +1,606 @@
+# columnar.py
+# Columnar storage for the log / expenses / earnings ledgers held in session state.
+#
+# A LedgerTable behaves like the list of dicts it replaces (len, indexing,
+# slicing, append, del, iteration all hand back plain dicts), but keeps one
+# typed array per field instead of one dict per record:
+#   f    float64 array        amounts, distances, gallons, mpg   (missing = NaN)
+#   i    int64 array          ids, event sequence numbers         (missing = INT_MISSING)
+#   ts   int64 epoch seconds  "YYYY-MM-DD HH:MM:SS" timestamps    (missing = INT_MISSING == NaT)
+#   d    int64 epoch seconds  "YYYY-MM-DD" dates
+#   cat  uint16 codes         record/expense types, interned per table (0 = missing)
+#   s    list of str          notes, descriptions
+# Values that don't fit their column (legacy strings in number fields, odd
+# date formats, unknown keys) are kept verbatim in a per-record `extra` dict,
+# so to_json() always returns exactly what was put in. Ints in f fields are
+# stored as floats with a per-record bit saying which ones to give back as
+# ints (ints beyond 2**53 also go to `extra`).
+#
+# column()/frame() hand pandas zero-copy views of the arrays. They are valid
+# until the next mutation; an append while a view is alive moves the table to
+# a fresh buffer instead of failing.
+#
+# Monthly partitions: `parts` lists [["YYYY-MM", count], ...] oldest first,
+# covering the whole history, but only the newest partitions need to be in
+# memory. The first `base` records (older, not yet loaded) keep their indexes;
+# touching one calls the loader and prepends its partition, so positions never
+# shift. A record goes in the partition of its own month, or the newest one if
+# that is later (records are appended in time order; this keeps partitions
+# contiguous). Iteration, to_json() and == load everything first; frame(),
+# column() and loaded_items() only look at what is loaded. Loading takes a
+# per-table lock, since a table may be shared by several sessions (shared.py);
+# copy() gives a private table for copy-on-write.
+#
+# Time index: newest(), between() and latest() answer "last N", "dated
+# between" and "newest of a type" from positions kept sorted by (date epoch,
+# id or position), overall and per record type: O(log n + k), no sort. It is
+# built on the first query; an append in time order extends it in place,
+# anything else (edits, deletes, loading an older partition) drops it until
+# the next query. Queries load older partitions only when their answer could
+# be in one.
+import bisect
+import calendar
+import threading
+import time
+from array import array
+from collections.abc import MutableSequence
+
+INT_MISSING = -2 ** 63  # also numpy's NaT for datetime64 views
+NAN = float("nan")
+
+_TS_FMT = "%Y-%m-%d %H:%M:%S"
+_DATE_FMT = "%Y-%m-%d"
+_TYPECODES = {"f": "d", "i": "q", "ts": "q", "d": "q", "cat": "H"}
+
+# field order = key order of the dicts the app writes
+LEDGER_SCHEMAS = {
+    "log": (("timestamp", "ts"), ("type", "cat"), ("distance", "f"), ("gallons", "f"), ("mpg", "f"),
+            ("amount", "f"), ("note", "s"), ("expense_id", "i"), ("seq", "i")),
+    "expenses": (("id", "i"), ("date", "d"), ("type", "cat"), ("description", "s"), ("amount", "f")),
+    "earnings": (("date", "d"), ("worker", "f"), ("owner", "f"), ("net_owner", "f")),
+}
+LEDGER_KEYS = tuple(LEDGER_SCHEMAS)
+
+_MISS = object()
+_EXACT = 2 ** 53  # larger ints don't survive float64
+
+
+def _parse_time(s, fmt):
+    # strict: only strings that format back identically are stored as epochs
+    if not isinstance(s, str):
+        return None
+    try:
+        t = time.strptime(s, fmt)
+    except ValueError:
+        return None
+    if time.strftime(fmt, t) != s:
+        return None
+    return calendar.timegm(t)
+
+
+def _format_time(epoch, fmt):
+    return time.strftime(fmt, time.gmtime(epoch))
+
+
+def _this_month():
+    return time.strftime("%Y-%m")
+
+
+def _rows(value):
+    # records from a Firebase list node: a list, a sparse {"0": .., "5": ..} dict or None
+    if isinstance(value, dict):
+        value = [value[k] for k in sorted(value, key=lambda k: int(k) if str(k).isdigit() else 0)]
+    return [r for r in (value or []) if isinstance(r, dict)]
+
+
+class LedgerTable(MutableSequence):
+    def __init__(self, kind, rows=None):
+        self.kind = kind
+        self.schema = LEDGER_SCHEMAS[kind]
+        self._cols = {}
+        self._cats = {}     # field -> [None, "Fuel", ...] (code -> value)
+        self._codes = {}    # field -> {"Fuel": 1, ...}
+        for name, ftype in self.schema:
+            if ftype == "s":
+                self._cols[name] = []
+            else:
+                self._cols[name] = array(_TYPECODES[ftype])
+            if ftype == "cat":
+                self._cats[name] = [None]
+                self._codes[name] = {}
+        self._extra = []    # per record: None or {key: raw value}
+        self._ints = array("H")  # per record: bit k set = field k (an f field) was an int
+        self._n = 0         # records in memory
+        self._date = next(n for n, t in self.schema if t in ("ts", "d"))
+        self.parts = []     # [[month, count], ...] oldest first, loaded or not
+        self._unloaded = 0  # leading entries of `parts` not in memory
+        self.base = 0       # records in those partitions
+        self._loader = None
+        self._load_lock = threading.RLock()
+        self.last_delete = None  # (start, stop) of records moved by the last delete
+        self._order = None  # time index: (all positions, {type code: positions}), or None = stale
+        for r in rows or []:
+            self.append(r)
+
+    @classmethod
+    def from_parts(cls, kind, counts, loaded, loader=None):
+        # counts: [(month, n), ...] for every partition; loaded: {month: rows} for the newest ones
+        t = cls(kind)
+        t._loader = loader
+        months = [mk for mk, _ in sorted(counts)]
+        n_counts = dict(counts)
+        first = len(months)
+        while first and months[first - 1] in loaded:
+            first -= 1
+        for mk in months[:first]:
+            t.parts.append([mk, int(n_counts[mk] or 0)])
+        t._unloaded = first
+        t.base = sum(n for _, n in t.parts)
+        for mk in months[first:]:
+            rows = _rows(loaded.get(mk))
+            t.parts.append([mk, len(rows)])
+            t._extend(rows)
+        return t
+
+    def attach(self, loader):
+        # loader(kind, month) -> rows of that partition (list, {"0": ..} dict or None)
+        self._loader = loader
+
+    def copy(self):
+        # independent table (same loader); arrays and lists are copied, records are immutable values
+        with self._load_lock:
+            t = object.__new__(type(self))
+            t.__dict__.update(self.__dict__)
+            t._cols = {name: col[:] for name, col in self._cols.items()}
+            t._cats = {name: list(v) for name, v in self._cats.items()}
+            t._codes = {name: dict(v) for name, v in self._codes.items()}
+            t._extra = list(self._extra)
+            t._ints = self._ints[:]
+            t.parts = [list(p) for p in self.parts]
+            t._order = None
+            t._load_lock = threading.RLock()
+            return t
+
+    # ---- encoding ----
+    def _encode(self, name, ftype, v, extra):
+        # -> stored value; anything that doesn't fit goes to `extra`
+        if v is _MISS:
+            if ftype == "f":
+                return NAN
+            if ftype == "cat":
+                return 0
+            if ftype == "s":
+                return _MISS
+            return INT_MISSING
+        if ftype == "f":
+            if isinstance(v, (int, float)) and not isinstance(v, bool) and v == v:
+                if isinstance(v, int) and not -_EXACT <= v <= _EXACT:
+                    extra[name] = v
+                return float(v)
+            extra[name] = v
+            return NAN
+        if ftype == "i":
+            if isinstance(v, int) and not isinstance(v, bool) and INT_MISSING < v < 2 ** 63:
+                return v
+            extra[name] = v
+            return INT_MISSING
+        if ftype in ("ts", "d"):
+            e = _parse_time(v, _TS_FMT if ftype == "ts" else _DATE_FMT)
+            if e is None:
+                extra[name] = v
+                return INT_MISSING
+            return e
+        if ftype == "cat":
+            if isinstance(v, str):
+                code = self._codes[name].get(v)
+                if code is None:
+                    code = len(self._cats[name])
+                    self._cats[name].append(v)
+                    self._codes[name][v] = code
+                return code
+            extra[name] = v
+            return 0
+        # "s"
+        if isinstance(v, str):
+            return v
+        extra[name] = v
+        return _MISS
+
+    def _encode_row(self, row):
+        # -> (column values, extra or None, int bits)
+        extra = {}
+        vals = []
+        ints = 0
+        for k, (name, ftype) in enumerate(self.schema):
+            v = row.get(name, _MISS)
+            if ftype == "f" and type(v) is int:
+                ints |= 1 << k
+            vals.append(self._encode(name, ftype, v, extra))
+        known = self._cols.keys()
+        for k, v in row.items():
+            if k not in known:
+                extra[k] = v
+        return vals, (extra or None), ints
+
+    def _month_of(self, vals, extra):
+        e = vals[[n for n, _ in self.schema].index(self._date)]
+        if e != INT_MISSING:
+            return _format_time(e, "%Y-%m")
+        raw = extra.get(self._date) if extra else None
+        if isinstance(raw, str) and len(raw) >= 7 and raw[4] == "-" and raw[:4].isdigit() and raw[5:7].isdigit():
+            return raw[:7]
+        return None
+
+    def _decode(self, i):
+        # i = position in memory (index - base)
+        out = {}
+        extra = self._extra[i] or {}
+        ints = self._ints[i]
+        for k, (name, ftype) in enumerate(self.schema):
+            if name in extra:
+                out[name] = extra[name]
+                continue
+            v = self._cols[name][i]
+            if ftype == "f":
+                if v == v:
+                    out[name] = int(v) if ints >> k & 1 else v
+            elif ftype == "i":
+                if v != INT_MISSING:
+                    out[name] = v
+            elif ftype in ("ts", "d"):
+                if v != INT_MISSING:
+                    out[name] = _format_time(v, _TS_FMT if ftype == "ts" else _DATE_FMT)
+            elif ftype == "cat":
+                if v:
+                    out[name] = self._cats[name][v]
+            elif v is not _MISS:
+                out[name] = v
+        for k, v in extra.items():
+            if k not in out:
+                out[k] = v
+        return out
+
+    # ---- MutableSequence ----
+    def __len__(self):
+        return self.base + self._n
+
+    def _index(self, i):
+        # index -> position in memory, loading older partitions if needed
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("ledger index out of range")
+        if i < self.base:
+            self._load_back(i)
+        return i - self.base
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._decode(self._index(j)) for j in range(*i.indices(len(self)))]
+        return self._decode(self._index(i))
+
+    def __setitem__(self, i, row):
+        if isinstance(i, slice):
+            raise TypeError("slice assignment is not supported")
+        p = self._index(i)
+        before = self._placement(p)
+        vals, extra, ints = self._encode_row(row)
+        for (name, _), v in zip(self.schema, vals):
+            self._cols[name][p] = v
+        self._extra[p] = extra
+        self._ints[p] = ints
+        if self._placement(p) != before:
+            self._order = None
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            for j in sorted(range(*i.indices(len(self))), reverse=True):
+                del self[j]
+            return
+        p = self._index(i)
+        i = p + self.base
+        for name, _ in self.schema:
+            self._resize(name, lambda col: col.pop(p))
+        del self._extra[p]
+        del self._ints[p]
+        self._n -= 1
+        self._order = None
+        k, start = self._part_at(i)
+        self.parts[k][1] -= 1
+        # records i.. of the same partition moved down one slot
+        self.last_delete = (i, start + self.parts[k][1])
+        if not self.parts[k][1]:
+            del self.parts[k]
+
+    def insert(self, i, row):
+        n = len(self)
+        i = max(self.base, min(n, i + n if i < 0 else i))
+        vals, extra, ints = self._encode_row(row)
+        p = i - self.base
+        for (name, _), v in zip(self.schema, vals):
+            if p == self._n:
+                self._resize(name, lambda col, v=v: col.append(v))
+            else:
+                self._resize(name, lambda col, v=v: col.insert(p, v))
+        self._extra.insert(p, extra)
+        self._ints.insert(p, ints)
+        self._n += 1
+        if i == n:
+            self._index_add(p)
+            newest = self.parts[-1][0] if self.parts else None
+            mk = self._month_of(vals, extra) or newest or _this_month()
+            if newest is None or mk > newest:
+                self.parts.append([mk, 1])
+            else:
+                self.parts[-1][1] += 1
+        else:
+            self.parts[self._part_at(i)[0]][1] += 1
+            self._order = None
+
+    def __iter__(self):
+        self.load_all()
+        for p in range(self._n):
+            yield self._decode(p)
+
+    def _resize(self, name, op):
+        col = self._cols[name]
+        try:
+            op(col)
+        except BufferError:
+            # a column() view still holds this buffer; leave it to the view
+            col = self._cols[name] = array(col.typecode, col)
+            op(col)
+
+    def __eq__(self, other):
+        if isinstance(other, LedgerTable):
+            return self.kind == other.kind and self.to_json() == other.to_json()
+        if isinstance(other, list):
+            return self.to_json() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"LedgerTable({self.kind!r}, {len(self)} records, {self.base} not loaded)"
+
+    # ---- partitions ----
+    def _part_at(self, i):
+        # (position in parts, first index) of the partition holding index i
+        start = 0
+        for k, (_, n) in enumerate(self.parts):
+            if i < start + n:
+                return k, start
+            start += n
+        return len(self.parts) - 1, start - (self.parts[-1][1] if self.parts else 0)
+
+    def locate(self, i):
+        # index -> (month, slot inside that month's partition)
+        k, start = self._part_at(i)
+        return self.parts[k][0], i - start
+
+    def month_start(self, mk):
+        # index of the first record in a partition of month >= mk (no loading)
+        start = 0
+        for m, n in self.parts:
+            if m >= mk:
+                return start
+            start += n
+        return start
+
+    def partition_rows(self, mk):
+        start = 0
+        for m, n in self.parts:
+            if m == mk:
+                return self[start:start + n]
+            start += n
+        return []
+
+    @property
+    def loaded_len(self):
+        return self._n
+
+    def loaded_items(self):
+        # (index, record) for what is in memory, oldest first; never loads
+        for p in range(self._n):
+            yield self.base + p, self._decode(p)
+
+    def _load_back(self, i):
+        with self._load_lock:
+            while self._unloaded and self.base > i:
+                self._load_one()
+
+    def load_all(self):
+        with self._load_lock:
+            while self._unloaded:
+                self._load_one()
+
+    def load_recent(self, min_rows):
+        # make sure at least `min_rows` of the newest records are in memory
+        with self._load_lock:
+            while self._unloaded and self._n < min_rows:
+                self._load_one()
+
+    def _load_one(self):
+        k = self._unloaded - 1
+        mk, expected = self.parts[k]
+        rows = _rows(self._loader(self.kind, mk) if self._loader else None)
+        # counts are written in the same update() as the records, so they agree;
+        # if they don't, the partition takes what is actually there
+        self.parts[k][1] = len(rows)
+        self._unloaded = k
+        self.base -= expected
+        self._prepend(rows)
+
+    def _extend(self, rows):
+        # rows already counted in `parts`
+        for r in rows:
+            vals, extra, ints = self._encode_row(r)
+            for (name, _), v in zip(self.schema, vals):
+                self._resize(name, lambda col, v=v: col.append(v))
+            self._extra.append(extra)
+            self._ints.append(ints)
+            self._n += 1
+
+    def _prepend(self, rows):
+        enc = [self._encode_row(r) for r in rows]
+        for c, (name, ftype) in enumerate(self.schema):
+            vals = [e[0][c] for e in enc]
+            col = self._cols[name]
+            self._cols[name] = (vals + col) if ftype == "s" else (array(col.typecode, vals) + col)
+        self._extra[:0] = [e[1] for e in enc]
+        self._ints = array("H", [e[2] for e in enc]) + self._ints
+        self._n += len(rows)
+        self._order = None
+
+    # ---- time index ----
+    def _tkey(self, p):
+        return self._cols[self._date][p], (self._cols["id"][p] if "id" in self._cols else p)
+
+    def _placement(self, p):
+        # what decides where record p sits in the time index
+        return self._tkey(p), (self._cols["type"][p] if "type" in self._codes else None)
+
+    def _time_index(self):
+        with self._load_lock:
+            if self._order is None:
+                order = array("q", sorted(range(self._n), key=self._tkey))
+                by_type = {}
+                if "type" in self._codes:
+                    types = self._cols["type"]
+                    for p in order:
+                        by_type.setdefault(types[p], array("q")).append(p)
+                self._order = (order, by_type)
+            return self._order
+
+    def _index_add(self, p):
+        # record p was just appended
+        if self._order is None:
+            return
+        order, by_type = self._order
+        key = self._tkey(p)
+        arrs = [order]
+        if "type" in self._codes:
+            arrs.append(by_type.setdefault(self._cols["type"][p], array("q")))
+        for arr in arrs:
+            if not arr or self._tkey(arr[-1]) <= key:
+                arr.append(p)
+            else:
+                bisect.insort(arr, p, key=self._tkey)  # back-dated
+
+    def _typed(self, of_type):
+        order, by_type = self._time_index()
+        if of_type is None:
+            return order
+        code = self._codes.get("type", {}).get(of_type)
+        return by_type.get(code) or array("q")
+
+    def _unloaded_before(self):
+        # epoch every record in an unloaded partition is older than
+        mk = self.parts[self._unloaded - 1][0]
+        y, m = int(mk[:4]), int(mk[5:7])
+        return calendar.timegm((y + m // 12, m % 12 + 1, 1, 0, 0, 0))
+
+    def _epoch(self, day, end=False):
+        # "YYYY-MM-DD" or a full timestamp; end=True: the last second of that day
+        e = _parse_time(day, _TS_FMT)
+        if e is None:
+            e = _parse_time(str(day)[:10], _DATE_FMT)
+            if e is None:
+                raise ValueError(f"not a date: {day!r}")
+            if end:
+                e += 86399
+        return e
+
+    def newest(self, n, of_type=None):
+        # indexes of the `n` newest records (of one type), newest first
+        with self._load_lock:
+            while True:
+                arr = self._typed(of_type)
+                picked = arr[max(0, len(arr) - n):] if n > 0 else arr[:0]
+                if not self._unloaded or (n > 0 and len(picked) == n
+                                          and self._cols[self._date][picked[0]] >= self._unloaded_before()):
+                    return [self.base + p for p in reversed(picked)]
+                self._load_one()
+
+    def latest(self, of_type=None):
+        # index of the newest record (of one type), or None
+        found = self.newest(1, of_type)
+        return found[0] if found else None
+
+    def between(self, start=None, end=None, of_type=None):
+        # indexes of records dated start..end (inclusive; None = open), newest first
+        with self._load_lock:
+            if start is None:
+                self.load_all()
+            else:
+                self._load_back(self.month_start(str(start)[:7]))  # later months can hold older dates, not earlier ones
+            arr = self._typed(of_type)
+            col = self._cols[self._date]
+            lo = 0 if start is None else bisect.bisect_left(arr, self._epoch(start), key=col.__getitem__)
+            hi = len(arr) if end is None else bisect.bisect_right(arr, self._epoch(end, True), key=col.__getitem__)
+            return [self.base + p for p in reversed(arr[lo:hi])]
+
+    # ---- conversion ----
+    def to_json(self):
+        # the list-of-dicts shape used in backups
+        self.load_all()
+        return [self._decode(p) for p in range(self._n)]
+
+    def value(self, i, name, default=None):
+        # one field without building the whole record dict
+        p = self._index(i)
+        rec_extra = self._extra[p]
+        if rec_extra and name in rec_extra:
+            return rec_extra[name]
+        if name not in self._cols:
+            return default
+        k = [n for n, _ in self.schema].index(name)
+        ftype = self.schema[k][1]
+        v = self._cols[name][p]
+        if ftype == "f":
+            if v != v:
+                return default
+            return int(v) if self._ints[p] >> k & 1 else v
+        if ftype == "i":
+            return default if v == INT_MISSING else v
+        if ftype in ("ts", "d"):
+            return default if v == INT_MISSING else _format_time(v, _TS_FMT if ftype == "ts" else _DATE_FMT)
+        if ftype == "cat":
+            return self._cats[name][v] if v else default
+        return default if v is _MISS else v
+
+    # ---- zero-copy views ----
+    def column(self, name):
+        import numpy as np
+        import pandas as pd
+
+        ftype = dict(self.schema)[name]
+        col = self._cols[name]
+        if ftype == "f":
+            return np.frombuffer(col, dtype=np.float64) if len(col) else np.empty(0, dtype=np.float64)
+        if ftype == "i":
+            return np.frombuffer(col, dtype=np.int64) if len(col) else np.empty(0, dtype=np.int64)
+        if ftype in ("ts", "d"):
+            raw = np.frombuffer(col, dtype=np.int64) if len(col) else np.empty(0, dtype=np.int64)
+            return raw.view("datetime64[s]")
+        if ftype == "cat":
+            codes = np.frombuffer(col, dtype=np.uint16) if len(col) else np.empty(0, dtype=np.uint16)
+            return pd.Categorical.from_codes(codes.astype(np.int32) - 1, categories=self._cats[name][1:])
+        return [None if v is _MISS else v for v in col]
+
+    def frame(self, names=None):
+        import pandas as pd
+
+        names = list(names or self._cols)
+        return pd.DataFrame({n: self.column(n) for n in names}, copy=False)
+
+
+def ledger_table(kind, rows=None):
+    # session-state value for one of LEDGER_KEYS, from a list (or Firebase's None)
+    if isinstance(rows, LedgerTable):
+        return rows
+    return LedgerTable(kind, _rows(rows))
+
+
+def to_plain(v):
+    # JSON-ready value: tables become lists of dicts, everything else passes through
+    return v.to_json() if isinstance(v, LedgerTable) else v
@@ -0,0 +1,207 @@
+# doccache.py
+# Server-side read-through cache of each user's documents, stamped with the
+# user's version node.
+#
+# Every queued write also sets /users/<uid>/version to a fresh stamp (see
+# sync.py). A reload reads that one small node first: if it matches the stamp
+# the cached docs were read under, "app" and the monthly partitions come from
+# here instead of the network; if not, the entry is emptied and refilled as
+# docs are fetched again. Docs are only ever stored under a stamp read
+# *before* they were fetched, so a cached doc is never older than its stamp.
+#
+# This process's own queued writes are applied to the cached docs when they
+# are submitted. When the writer sends them it reads the version node first
+# and reports (before, after); the entry moves on to `after` only if `before`
+# is the stamp it holds, i.e. nobody else wrote in between. Otherwise it is
+# dropped. Users are evicted least-recently-used past DOC_CACHE_USERS or
+# DOC_CACHE_BYTES (approximate JSON size, kept per written path so that a
+# replaced doc gives back the size of what it replaced).
+#
+# The stamps this process sends are remembered (own()), so a database stream
+# (livesync.py) can tell the echo of its own write from someone else's, and
+# apply() a foreign write together with its stamp. Every write also sets
+# the small /users/<uid>/changed node (stamp()): its stamp and the paths it
+# wrote, or no paths when there are too many or they don't matter (a reset,
+# an import switch); that node is all the stream follows. stale() serves
+# reads from the cache as is while the database is down.
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+
+from storage import MemoryStorage
+
+VERSION_KEY = "version"            # /users/<uid>/version
+CHANGED_KEY = "changed"            # /users/<uid>/changed: {"version": .., "paths": [..]} of the last write
+CHANGED_MAX_PATHS = 64             # a write touching more paths is announced without them
+DOC_CACHE_USERS = 64
+DOC_CACHE_BYTES = 256 * 1024 * 1024
+OWN_STAMPS = 64                    # recent stamps remembered per uid
+
+MISS = object()
+
+
+def new_version():
+    # sortable enough to eyeball, unique enough to never repeat
+    return f"{time.time_ns():x}-{secrets.token_hex(4)}"
+
+
+def stamp(version, paths=None):
+    # the stamp fields of a multi-path write to /users/<uid> that changed `paths`
+    changed = {"version": version}
+    paths = sorted(p for p in (paths or ()) if p not in (VERSION_KEY, CHANGED_KEY))
+    if paths and len(paths) <= CHANGED_MAX_PATHS:
+        changed["paths"] = paths
+    return {VERSION_KEY: version, CHANGED_KEY: changed}
+
+
+def _size(value):
+    try:
+        return len(json.dumps(value, separators=(",", ":"), default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class _Entry:
+    def __init__(self, version):
+        self.version = version
+        self.docs = MemoryStorage()  # Firebase JSON semantics for reads and patches
+        self.known = set()           # doc paths held in full ("app", "parts/2024-05", "parts/2024-04/log")
+        self.sizes = {}              # written path -> approximate size
+        self.bytes = 0
+
+    def covers(self, path):
+        return any(path == k or path.startswith(k + "/") for k in self.known)
+
+    def touches(self, path):
+        return self.covers(path) or any(k.startswith(path + "/") for k in self.known)
+
+
+class DocCache:
+    def __init__(self, max_users=DOC_CACHE_USERS, max_bytes=DOC_CACHE_BYTES):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._users = OrderedDict()  # uid -> _Entry, least recently used first
+        self._bytes = 0
+        self._own = {}  # uid -> recent stamps this process wrote
+        self.hits = 0
+        self.misses = 0
+
+    def check(self, uid, version):
+        # call with the version node just read: a different stamp empties the entry
+        with self._lock:
+            e = self._users.get(uid)
+            if e is None or e.version != version:
+                self._drop(uid)
+                e = self._users[uid] = _Entry(version)
+            self._users.move_to_end(uid)
+
+    def current(self, uid):
+        # the stamp the cached docs are at (MISS if nothing is cached)
+        with self._lock:
+            e = self._users.get(uid)
+            return MISS if e is None else e.version
+
+    def get(self, uid, path):
+        # a private copy of the doc at `path`, or MISS
+        with self._lock:
+            e = self._users.get(uid)
+            if e is None or not e.covers(path):
+                self.misses += 1
+                return MISS
+            self._users.move_to_end(uid)
+            self.hits += 1
+            return e.docs.read(path)
+
+    def put(self, uid, path, value, version):
+        # `value` was fetched after `version` was read; ignored if the entry moved on
+        size = _size(value)
+        with self._lock:
+            e = self._users.get(uid)
+            if e is None or e.version != version:
+                return
+            e.docs.write(path, value)
+            e.known.add(path)
+            self._resize(e, path, size)
+            self._evict(keep=uid)
+
+    def apply(self, uid, delta, version=None):
+        # a multi-path write (paths relative to /users/<uid>): this process's own
+        # when it is queued, or someone else's as it arrives with its new stamp
+        with self._lock:
+            e = self._users.get(uid)
+            if e is None:
+                return
+            for path, value in delta.items():
+                if e.touches(path):
+                    e.docs.write(path, value)
+                    self._resize(e, path, 0 if value is None else _size(value))
+            if version is not None:
+                e.version = version
+            self._evict(keep=uid)
+
+    def stale(self, path, shallow=False):
+        # a read of /users/<uid>/... answered from whatever is cached, whatever
+        # its stamp; only while the database is unreachable (resilient.py)
+        parts = [p for p in str(path).split("/") if p]
+        if shallow or len(parts) < 3 or parts[0] != "users":
+            return MISS
+        uid, rel = parts[1], "/".join(parts[2:])
+        if rel == VERSION_KEY:
+            return self.current(uid)
+        return self.get(uid, rel)
+
+    def own(self, uid, version):
+        # the writer is about to send `version`
+        with self._lock:
+            self._own.setdefault(uid, deque(maxlen=OWN_STAMPS)).append(version)
+
+    def is_own(self, uid, version):
+        with self._lock:
+            return version in self._own.get(uid, ())
+
+    def committed(self, uid, before, after):
+        # the writer saw `before` on the server right before writing `after`
+        with self._lock:
+            e = self._users.get(uid)
+            if e is None:
+                return
+            if e.version == before:
+                e.version = after
+            else:
+                self._drop(uid)
+
+    def drop(self, uid):
+        with self._lock:
+            self._drop(uid)
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._users), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+    # -- callers hold self._lock --
+    def _resize(self, e, path, size):
+        # `path` and everything under it was just replaced by a value of `size`
+        old = [k for k in e.sizes if k == path or k.startswith(path + "/")]
+        freed = sum(e.sizes.pop(k) for k in old)
+        if size:
+            e.sizes[path] = size
+        e.bytes += size - freed
+        self._bytes += size - freed
+
+    def _drop(self, uid):
+        e = self._users.pop(uid, None)
+        if e is not None:
+            self._bytes -= e.bytes
+
+    def _evict(self, keep):
+        while self._users and (len(self._users) > self.max_users or self._bytes > self.max_bytes):
+            uid = next(iter(self._users))
+            if uid == keep:
+                if len(self._users) == 1:
+                    break
+                self._users.move_to_end(uid)
+                continue
+            self._drop(uid)
@@ -0,0 +1,160 @@
+# events.py
+# The log as a versioned event stream, with the trip totals derived from it
+# saved as periodic snapshots instead of with every change.
+#
+# Every record appended to the log is stamped with the next sequence number
+# ("seq"; the last one handed out is the app key "event_seq"). The derived
+# keys (total_miles, total_gallons, last_mileage, last_trip_summary) stay in
+# session state as before, but are only written when a snapshot is taken:
+#   /app/snapshot     {"seq": n, <derived keys>}  their values once events 1..n are applied
+#   /app/corrections  [{"seq", "target", "at", "distance", "gallons", "removed"}, ...]
+#                     compensating events: an edit or delete of a trip the
+#                     snapshot already counts, as the change it made
+# A trip added, edited or deleted after the snapshot needs no correction:
+# replaying its record as it is now (or not at all) covers it.
+#
+# restore() (load_data) = the snapshot + the log records with a higher seq,
+# which are the last ones in the log (newest partitions) + the corrections.
+# save_data() takes a new snapshot (maybe_snapshot) once SNAPSHOT_EVERY
+# events came after the last one; that also empties the corrections, so what
+# is replayed and what is written both grow with recent activity only.
+#
+# Data saved before snapshots existed has none: its persisted derived keys are
+# the snapshot at seq 0, and log records without a seq are already in it.
+from persistence import before_write, mark_dirty, mark_record
+
+EVENT_SEQ = "event_seq"
+SNAPSHOT = "snapshot"
+CORRECTIONS = "corrections"
+EVENT_KEYS = (EVENT_SEQ, SNAPSHOT, CORRECTIONS)
+DERIVED_KEYS = ("total_miles", "total_gallons", "last_mileage", "last_trip_summary")
+SNAPSHOT_EVERY = 200  # events (log records + corrections) between snapshots
+
+
+def _num(v):
+    try:
+        return float(v or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _snapshot(state):
+    snap = state.get(SNAPSHOT)
+    return snap if isinstance(snap, dict) and "seq" in snap else None
+
+
+def _next_seq(state):
+    seq = int(state.get(EVENT_SEQ) or 0) + 1
+    state[EVENT_SEQ] = seq
+    mark_dirty(state, EVENT_SEQ)
+    return seq
+
+
+def _seq(log, i):
+    v = log.value(i, "seq") if hasattr(log, "value") else log[i].get("seq")
+    return v or 0
+
+
+def _same_trip(c, trip):
+    # trips are told apart by seq; older records without one by timestamp
+    if trip.get("seq") is not None:
+        return c.get("target") == trip["seq"]
+    return c.get("target") is None and c.get("at") == trip.get("timestamp")
+
+
+def stamp(state, entry):
+    # give a record about to be appended to the log its sequence number
+    entry["seq"] = _next_seq(state)
+    return entry
+
+
+def latest_trip(log):
+    # newest Trip record, walking back from the end; -> dict or {}
+    for i in range(len(log) - 1, -1, -1):
+        rec_type = log.value(i, "type") if hasattr(log, "value") else log[i].get("type")
+        if rec_type == "Trip":
+            return log[i]
+    return {}
+
+
+def correct(state, old, new=None):
+    # compensating event for an edit (`new`) or delete (no `new`) of log record `old`
+    if old.get("type") != "Trip":
+        return
+    snap = _snapshot(state)
+    if old.get("seq") and old["seq"] > (snap["seq"] if snap else 0):
+        return  # not in the snapshot yet: restore() replays the record as it is
+    before_write(state)
+    new = new or {}
+    c = {"seq": _next_seq(state), "target": old.get("seq"), "at": old.get("timestamp"),
+         "distance": _num(new.get("distance")) - _num(old.get("distance")),
+         "gallons": _num(new.get("gallons")) - _num(old.get("gallons")),
+         "removed": not new}
+    corrections = state.get(CORRECTIONS)
+    if not isinstance(corrections, list):
+        corrections = state[CORRECTIONS] = []
+    corrections.append(c)
+    mark_record(state, CORRECTIONS, len(corrections) - 1)
+
+
+def take_snapshot(state):
+    # the derived keys as they are now become the snapshot; older corrections are folded in
+    state[SNAPSHOT] = {"seq": int(state.get(EVENT_SEQ) or 0),
+                       **{k: state.get(k) for k in DERIVED_KEYS}}
+    state[CORRECTIONS] = []
+    mark_dirty(state, SNAPSHOT, CORRECTIONS, *DERIVED_KEYS)
+
+
+def maybe_snapshot(state):
+    # save_data(): snapshot when there is none yet or enough events piled up after it
+    snap = _snapshot(state)
+    if snap is not None and int(state.get(EVENT_SEQ) or 0) - snap["seq"] < SNAPSHOT_EVERY:
+        return False
+    take_snapshot(state)
+    return True
+
+
+def rebase(state):
+    # the ledger was replaced wholesale (backup import, reset): carry on numbering
+    # after whatever seqs it holds and snapshot it as it is
+    top = max((e.get("seq") or 0 for e in state.get("log") or []), default=0)
+    state[EVENT_SEQ] = max(int(state.get(EVENT_SEQ) or 0), top)
+    take_snapshot(state)
+
+
+def restore(state):
+    # the derived keys from the snapshot + the events after it (load_data)
+    snap = _snapshot(state) or {"seq": 0, **{k: state.get(k) for k in DERIVED_KEYS}}
+    miles, gallons = _num(snap.get("total_miles")), _num(snap.get("total_gallons"))
+    mileage = snap.get("last_mileage")
+    last = snap.get("last_trip_summary") or {}
+    log = state["log"]
+    # the records after the snapshot are the newest ones
+    start = len(log)
+    while start > 0 and _seq(log, start - 1) > snap["seq"]:
+        start -= 1
+    replayed = False
+    for i in range(start, len(log)):
+        e = log[i]
+        if e.get("type") != "Trip":
+            continue
+        miles += _num(e.get("distance"))
+        gallons += _num(e.get("gallons"))
+        if mileage is not None:
+            mileage = _num(mileage) + _num(e.get("distance"))
+        last, replayed = e, True
+    stale_last = False
+    for c in state.get(CORRECTIONS) or []:
+        if not isinstance(c, dict) or (c.get("seq") or 0) <= snap["seq"] or (c.get("target") or 0) > snap["seq"]:
+            continue
+        miles += _num(c.get("distance"))
+        gallons += _num(c.get("gallons"))
+        if mileage is not None:
+            mileage = _num(mileage) + _num(c.get("distance"))
+        stale_last = stale_last or (not replayed and bool(last) and _same_trip(c, last))
+    if stale_last:
+        last = latest_trip(log)  # the snapshot's last trip was edited or deleted since
+    if mileage is None and state.get("baseline") is not None:
+        mileage = _num(state["baseline"]) + miles
+    state["total_miles"], state["total_gallons"] = miles, gallons
+    state["last_mileage"], state["last_trip_summary"] = mileage, last
@@ -1,6 +1,22 @@
 # firebase_config.py
+import os
+
 import streamlit as st
 import pyrebase
+from requests.adapters import HTTPAdapter
+
+from storage import FirebaseStorage, LocalAuth, MemoryStorage, SQLiteStorage
+
+STORAGE_BACKENDS = ("firebase", "sqlite", "memory")
+SOCKET_TIMEOUT = (5, 30)  # seconds to connect / between bytes on database requests
+
+
+class _TimeoutAdapter(HTTPAdapter):
+    # pyrebase sends without a timeout; a dead connection would hang its thread forever
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = SOCKET_TIMEOUT
+        return super().send(request, **kwargs)
 
 @st.cache_resource
 def get_firebase_clients():
@@ -26,11 +42,32 @@ def get_firebase_clients():
         "appId": st.secrets["FIREBASE_APP_ID"],
     }
     app = pyrebase.initialize_app(cfg)
+    for scheme in ("http://", "https://"):
+        app.requests.mount(scheme, _TimeoutAdapter())
     # return in (auth, db, app) order if you prefer
     return app, app.auth(), app.database()
 
 
+def get_storage_backend_name() -> str:
+    # BL_STORAGE_BACKEND (env) wins over STORAGE_BACKEND (secrets); default is Firebase
+    name = os.environ.get("BL_STORAGE_BACKEND") or st.secrets.get("STORAGE_BACKEND", "firebase")
+    name = str(name).strip().lower()
+    if name not in STORAGE_BACKENDS:
+        raise RuntimeError(f"Unknown STORAGE_BACKEND '{name}'. Use one of: " + ", ".join(STORAGE_BACKENDS))
+    return name
 
 
-
-
+@st.cache_resource
+def get_storage_clients():
+    # Same (app, auth, db) shape as get_firebase_clients(); `db` is a storage.StorageBackend.
+    # The sqlite/memory engines come with a local auth stand-in and need no network.
+    name = get_storage_backend_name()
+    if name == "firebase":
+        app, auth, db = get_firebase_clients()
+        return app, auth, FirebaseStorage(db)
+    if name == "sqlite":
+        path = os.environ.get("BL_SQLITE_PATH") or st.secrets.get("SQLITE_PATH", "balls_logistics.db")
+        db = SQLiteStorage(path)
+    else:
+        db = MemoryStorage()
+    return None, LocalAuth(db), db
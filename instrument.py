@@ -0,0 +1,203 @@
+# instrument.py
+# Wall-clock timings for named sections of a rerun, shared by every session.
+#
+# timed("load_data") is a context manager (and a decorator); begin(name)
+# returns a done() callback for sections that span a whole script run and may
+# be cut short by st.stop()/st.rerun() (an interrupted section records
+# nothing). Each section keeps its last SECTION_WINDOW samples for p50/p95
+# plus lifetime count/sum and a latency histogram (HISTOGRAM_BUCKETS), which
+# is what the Prometheus text file exports.
+#
+# start_profile()/finish_profile() wrap one rerun in cProfile. Only one
+# capture runs at a time per process; a capture that was never finished
+# (script interrupted, tab closed) is abandoned after PROFILE_STALE_AFTER.
+import bisect
+import cProfile
+import io
+import itertools
+import math
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+SECTION_WINDOW = 512          # recent samples per section used for percentiles
+TEXTFILE_INTERVAL = 15.0      # seconds between Prometheus text file writes
+PROFILE_STALE_AFTER = 120.0   # seconds before an unfinished capture can be replaced
+PROFILE_TOP = 30              # rows in the cProfile report
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds, upper bounds
+
+
+def _percentile(ordered, q):
+    # nearest-rank on an already sorted list
+    if not ordered:
+        return None
+    k = max(0, min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1))
+    return ordered[k]
+
+
+class _Section:
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS) + 1)  # last one is +Inf; not cumulative
+
+
+class Metrics:
+    def __init__(self, window=SECTION_WINDOW):
+        self.window = window
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._sections = {}
+        self._written_at = 0.0
+
+    def record(self, name, seconds):
+        with self._lock:
+            s = self._sections.get(name)
+            if s is None:
+                s = self._sections[name] = _Section(self.window)
+            s.samples.append(seconds)
+            s.count += 1
+            s.total += seconds
+            s.buckets[bisect.bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+
+    @contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def begin(self, name):
+        start = time.perf_counter()
+        state = {"done": False}
+
+        def done():
+            if not state["done"]:
+                state["done"] = True
+                self.record(name, time.perf_counter() - start)
+        return done
+
+    def summary(self):
+        # [{"section", "count", "p50", "p95", "max", "total"}], slowest total first
+        with self._lock:
+            snap = [(name, sorted(s.samples), s.count, s.total) for name, s in self._sections.items()]
+        rows = [{
+            "section": name, "count": count,
+            "p50": _percentile(ordered, 0.50), "p95": _percentile(ordered, 0.95),
+            "max": ordered[-1] if ordered else None, "total": total,
+        } for name, ordered, count, total in snap]
+        rows.sort(key=lambda r: r["total"], reverse=True)
+        return rows
+
+    def percentile(self, name, q):
+        # one section's recent percentile, None without samples
+        with self._lock:
+            s = self._sections.get(name)
+            ordered = sorted(s.samples) if s is not None else []
+        return _percentile(ordered, q)
+
+    def histogram(self, name):
+        # [(upper bound in seconds or inf, cumulative count)] for one section
+        with self._lock:
+            s = self._sections.get(name)
+            counts = list(s.buckets) if s is not None else [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        return list(zip((*HISTOGRAM_BUCKETS, math.inf), itertools.accumulate(counts)))
+
+    def reset(self):
+        with self._lock:
+            self._sections.clear()
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP bl_section_seconds Wall-clock seconds spent in a named app section.",
+            "# TYPE bl_section_seconds summary",
+        ]
+        for r in sorted(self.summary(), key=lambda r: r["section"]):
+            label = r["section"].replace("\\", "\\\\").replace('"', '\\"')
+            for q in ("0.5", "0.95"):
+                v = r["p50"] if q == "0.5" else r["p95"]
+                if v is not None:
+                    lines.append(f'bl_section_seconds{{section="{label}",quantile="{q}"}} {v:.6f}')
+            lines.append(f'bl_section_seconds_sum{{section="{label}"}} {r["total"]:.6f}')
+            lines.append(f'bl_section_seconds_count{{section="{label}"}} {r["count"]}')
+        lines += [
+            "# HELP bl_section_latency_seconds Latency histogram of a named app section.",
+            "# TYPE bl_section_latency_seconds histogram",
+        ]
+        for r in sorted(self.summary(), key=lambda r: r["section"]):
+            label = r["section"].replace("\\", "\\\\").replace('"', '\\"')
+            for le, n in self.histogram(r["section"]):
+                bound = "+Inf" if le == math.inf else f"{le:g}"
+                lines.append(f'bl_section_latency_seconds_bucket{{section="{label}",le="{bound}"}} {n}')
+            lines.append(f'bl_section_latency_seconds_sum{{section="{label}"}} {r["total"]:.6f}')
+            lines.append(f'bl_section_latency_seconds_count{{section="{label}"}} {r["count"]}')
+        lines += [
+            "# HELP bl_process_start_time_seconds Start of the metrics window (unix time).",
+            "# TYPE bl_process_start_time_seconds gauge",
+            f"bl_process_start_time_seconds {self.started:.0f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path, min_interval=TEXTFILE_INTERVAL):
+        # node_exporter textfile collector format; atomic replace, at most every min_interval
+        now = time.monotonic()
+        with self._lock:
+            if now - self._written_at < min_interval:
+                return False
+            self._written_at = now
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+        return True
+
+
+METRICS = Metrics()
+timed = METRICS.section
+begin = METRICS.begin
+
+
+# ------------------------- cProfile capture -------------------------
+_profile_lock = threading.Lock()
+_profile_active = None  # (profiler, started_at)
+
+
+def start_profile():
+    # -> profiler, or None if another capture is running
+    global _profile_active
+    with _profile_lock:
+        if _profile_active is not None:
+            prof, since = _profile_active
+            if time.monotonic() - since < PROFILE_STALE_AFTER:
+                return None
+            try:
+                prof.disable()
+            except Exception:
+                pass
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            return None  # another profiler (debugger, coverage) owns the hook
+        _profile_active = (prof, time.monotonic())
+        return prof
+
+
+def finish_profile(prof, limit=PROFILE_TOP):
+    # stop the capture and return the report (cumulative time, top `limit` rows)
+    global _profile_active
+    with _profile_lock:
+        prof.disable()
+        if _profile_active is not None and _profile_active[0] is prof:
+            _profile_active = None
+    out = io.StringIO()
+    try:
+        pstats.Stats(prof, stream=out).strip_dirs().sort_stats("cumulative").print_stats(limit)
+    except TypeError:
+        return ""  # nothing was recorded
+    return out.getvalue()
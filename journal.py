@@ -0,0 +1,165 @@
+# journal.py
+# Write-ahead journal for the write-behind queue (sync.py): one append-only
+# JSON-lines file per uid under the journal directory.
+#
+# A delta is appended and fsynced before the writer queues it, so once
+# save_data() has returned the change survives a crash or restart of the
+# server. After a send succeeds the writer appends an ack for everything up
+# to that entry. A writer created for a uid that still has unacknowledged
+# entries replays them in order before anything new; at startup recover()
+# lists every such uid so the queue can start their writers right away,
+# without waiting for the user to sign in again. For that the user's refresh
+# token is recorded next to the entries (whenever it changes), so keep the
+# directory private. A fully acknowledged file is deleted; one that grows
+# past JOURNAL_COMPACT_BYTES is rewritten with just the pending tail.
+#
+#   {"seq": 7, "uid": "abc", "at": 1718000000.0, "delta": {"app/baseline": 1000, ...}}
+#   {"refresh": "<refresh token>"}
+#   {"ack": 7}
+#
+# A line torn by a crash mid-write is skipped when the file is read back.
+import hashlib
+import json
+import os
+import threading
+import time
+
+JOURNAL_COMPACT_BYTES = 4 * 1024 * 1024
+
+
+def _file_name(uid):
+    # uids are Firebase push ids in practice; hash anything that isn't filename-safe
+    uid = str(uid)
+    if uid and all(c.isalnum() or c in "-_" for c in uid):
+        return uid + ".jsonl"
+    return hashlib.sha256(uid.encode("utf-8")).hexdigest() + ".jsonl"
+
+
+class _Log:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.entries = []   # [(seq, delta)] not acknowledged yet, oldest first
+        self.last_seq = 0
+        self.uid = None
+        self.refresh = None  # newest refresh token recorded
+
+
+class Journal:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._lock = threading.Lock()
+        self._logs = {}
+
+    def _path(self, uid):
+        return os.path.join(self.directory, _file_name(uid))
+
+    def _log(self, uid):
+        with self._lock:
+            log = self._logs.get(uid)
+            if log is None:
+                log = self._logs[uid] = _Log()
+        with log.lock:
+            if not log.loaded:
+                self._read(uid, log)
+                log.loaded = True
+        return log
+
+    def _read(self, uid, log, path=None):
+        entries, acked = {}, 0
+        try:
+            with open(path or self._path(uid), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # torn write
+                    if "ack" in rec:
+                        acked = max(acked, int(rec["ack"]))
+                    elif "refresh" in rec:
+                        log.refresh = rec["refresh"]
+                    elif "seq" in rec:
+                        entries[int(rec["seq"])] = rec.get("delta") or {}
+                        log.uid = rec.get("uid", log.uid)
+        except FileNotFoundError:
+            return
+        log.last_seq = max([acked, *entries])
+        log.entries = sorted((s, d) for s, d in entries.items() if s > acked)
+
+    def _append_lines(self, uid, records):
+        fd = os.open(self._path(uid), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        with open(fd, "a", encoding="utf-8") as f:
+            for rec in records:
+                f.write(json.dumps(rec, separators=(",", ":"), default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append(self, uid, delta, refresh=None):
+        # durable once this returns; -> the entry's sequence number.
+        # `refresh`: the user's refresh token, for a replay after a restart
+        log = self._log(uid)
+        with log.lock:
+            seq = log.last_seq + 1
+            records = [{"seq": seq, "uid": uid, "at": round(time.time(), 3), "delta": delta}]
+            if refresh and refresh != log.refresh:
+                records.append({"refresh": refresh})
+            self._append_lines(uid, records)
+            log.last_seq = seq
+            log.refresh = refresh or log.refresh
+            log.entries.append((seq, delta))
+            return seq
+
+    def ack(self, uid, seq):
+        # everything up to `seq` reached the database
+        log = self._log(uid)
+        with log.lock:
+            log.entries = [(s, d) for s, d in log.entries if s > seq]
+            path = self._path(uid)
+            if not log.entries:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                return
+            try:
+                big = os.path.getsize(path) > JOURNAL_COMPACT_BYTES
+            except OSError:
+                big = False
+            if not big:
+                self._append_lines(uid, [{"ack": seq}])
+                return
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as f:
+                for s, d in log.entries:
+                    f.write(json.dumps({"seq": s, "uid": uid, "delta": d}, separators=(",", ":"),
+                                       default=str) + "\n")
+                if log.refresh:
+                    f.write(json.dumps({"refresh": log.refresh}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+
+    def pending(self, uid):
+        # [(seq, delta)] still to be sent, oldest first
+        log = self._log(uid)
+        with log.lock:
+            return list(log.entries)
+
+    def recover(self):
+        # [(uid, refresh token or None)] for every file with unacknowledged entries
+        out = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".jsonl"):
+                continue
+            log = _Log()
+            self._read(None, log, os.path.join(self.directory, name))
+            uid = log.uid or name[:-len(".jsonl")]
+            if log.entries and _file_name(uid) == name:
+                out.append((uid, log.refresh))
+        return out
+
+    def depth(self, uid):
+        log = self._log(uid)
+        with log.lock:
+            return len(log.entries)
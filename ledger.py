@@ -0,0 +1,550 @@
+# ledger.py
+# Ledger mutations (expenses, earnings and their log entries) and the derived
+# data persisted next to APP_KEYS, so pages read totals instead of rescanning
+# history on every rerun.
+#
+# "aggregates" (persisted under /app/aggregates):
+#   worker, owner, expenses   running totals
+#   by_type                   {expense type: summed amount}
+#   latest                    {expense type: {"id", "date", "amount"}} newest entry per type
+#
+# "rollups" (persisted under /app/rollups/<YYYY-MM>):
+#   {"YYYY-MM": {"worker", "owner", "expenses"}}   per-month sums; net = owner - expenses
+#
+# trip totals (total_miles, total_gallons, last_mileage, last_trip_summary;
+# persisted as snapshots, see events.py) move by the delta of each trip
+# change. "last_trip_index" (session only) points at the newest Trip record,
+# so an edit or delete knows whether it touched last_trip_summary without a
+# scan; it is found again by walking back from the end when it is unknown.
+#
+# "expense_index" (session only, rebuilt by load_data()):
+#   {expense id: [index in expenses, index of its log entry or None]}
+#   covers the partitions in memory; ids from older ones are picked up by a
+#   rebuild the first time they are looked up after loading.
+#
+# All functions take the session-state mapping and mark what they touched for
+# save_data() (see persistence.py).
+import bisect
+
+from events import correct, stamp
+from persistence import before_write, mark_dirty, mark_record, mark_shifted
+
+_FORBIDDEN_KEY_CHARS = ".$#[]/"
+LAST_TRIP = "last_trip_index"
+TRIP_TOTALS = ("total_miles", "total_gallons", "last_mileage", "last_trip_summary")
+
+
+def _num(v):
+    try:
+        return float(v or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _type_key(t):
+    # expense types become Firebase keys; keep them legal
+    t = str(t)
+    for ch in _FORBIDDEN_KEY_CHARS:
+        t = t.replace(ch, "_")
+    return t
+
+
+def _sort_key(e):
+    # same newest-first ordering the tables use: (date, id)
+    return (e.get("date", "") or "", e.get("id", 0) or 0)
+
+
+def _latest_ref(e):
+    return {"id": e.get("id", 0) or 0, "date": e.get("date", "") or "", "amount": _num(e.get("amount"))}
+
+
+# ------------------------- Aggregates -------------------------
+def empty_aggregates():
+    return {"worker": 0.0, "owner": 0.0, "expenses": 0.0, "by_type": {}, "latest": {}}
+
+
+def build_aggregates(expenses, earnings):
+    # full scan; only used when aggregates are missing (old data, import, reset)
+    agg = empty_aggregates()
+    for e in earnings or []:
+        _agg_earning(agg, e, +1)
+    for e in expenses or []:
+        _agg_expense(agg, e, +1)
+    return agg
+
+
+def aggregates(state):
+    # the store, with the sub-maps Firebase drops when they are empty restored
+    agg = state.get("aggregates")
+    if not isinstance(agg, dict):
+        agg = state["aggregates"] = empty_aggregates()
+    for k in ("worker", "owner", "expenses"):
+        agg.setdefault(k, 0.0)
+    if not isinstance(agg.get("by_type"), dict):
+        agg["by_type"] = {}
+    if not isinstance(agg.get("latest"), dict):
+        agg["latest"] = {}
+    return agg
+
+
+def ensure_aggregates(state):
+    # after load_data(): build once for data saved before aggregates existed
+    if not isinstance(state.get("aggregates"), dict):
+        state["aggregates"] = build_aggregates(state.get("expenses"), state.get("earnings"))
+        mark_dirty(state, "aggregates")
+    return aggregates(state)
+
+
+def latest_expense(state, etype):
+    return aggregates(state)["latest"].get(_type_key(etype))
+
+
+def _field(records, i, name):
+    # one field of records[i]; LedgerTable reads it straight from its column
+    if hasattr(records, "value"):
+        return records.value(i, name)
+    return records[i].get(name)
+
+
+def _round(x):
+    # keep float drift from piling up in long-running sums
+    return round(x, 6)
+
+
+def _agg_earning(agg, e, sign):
+    agg["worker"] = _round(_num(agg.get("worker")) + sign * _num(e.get("worker")))
+    agg["owner"] = _round(_num(agg.get("owner")) + sign * _num(e.get("owner")))
+
+
+def _agg_expense(agg, e, sign):
+    amt = _num(e.get("amount"))
+    agg["expenses"] = _round(_num(agg.get("expenses")) + sign * amt)
+    if e.get("type") is None:
+        return
+    tk = _type_key(e.get("type"))
+    by_type = agg.setdefault("by_type", {})
+    total = _round(_num(by_type.get(tk)) + sign * amt)
+    if sign > 0 or abs(total) > 1e-9:
+        by_type[tk] = total
+    else:
+        by_type.pop(tk, None)
+    latest = agg.setdefault("latest", {})
+    if sign > 0:
+        cur = latest.get(tk)
+        if cur is None or _sort_key(e) >= (cur.get("date", ""), cur.get("id", 0)):
+            latest[tk] = _latest_ref(e)
+
+
+def _refresh_latest(agg, etype, expenses):
+    # Only runs when the newest entry of a type is deleted or retyped
+    tk = _type_key(etype)
+    if hasattr(expenses, "latest"):
+        i = expenses.latest(etype)  # time index (columnar.py), no scan
+        if i is None:
+            agg["latest"].pop(tk, None)
+        else:
+            agg["latest"][tk] = _latest_ref(expenses[i])
+        return
+    best = None
+    for e in expenses:
+        if e.get("type") is not None and _type_key(e.get("type")) == tk and (best is None or _sort_key(e) > _sort_key(best)):
+            best = e
+    if best is None:
+        agg["latest"].pop(tk, None)
+    else:
+        agg["latest"][tk] = _latest_ref(best)
+
+
+def _is_latest(agg, e):
+    if e.get("type") is None:
+        return False
+    cur = agg["latest"].get(_type_key(e.get("type")))
+    return bool(cur) and (cur.get("date", ""), cur.get("id", 0)) == _sort_key(e)
+
+
+# ------------------------- Monthly rollups -------------------------
+_ROLLUP_FIELDS = ("worker", "owner", "expenses")
+
+
+def month_key(date_str):
+    # "2024-05-17" / "2024-05-17 08:00:00" -> "2024-05"; None if it isn't a date
+    s = str(date_str or "")[:7]
+    if len(s) == 7 and s[4] == "-" and s[:4].isdigit() and s[5:].isdigit() and 1 <= int(s[5:]) <= 12:
+        return s
+    return None
+
+
+def month_index(mk):
+    # "2024-05" -> months since year 0, so windows can be paged with integer math
+    return int(mk[:4]) * 12 + int(mk[5:7]) - 1
+
+
+def month_from_index(i):
+    return f"{i // 12:04d}-{i % 12 + 1:02d}"
+
+
+def build_rollups(expenses, earnings):
+    out = {}
+    for e in earnings or []:
+        _roll_earning(out, e, +1)
+    for e in expenses or []:
+        _roll_expense(out, e, +1)
+    return out
+
+
+def fold_record(agg, roll, kind, e):
+    # one record of a backup being imported (backup.py) added to aggregates and rollups
+    if kind == "expenses":
+        _agg_expense(agg, e, +1)
+        _roll_expense(roll, e, +1)
+    elif kind == "earnings":
+        _agg_earning(agg, e, +1)
+        _roll_earning(roll, e, +1)
+
+
+def rollups(state):
+    r = state.get("rollups")
+    if not isinstance(r, dict):
+        r = state["rollups"] = {}
+    return r
+
+
+def ensure_rollups(state):
+    if not isinstance(state.get("rollups"), dict):
+        state["rollups"] = build_rollups(state.get("expenses"), state.get("earnings"))
+        mark_dirty(state, "rollups")
+    return rollups(state)
+
+
+def rollup_window(state, end_month, n):
+    # n months ending at `end_month` (index), oldest first; only those buckets are read
+    r = rollups(state)
+    out = []
+    for i in range(end_month - n + 1, end_month + 1):
+        mk = month_from_index(i)
+        b = r.get(mk) or {}
+        out.append((mk, {f: _num(b.get(f)) for f in _ROLLUP_FIELDS}))
+    return out
+
+
+def first_data_month(state):
+    # earliest month where worker or owner's net is non-zero (what the Income chart starts at)
+    months = [mk for mk, b in rollups(state).items()
+              if month_key(mk) and (_num(b.get("worker")) + _num(b.get("owner")) - _num(b.get("expenses"))) != 0]
+    return month_index(min(months)) if months else None
+
+
+def _bump(r, mk, field, amount):
+    b = r.get(mk)
+    if not isinstance(b, dict):
+        b = r[mk] = {}
+    b[field] = _round(_num(b.get(field)) + amount)
+    if all(abs(_num(b.get(f))) < 1e-9 for f in _ROLLUP_FIELDS):
+        del r[mk]
+
+
+def _roll_earning(r, e, sign):
+    mk = month_key(e.get("date"))
+    if mk:
+        _bump(r, mk, "worker", sign * _num(e.get("worker")))
+        _bump(r, mk, "owner", sign * _num(e.get("owner")))
+    return mk
+
+
+def _roll_expense(r, e, sign):
+    mk = month_key(e.get("date"))
+    if mk:
+        _bump(r, mk, "expenses", sign * _num(e.get("amount")))
+    return mk
+
+
+def _touch_month(state, mk):
+    if mk:
+        mark_record(state, "rollups", mk)
+
+
+# ------------------------- Expense id index -------------------------
+def _loaded(records):
+    # (index, record) pairs without pulling older partitions into memory
+    if hasattr(records, "loaded_items"):
+        return records.loaded_items()
+    return enumerate(records or [])
+
+
+def build_expense_index(expenses, log):
+    index = {}
+    for i, e in _loaded(expenses):
+        if e.get("id"):
+            index[e["id"]] = [i, None]
+    for j, le in _loaded(log):
+        if le.get("type") == "Expense" and le.get("expense_id") in index:
+            index[le["expense_id"]][1] = j
+    return index
+
+
+def rebuild_expense_index(state):
+    state["expense_index"] = build_expense_index(state.get("expenses"), state.get("log"))
+    return state["expense_index"]
+
+
+def expense_index(state):
+    index = state.get("expense_index")
+    return index if isinstance(index, dict) else rebuild_expense_index(state)
+
+
+def _position_ok(state, exp_id, pos):
+    i, j = pos
+    exps, log = state["expenses"], state["log"]
+    return (0 <= i < len(exps) and _field(exps, i, "id") == exp_id
+            and (j is None or (0 <= j < len(log) and _field(log, j, "expense_id") == exp_id)))
+
+
+def locate_expense(state, exp_id):
+    # (expense index, log index) for an id; O(1), with a one-off rebuild if the index went stale
+    if not exp_id:
+        return None, None
+    pos = expense_index(state).get(exp_id)
+    if pos is None or not _position_ok(state, exp_id, pos):
+        pos = rebuild_expense_index(state).get(exp_id)
+    return tuple(pos) if pos else (None, None)
+
+
+def _shift_expense_positions(state, start):
+    # records from `start` on moved down one slot; only the tail is visited
+    index = expense_index(state)
+    for e in state["expenses"][start:]:
+        pos = index.get(e.get("id"))
+        if pos is not None:
+            pos[0] -= 1
+
+
+def _shift_log_positions(state, start):
+    index = expense_index(state)
+    for le in state["log"][start:]:
+        if le.get("type") == "Expense":
+            pos = index.get(le.get("expense_id"))
+            if pos is not None and pos[1] is not None:
+                pos[1] -= 1
+
+
+# ------------------------- Trips -------------------------
+def last_trip_index(state):
+    # index of the newest Trip record, -1 if there is none
+    log = state["log"]
+    p = state.get(LAST_TRIP)
+    if p is not None and (p == -1 or (0 <= p < len(log) and _field(log, p, "type") == "Trip")):
+        return p
+    if not state.get("last_trip_summary"):
+        p = -1  # no trips at all; don't walk (and load) the whole log to find that out
+    else:
+        p = next((i for i in range(len(log) - 1, -1, -1) if _field(log, i, "type") == "Trip"), -1)
+    state[LAST_TRIP] = p
+    return p
+
+
+def _move_totals(state, distance, gallons):
+    state["total_miles"] = _round(_num(state.get("total_miles")) + distance)
+    state["total_gallons"] = _round(_num(state.get("total_gallons")) + gallons)
+    if state.get("last_mileage") is not None:
+        state["last_mileage"] = _round(_num(state["last_mileage"]) + distance)
+
+
+def add_trip(state, entry):
+    before_write(state)
+    log = state["log"]
+    log.append(stamp(state, entry))
+    _move_totals(state, _num(entry.get("distance")), _num(entry.get("gallons")))
+    state["last_trip_summary"] = entry
+    state[LAST_TRIP] = len(log) - 1
+    mark_record(state, "log", len(log) - 1)
+
+
+def update_trip(state, j, new):
+    # replace the Trip at log[j]; totals move by the difference
+    before_write(state)
+    log = state["log"]
+    old = log[j]
+    correct(state, old, new)
+    log[j] = new
+    mark_record(state, "log", j)
+    _move_totals(state, _num(new.get("distance")) - _num(old.get("distance")),
+                 _num(new.get("gallons")) - _num(old.get("gallons")))
+    if j == last_trip_index(state):
+        state["last_trip_summary"] = new
+
+
+def trip_totals(state):
+    # full recompute from the whole log (loads every partition); for checking only
+    miles = gallons = 0.0
+    last = {}
+    for e in state["log"]:
+        if e.get("type") == "Trip":
+            miles += _num(e.get("distance"))
+            gallons += _num(e.get("gallons"))
+            last = e
+    baseline = state.get("baseline")
+    return {"total_miles": miles, "total_gallons": gallons,
+            "last_mileage": None if baseline is None else _num(baseline) + miles,
+            "last_trip_summary": last}
+
+
+def trip_drift(state, tolerance=1e-6):
+    # {key: (running value, recomputed value)} where the running totals disagree with trip_totals()
+    full = trip_totals(state)
+    drift = {}
+    for k in TRIP_TOTALS:
+        have, want = state.get(k), full[k]
+        if isinstance(want, float) and have is not None:
+            if abs(_num(have) - want) > tolerance * max(1.0, abs(want)):
+                drift[k] = (have, want)
+        elif (have or None) != (want or None):
+            drift[k] = (have, want)
+    return drift
+
+
+# ------------------------- Log -------------------------
+def delete_log_entry(state, j):
+    # delete log[j]; any expense pointing at it is left without a log entry,
+    # a Trip takes its distance and gallons off the totals
+    before_write(state)
+    log = state["log"]
+    # only a Trip needs the pointer settled; otherwise shift it if it is known
+    p = last_trip_index(state) if _field(log, j, "type") == "Trip" else state.get(LAST_TRIP)
+    entry = log[j]
+    del log[j]
+    mark_shifted(state, "log", j)
+    if entry.get("type") == "Expense":
+        pos = expense_index(state).get(entry.get("expense_id"))
+        if pos is not None:
+            pos[1] = None
+    elif entry.get("type") == "Trip":
+        correct(state, entry)
+        _move_totals(state, -_num(entry.get("distance")), -_num(entry.get("gallons")))
+    if p is not None and j < p:
+        state[LAST_TRIP] = p - 1
+    elif p is not None and j == p:
+        state.pop(LAST_TRIP, None)
+        p = last_trip_index(state)  # the previous trip: walks back from the end
+        state["last_trip_summary"] = log[p] if p >= 0 else {}
+    _shift_log_positions(state, j)
+    return entry
+
+
+# ------------------------- Expenses -------------------------
+def expense_note(etype, description):
+    return f"{etype}: {description}"
+
+
+def add_expense(state, exp, log_entry):
+    before_write(state)
+    agg = aggregates(state)
+    state["expenses"].append(exp)
+    state["log"].append(stamp(state, log_entry))
+    _agg_expense(agg, exp, +1)
+    _touch_month(state, _roll_expense(rollups(state), exp, +1))
+    mark_record(state, "expenses", len(state["expenses"]) - 1)
+    mark_record(state, "log", len(state["log"]) - 1)
+    mark_dirty(state, "aggregates")
+    if exp.get("id"):
+        expense_index(state)[exp["id"]] = [len(state["expenses"]) - 1, len(state["log"]) - 1]
+
+
+def update_expense(state, idx, new_exp):
+    # replace expenses[idx] and keep its linked log entry in step
+    before_write(state)
+    agg = aggregates(state)
+    old = state["expenses"][idx]
+    was_latest = _is_latest(agg, old)
+    _agg_expense(agg, old, -1)
+    _touch_month(state, _roll_expense(rollups(state), old, -1))
+    state["expenses"][idx] = new_exp
+    _agg_expense(agg, new_exp, +1)
+    _touch_month(state, _roll_expense(rollups(state), new_exp, +1))
+    if was_latest and old.get("type") != new_exp.get("type"):
+        _refresh_latest(agg, old.get("type"), state["expenses"])
+    elif was_latest:
+        agg["latest"][_type_key(new_exp.get("type"))] = _latest_ref(new_exp)
+    mark_record(state, "expenses", idx)
+    mark_dirty(state, "aggregates")
+
+    _, j = locate_expense(state, new_exp.get("id"))
+    if j is not None:
+        # records come back as copies from a LedgerTable; write the edit back
+        le = dict(state["log"][j])
+        le["amount"] = new_exp.get("amount")
+        le["note"] = expense_note(new_exp.get("type"), new_exp.get("description"))
+        state["log"][j] = le
+        mark_record(state, "log", j)
+
+
+def delete_expense(state, idx):
+    # delete expenses[idx] along with its linked log record if present
+    before_write(state)
+    expenses = state["expenses"]
+    if not 0 <= idx < len(expenses):
+        return
+    agg = aggregates(state)
+    exp = expenses[idx]
+    exp_id = exp.get("id")
+    _, j = locate_expense(state, exp_id)
+    was_latest = _is_latest(agg, exp)
+    del expenses[idx]
+    mark_shifted(state, "expenses", idx)
+    expense_index(state).pop(exp_id, None)
+    _shift_expense_positions(state, idx)
+    _agg_expense(agg, exp, -1)
+    _touch_month(state, _roll_expense(rollups(state), exp, -1))
+    if was_latest:
+        _refresh_latest(agg, exp.get("type"), expenses)
+    mark_dirty(state, "aggregates")
+    # remove the linked log entry (by id only; legacy entries without an id keep theirs)
+    if j is not None:
+        delete_log_entry(state, j)
+
+
+# ------------------------- Earnings -------------------------
+def add_earning(state, earning, log_entry):
+    before_write(state)
+    agg = aggregates(state)
+    state["earnings"].append(earning)
+    state["log"].append(stamp(state, log_entry))
+    _agg_earning(agg, earning, +1)
+    _touch_month(state, _roll_earning(rollups(state), earning, +1))
+    mark_record(state, "earnings", len(state["earnings"]) - 1)
+    mark_record(state, "log", len(state["log"]) - 1)
+    mark_dirty(state, "aggregates")
+
+
+# ------------------------- Paging -------------------------
+def page_back(records, cursor, size, lo=0, skip_type=None):
+    # One newest-first page: walk back from index `cursor` (None = newest) to `lo`,
+    # skipping records of `skip_type`. Touches ~`size` records, not the whole list.
+    # Returns (indices on this page, cursor of the next older page or None).
+    i = len(records) - 1 if cursor is None else min(cursor, len(records) - 1)
+    out = []
+    while i >= lo and len(out) < size:
+        if skip_type is None or _field(records, i, "type") != skip_type:
+            out.append(i)
+        i -= 1
+    while i >= lo and skip_type is not None and _field(records, i, "type") == skip_type:
+        i -= 1
+    return out, (i if i >= lo else None)
+
+
+def _day(records, field):
+    return lambda i: str(_field(records, i, field) or "")[:10]
+
+
+def _month_floor(records, day):
+    # partitions of earlier months only hold earlier days; skip them without loading
+    return records.month_start(day[:7]) if hasattr(records, "month_start") else 0
+
+
+def first_index_on_or_after(records, day, field):
+    # records are appended in time order, so "YYYY-MM-DD" prefixes are sorted
+    return bisect.bisect_left(range(len(records)), day, lo=_month_floor(records, day), key=_day(records, field))
+
+
+def last_index_on_or_before(records, day, field):
+    return bisect.bisect_right(range(len(records)), day, lo=_month_floor(records, day), key=_day(records, field)) - 1
+
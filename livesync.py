@@ -0,0 +1,237 @@
+# livesync.py
+# Opt-in live updates from the user's other devices: one database stream per
+# signed-in uid, shared by every session of that user in this process.
+#
+# The stream follows only /users/<uid>/changed, the small node every write
+# sets next to its version stamp (doccache.stamp()): the stamp and the paths
+# the write changed. When a foreign stamp arrives, just those paths are read
+# back, applied to the doc cache (doccache.py) under that stamp, and queued as
+# a delta under the uid's next sequence number. Sessions poll that number from
+# a fragment, rerun when it moved, and fold the deltas they haven't seen into
+# their state (changes(), persistence.apply_delta()); so only the changed
+# records cross the network, and nothing is rebuilt. Stamps this process sent
+# are echoes of writes the cache already has and are skipped. A change that
+# comes without paths (a reset, an import switch, too many paths), or whose
+# paths couldn't be read, is queued as a reload: the cache entry is dropped
+# and sessions run load_data().
+#
+# Reconnects: the supervisor reopens the stream with a fresh token after a
+# cancel/auth_revoked/error event, or when nothing (not even the server's
+# 30 s keep-alive) arrived for LIVE_STALE_AFTER, backing off exponentially up
+# to LIVE_BACKOFF_MAX. A (re)connect starts with a snapshot of the node, a few
+# bytes; if its stamp is not the cached one, writes were missed while the
+# stream was down and a reload is queued.
+#
+# Back-pressure: the listener never waits on sessions, and a session reruns
+# at most once per poll interval however many events came in. Only the last
+# LIVE_MAX_PENDING deltas are kept; a session that is further behind than
+# that reloads instead.
+import threading
+import time
+from collections import deque
+
+from doccache import CHANGED_KEY, MISS
+
+LIVE_POLL_SECONDS = 3         # how often a session checks for remote changes
+LIVE_STALE_AFTER = 90.0       # seconds without any event before reconnecting
+LIVE_BACKOFF_MAX = 60.0       # seconds between reconnect attempts, at most
+LIVE_IDLE_TTL = 120.0         # stop listening once no session polled for this long
+LIVE_MAX_PENDING = 200        # deltas kept for sessions that haven't applied them yet
+LIVE_APPLIED = "live_applied"  # session state: the sequence number the state includes
+
+
+def _split(path):
+    return [p for p in str(path or "").split("/") if p]
+
+
+class _Listener:
+    def __init__(self, uid):
+        self.uid = uid
+        self.stream = None
+        self.conn = None          # identity of the current connection; stale events are ignored
+        self.token = None
+        self.seq = 0              # remote changes seen
+        self.changes = deque(maxlen=LIVE_MAX_PENDING)  # (seq, delta or None for a reload)
+        self.node = {}            # last known /users/<uid>/changed
+        self.state = "connecting"
+        self.failures = 0
+        self.retry_at = 0.0
+        self.reconnect = True
+        self.snapshot = True      # next put at "/" is the connection's initial snapshot
+        self.last_event = time.monotonic()
+        self.last_poll = time.monotonic()
+
+
+class LiveSync:
+    def __init__(self, db, tokens=None, doc_cache=None, tick=1.0):
+        self.db = db
+        self.tokens = tokens
+        self.doc_cache = doc_cache
+        self.tick = tick
+        self._lock = threading.Lock()
+        self._users = {}
+        self._thread = threading.Thread(target=self._run, name="live-sync", daemon=True)
+        self._thread.start()
+
+    # ---- sessions ----
+    def watch(self, uid, token=None):
+        # every poll of a session that has live sync on; -> current sequence number
+        with self._lock:
+            l = self._users.get(uid)
+            if l is None:
+                l = self._users[uid] = _Listener(uid)
+            l.last_poll = time.monotonic()
+            l.token = token or l.token
+            return l.seq
+
+    def changes(self, uid, since):
+        # -> the deltas after sequence number `since`, oldest first, or None if
+        # the session has to reload (a reload was queued, or they're gone)
+        with self._lock:
+            l = self._users.get(uid)
+            if l is None or since > l.seq:
+                return None
+            out = [d for s, d in l.changes if s > since]
+            if len(out) != l.seq - since or any(d is None for d in out):
+                return None
+            return out
+
+    def status(self, uid):
+        # -> "live" | "connecting" | "reconnecting" | "off"
+        with self._lock:
+            l = self._users.get(uid)
+            return l.state if l is not None else "off"
+
+    def stop(self, uid):
+        with self._lock:
+            l = self._users.pop(uid, None)
+        if l is not None:
+            self._close(l)
+
+    # ---- supervisor ----
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            now = time.monotonic()
+            with self._lock:
+                idle = [uid for uid, l in self._users.items() if now - l.last_poll > LIVE_IDLE_TTL]
+                todo = []
+                for uid, l in self._users.items():
+                    if uid in idle:
+                        continue
+                    if l.stream is not None and now - l.last_event > LIVE_STALE_AFTER:
+                        l.reconnect = True
+                    if l.reconnect and now >= l.retry_at:
+                        l.reconnect = False
+                        todo.append(l)
+            for uid in idle:
+                self.stop(uid)
+            for l in todo:
+                self._open(l)
+
+    def _open(self, l):
+        self._close(l)
+        conn = object()
+        with self._lock:
+            l.conn, l.snapshot, l.state = conn, True, "connecting"
+            l.last_event = time.monotonic()
+            token = l.token
+        try:
+            token = self._token(l, token)
+            stream = self.db.child("users").child(l.uid).child(CHANGED_KEY).stream(
+                lambda msg: self._on_event(l, conn, msg), token)
+        except Exception:
+            self._failed(l)
+            return
+        with self._lock:
+            if l.conn is conn:
+                l.stream = stream
+                return
+        stream.close()  # stopped while connecting
+
+    def _close(self, l):
+        with self._lock:
+            stream, l.stream, l.conn = l.stream, None, None
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def _failed(self, l):
+        with self._lock:
+            l.failures += 1
+            l.retry_at = time.monotonic() + min(LIVE_BACKOFF_MAX, 2 ** l.failures)
+            l.reconnect = True
+            l.state = "reconnecting"
+
+    def _token(self, l, token=None):
+        if self.tokens is not None:
+            token = self.tokens.token(l.uid) or token
+        return token or l.token
+
+    def _push(self, l, delta):
+        # queue a delta (None: a reload) for the sessions
+        if delta is None and self.doc_cache is not None:
+            self.doc_cache.drop(l.uid)
+        with self._lock:
+            l.seq += 1
+            l.changes.append((l.seq, delta))
+
+    # ---- events (stream thread) ----
+    def _on_event(self, l, conn, msg):
+        with self._lock:
+            if l.conn is not conn:
+                return  # from a connection we already replaced
+            l.last_event = time.monotonic()
+        event = msg.get("event")
+        if event == "keep-alive":
+            return
+        if event in ("cancel", "auth_revoked", "error", "closed"):
+            if event == "auth_revoked" and self.tokens is not None:
+                self.tokens.expire(l.uid)
+            self._failed(l)
+            return
+        if event not in ("put", "patch"):
+            return
+        try:
+            self._apply(l, event, _split(msg.get("path")), msg.get("data"))
+        except Exception:
+            self._push(l, None)  # couldn't follow it: make sessions reload
+
+    def _apply(self, l, event, path, data):
+        cache, uid = self.doc_cache, l.uid
+        with self._lock:
+            first, l.snapshot = l.snapshot and event == "put" and not path, False
+            if first:
+                l.failures, l.state = 0, "live"
+        # rebuild the node from the event
+        if not path:
+            if event == "put":
+                l.node = dict(data) if isinstance(data, dict) else {}
+            elif isinstance(data, dict):
+                l.node.update(data)
+        else:
+            l.node[path[0]] = data
+        version, paths = l.node.get("version"), l.node.get("paths")
+        if first:
+            cached = cache.current(uid) if cache is not None else MISS
+            if cached is not MISS and cached != version:
+                self._push(l, None)  # written to while we weren't listening
+            return
+        if version is None:
+            return  # removed; the reset that did it comes with its own stamp
+        if cache is not None and cache.is_own(uid, version):
+            return  # our own write coming back
+        if not isinstance(paths, list) or not paths:
+            self._push(l, None)
+            return
+        users = self.db.child("users").child(uid)
+        token = self._token(l)
+        delta = {}
+        for p in paths:
+            parts = _split(p)
+            delta["/".join(parts)] = users.child(*parts).get(token).val()
+        if cache is not None:
+            cache.apply(uid, delta, version)
+        self._push(l, delta)
@@ -0,0 +1,294 @@
+# persistence.py
+# Dirty-key / dirty-record tracking for the /users/<uid> node.
+#
+# Session state stays the source of truth. Every mutation marks what it
+# touched, and save_data() turns the marks into one multi-path update() on
+# /users/<uid>:
+#   - scalar keys (baseline, totals, ...) are sent whole:   {"app/total_miles": 12.5}
+#   - list records are sent by position:                    {"app/<key>/42": {...}}
+#   - records that fell off the end are nulled:             {"app/<key>/43": None}
+#   - dict children are sent by key:                        {"app/rollups/2024-05": {...}}
+#   - ledger tables (columnar.py) go to monthly partitions: {"parts/2024-05/log/7": {...}}
+#     with their counts in the index:                       {"app/part_index/2024-05/log": 8}
+#     The partitions live under /parts unless /app/parts_root names another
+#     node (a backup import writes a fresh one and switches to it, backup.py).
+# Firebase stores lists as {"0": .., "1": ..} objects and reads dense ones
+# back as lists, so the node load_data() reads afterwards is the same one a
+# full set() would have produced. apply_delta() goes the other way: it folds
+# an update another device sent (livesync.py) into session state.
+#
+# When several sessions share one user's state (shared.py) the objects in it
+# must not change under the other sessions: mutation helpers call
+# before_write(state) first, which hands this session private copies.
+import itertools
+
+from columnar import LedgerTable, to_plain
+
+DIRTY_KEYS = "dirty_keys"          # set of APP_KEYS rewritten whole
+DIRTY_RECORDS = "dirty_records"    # {key: set(list index | dict child key)}
+SYNCED_LENS = "synced_lens"        # {list key: length | {month: length} last written/read}
+LEDGER_VERSION = "ledger_version"  # changes on every mutation/load; keys viewcache.py
+WRITE_HOOK = "_before_write"       # set by shared.py: callable(state), copy-on-write
+PARTS_ROOT = "parts_root"          # /app/parts_root: node holding the partitions, if not DEFAULT_PARTS_ROOT
+DEFAULT_PARTS_ROOT = "parts"
+
+TRACKING_KEYS = (DIRTY_KEYS, DIRTY_RECORDS, SYNCED_LENS, LEDGER_VERSION)
+
+# process-wide, so a version number is never reused by a reload or another session
+_versions = itertools.count(1)
+
+
+def _is_list(v):
+    # plain lists and the columnar ledger tables (see columnar.py)
+    return isinstance(v, (list, LedgerTable))
+
+
+def _wire(v):
+    # Firebase drops empty containers; sending None keeps update() unambiguous
+    v = to_plain(v)
+    if v is None or v == [] or v == {}:
+        return None
+    return v
+
+
+def parts_root(state):
+    # the /users/<uid> child the monthly partitions are under
+    return state.get(PARTS_ROOT) or DEFAULT_PARTS_ROOT
+
+
+def before_write(state):
+    # call before changing anything in `state` in place
+    hook = state.get(WRITE_HOOK)
+    if hook is not None:
+        hook(state)
+
+
+def bump_version(state):
+    state[LEDGER_VERSION] = next(_versions)
+
+
+def mark_dirty(state, *keys):
+    before_write(state)
+    bump_version(state)
+    dirty = state.get(DIRTY_KEYS)
+    if dirty is None:
+        dirty = state[DIRTY_KEYS] = set()
+    dirty.update(keys)
+
+
+def mark_all_dirty(state, keys):
+    mark_dirty(state, *keys)
+    state[DIRTY_RECORDS] = {}
+
+
+def mark_record(state, key, index):
+    before_write(state)
+    bump_version(state)
+    recs = state.get(DIRTY_RECORDS)
+    if recs is None:
+        recs = state[DIRTY_RECORDS] = {}
+    recs.setdefault(key, set()).add(index if isinstance(index, str) else int(index))
+
+
+def mark_shifted(state, key, start):
+    # After `del lst[start]` every record from `start` on moved down one slot;
+    # the stale tail slot is nulled in build_delta() via SYNCED_LENS. In a
+    # partitioned table only the rest of that month's partition moved.
+    before_write(state)
+    bump_version(state)
+    start = int(start)
+    v = state.get(key)
+    stop = len(v or [])
+    if isinstance(v, LedgerTable) and v.last_delete and v.last_delete[0] == start:
+        stop = v.last_delete[1]
+    recs = state.get(DIRTY_RECORDS)
+    if recs is None:
+        recs = state[DIRTY_RECORDS] = {}
+    # earlier marks past `start` now point one slot lower
+    old = recs.get(key) or set()
+    recs[key] = {m - 1 if m > start else m for m in old if m != start}
+    recs[key].update(range(start, stop))
+
+
+def has_changes(state):
+    return bool(state.get(DIRTY_KEYS)) or any((state.get(DIRTY_RECORDS) or {}).values())
+
+
+def _partition_delta(delta, k, table, marks, whole, synced, root):
+    cur = {mk: n for mk, n in table.parts}
+    old = synced if isinstance(synced, dict) else {}
+    if whole:
+        # rewrite every partition; drop ones that no longer exist and any
+        # flat list left from before partitioning
+        delta[f"app/{k}"] = None
+        for mk in old:
+            if mk not in cur:
+                delta[f"{root}/{mk}/{k}"] = None
+                delta[f"app/part_index/{mk}/{k}"] = None
+        for mk, n in cur.items():
+            delta[f"{root}/{mk}/{k}"] = _wire(table.partition_rows(mk))
+            delta[f"app/part_index/{mk}/{k}"] = n or None
+        return
+    n = len(table)
+    for i in sorted(marks):
+        if i < n:
+            mk, j = table.locate(i)
+            delta[f"{root}/{mk}/{k}/{j}"] = table[i]
+    for mk in set(old) | set(cur):
+        now, was = cur.get(mk, 0), old.get(mk, 0)
+        if now != was:
+            for j in range(now, was):
+                delta[f"{root}/{mk}/{k}/{j}"] = None
+            delta[f"app/part_index/{mk}/{k}"] = now or None
+
+
+def build_delta(state, app_keys):
+    # Multi-path payload for db.child("users").child(uid).update(payload, token)
+    full = state.get(DIRTY_KEYS) or set()
+    recs = state.get(DIRTY_RECORDS) or {}
+    synced = state.get(SYNCED_LENS) or {}
+    delta = {}
+    root = parts_root(state)
+    for k in app_keys:
+        v = state.get(k)
+        if isinstance(v, LedgerTable):
+            if k in full or recs.get(k) or synced.get(k) != {mk: n for mk, n in v.parts}:
+                _partition_delta(delta, k, v, recs.get(k) or (), k in full, synced.get(k), root)
+        elif k in full:
+            delta[f"app/{k}"] = _wire(v)
+        elif recs.get(k) and _is_list(v):
+            n = len(v)
+            for i in sorted(recs[k]):
+                if i < n:
+                    delta[f"app/{k}/{i}"] = v[i]
+            for i in range(n, synced.get(k, n)):
+                delta[f"app/{k}/{i}"] = None
+        elif recs.get(k) and isinstance(v, dict):
+            for c in sorted(recs[k], key=str):
+                delta[f"app/{k}/{c}"] = _wire(v.get(c))
+    return delta
+
+
+def mark_synced(state, app_keys, data=None):
+    # Clear all marks; remember list lengths as they now exist in the cloud.
+    # `data` is what was just read (load_data); otherwise session state was just written.
+    src = state if data is None else data
+    lens = {}
+    for k in app_keys:
+        if isinstance(state.get(k), LedgerTable):
+            # partitioned tables are read per month, so their layout is the one to trust
+            lens[k] = {mk: n for mk, n in state[k].parts}
+            continue
+        v = src.get(k) if hasattr(src, "get") else None
+        if _is_list(v):
+            lens[k] = len(v)
+    state[DIRTY_KEYS] = set()
+    state[DIRTY_RECORDS] = {}
+    state[SYNCED_LENS] = lens
+    if data is not None:
+        bump_version(state)  # freshly loaded data
+
+
+def _set_child(container, key, value):
+    # one child of a list/dict as Firebase would have it after the write; -> ok
+    if isinstance(container, dict):
+        if value is None:
+            container.pop(key, None)
+        else:
+            container[key] = value
+        return True
+    if not isinstance(container, list) or not key.isdigit():
+        return False
+    i = int(key)
+    if value is None:
+        del container[i:]  # build_delta() only nulls the tail
+        return True
+    if i < len(container):
+        container[i] = value
+    elif i == len(container):
+        container.append(value)
+    else:
+        return False
+    return True
+
+
+def _apply_partitions(table, counts, slots):
+    # slots {(month, j): record | None} and new counts {month: n} of one ledger
+    now = {mk: n for mk, n in table.parts}
+    want = {**now, **counts}
+    months = sorted(set(counts) | {mk for mk, _ in slots})
+    for (mk, j), rec in slots.items():
+        if (rec is None) != (j >= want.get(mk, 0)):
+            return False  # a hole, or a record past the end
+    # rewrites and shrinks, newest month first so earlier positions stay put
+    for mk in reversed(months):
+        was, n = now.get(mk, 0), want.get(mk, 0)
+        start = table.month_start(mk)
+        if was and start < table.base:
+            return False  # not loaded here; the next reload reads it
+        for j in range(min(was, n)):
+            if (mk, j) in slots:
+                table[start + j] = slots[(mk, j)]
+        for j in range(was - 1, n - 1, -1):
+            del table[start + j]
+    # growth, oldest month first: records only ever go onto the newest one
+    for mk in months:
+        was, n = now.get(mk, 0), want.get(mk, 0)
+        if n > was and table.parts and mk < table.parts[-1][0]:
+            return False
+        for j in range(was, n):
+            if slots.get((mk, j)) is None:
+                return False
+            table.append(slots[(mk, j)])
+    return {mk: n for mk, n in table.parts if n} == {mk: n for mk, n in want.items() if n}
+
+
+def apply_delta(state, delta, app_keys):
+    # The inverse of build_delta(): change session state the way `delta` (a
+    # multi-path update of /users/<uid>) changed the database, record by
+    # record. -> False if it can't be followed that way (a whole partition, a
+    # month not loaded here, unsent changes of our own, ...); state may then
+    # be half updated and the caller must reload.
+    if has_changes(state):
+        return False
+    root = parts_root(state)
+    plain, counts, slots = [], {}, {}
+    for path in sorted(delta, key=lambda p: p.count("/")):
+        value, p = delta[path], [x for x in path.split("/") if x]
+        if p[:2] == ["app", "part_index"] and len(p) == 4:
+            if not isinstance(state.get(p[3]), LedgerTable) or not isinstance(value, (int, type(None))):
+                return False
+            counts.setdefault(p[3], {})[p[2]] = value or 0
+        elif len(p) >= 2 and p[0] == "app":
+            if p[1] == PARTS_ROOT:
+                return False  # the partitions moved (backup.py)
+            if p[1] not in app_keys:
+                continue  # not session state (the import marker, ...)
+            if isinstance(state.get(p[1]), LedgerTable):
+                if len(p) == 2 and value is None:
+                    continue  # a flat list left from before partitioning
+                return False
+            if len(p) > 3:
+                return False
+            plain.append((p[1:], value))
+        elif len(p) == 4 and p[0] == root and p[3].isdigit() and isinstance(state.get(p[2]), LedgerTable):
+            if value is not None and not isinstance(value, dict):
+                return False
+            slots.setdefault(p[2], {})[(p[1], int(p[3]))] = value
+        else:
+            return False
+    before_write(state)
+    for p, value in plain:
+        if len(p) == 1:
+            state[p[0]] = value
+            continue
+        if state.get(p[0]) is None and (p[1] == "0" or not p[1].isdigit()):
+            state[p[0]] = [] if p[1] == "0" else {}  # Firebase drops empty ones; the write recreates it
+        if not _set_child(state.get(p[0]), p[1], value):
+            return False
+    for k in set(counts) | set(slots):
+        if not _apply_partitions(state[k], counts.get(k, {}), slots.get(k, {})):
+            return False
+    mark_synced(state, app_keys)
+    bump_version(state)
+    return True
@@ -0,0 +1,296 @@
+# resilient.py
+# Deadlines, bounded retries, hedged reads and a circuit breaker around the
+# storage backend (`db`) and the auth client.
+#
+# Every call runs on a small worker pool and the caller waits at most its
+# deadline (DeadlineExceeded). The abandoned call still finishes on the pool;
+# the Firebase session also has a socket timeout (firebase_config.py), so a
+# dead connection can't hold a worker forever.
+#
+# Transient read failures (timeouts, connection errors, HTTP 429/5xx, a locked
+# SQLite file) are retried with jittered exponential backoff while the retry
+# budget allows: each call earns RETRY_RATIO of a token, each retry or hedge
+# spends one, so retries stay a small share of traffic when everything is
+# failing. Reads that are slower than the recent p95 get a second, hedged
+# request and the first answer wins. Writes are never retried here: an attempt
+# that missed its deadline may still land, and a retry sent meanwhile could be
+# overtaken by it and put older values back. The write-behind queue (sync.py)
+# re-sends failed writes in order. The next write first waits for any write
+# abandoned at its deadline to finish; that wait comes out of its own
+# deadline, so a script-thread write still gives up (DeadlineExceeded) in
+# WRITE_DEADLINE. Auth errors, bad credentials and other 4xx are never retried
+# and never count against the breaker.
+#
+# The breaker opens after BREAKER_FAILURES transient failures in a row; for
+# BREAKER_COOLDOWN seconds calls fail fast (CircuitOpen), then one trial call
+# is let through. While it is open, reads are answered by `offline(path)`
+# (the doc cache: last synced data) when it has them; writes fail and stay in
+# the write-behind queue/journal. Per-operation latencies go to instrument.py
+# as "db.<op>" / "auth.<op>".
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from doccache import MISS
+from instrument import METRICS
+from storage import Ref, StorageBackend
+
+READ_DEADLINE = 8.0        # seconds a caller waits for one read
+WRITE_DEADLINE = 15.0
+AUTH_DEADLINE = 10.0
+MAX_ATTEMPTS = 3           # per call, first try included
+RETRY_BASE = 0.2           # seconds; doubled per attempt, with jitter
+RETRY_RATIO = 0.2          # budget tokens earned per call
+RETRY_BUDGET_MAX = 10.0
+HEDGE_MIN = 0.25           # never hedge a read sooner than this
+HEDGE_MAX = 2.0
+BREAKER_FAILURES = 5
+BREAKER_COOLDOWN = 30.0
+POOL_WORKERS = 32
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpen(ConnectionError):
+    pass
+
+
+def _status(ex):
+    # HTTP status behind a requests/pyrebase error, if any
+    for e in (ex, *(a for a in getattr(ex, "args", ()) if isinstance(a, BaseException))):
+        resp = getattr(e, "response", None)
+        code = getattr(resp, "status_code", None)
+        if code is not None:
+            return code
+    return None
+
+
+def is_transient(ex):
+    if isinstance(ex, (DeadlineExceeded, CircuitOpen, TimeoutError)):
+        return True
+    if isinstance(ex, sqlite3.OperationalError):
+        return "locked" in str(ex) or "busy" in str(ex)
+    code = _status(ex)
+    if code is not None:
+        return code == 429 or code >= 500
+    return isinstance(ex, (ConnectionError, OSError))
+
+
+class RetryBudget:
+    def __init__(self, ratio=RETRY_RATIO, cap=RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.cap = cap
+        self._tokens = cap
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self._tokens = min(self.cap, self._tokens + self.ratio)
+
+    def spend(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._streak = 0
+        self._opened_at = None
+        self._trial = False
+        self.opened = 0  # times it opened, for the admin panel
+
+    @property
+    def state(self):
+        # "closed" | "open" | "half-open"
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._trial:
+                return False
+            self._trial = True  # one probe at a time
+            return True
+
+    def success(self):
+        with self._lock:
+            self._streak, self._opened_at, self._trial = 0, None, False
+
+    def failure(self):
+        with self._lock:
+            self._streak += 1
+            if self._trial or (self._opened_at is None and self._streak >= self.failures):
+                if self._opened_at is None:
+                    self.opened += 1
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class _Caller:
+    # shared machinery for ResilientStorage / ResilientAuth
+    def __init__(self, prefix, breaker=None, budget=None, pool=None):
+        self.prefix = prefix
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = budget or RetryBudget()
+        self._pool = pool or ThreadPoolExecutor(max_workers=POOL_WORKERS, thread_name_prefix=prefix)
+        self._lock = threading.Lock()
+        self._abandoned = []  # futures of writes that missed their deadline
+
+    def _settle(self, deadline):
+        # wait for abandoned writes, so none of them lands after the next one; -> seconds waited
+        with self._lock:
+            pending, self._abandoned = self._abandoned, []
+        if not pending:
+            return 0.0
+        start = time.perf_counter()
+        _, left = wait(pending, timeout=deadline)
+        if left:
+            with self._lock:
+                self._abandoned.extend(left)
+            raise DeadlineExceeded(f"{self.prefix}: an earlier write is still in flight")
+        return time.perf_counter() - start
+
+    def _attempt(self, op, fn, deadline, hedge, settle=False):
+        # one try, optionally hedged; -> result or raises
+        start = time.perf_counter()
+        futures = [self._pool.submit(fn)]
+        try:
+            if hedge is not None:
+                done, _ = wait(futures, timeout=min(hedge, deadline))
+                if not done and self.budget.spend():
+                    futures.append(self._pool.submit(fn))
+                    METRICS.record(f"{self.prefix}.{op}.hedged", 0.0)
+            left = deadline - (time.perf_counter() - start)
+            while futures and left > 0:
+                done, pending = wait(futures, timeout=left, return_when=FIRST_COMPLETED)
+                for f in done:
+                    if f.exception() is None:
+                        return f.result()
+                if not pending:
+                    raise next(iter(done)).exception()  # every copy failed
+                futures = list(pending)
+                left = deadline - (time.perf_counter() - start)
+            if settle:
+                with self._lock:
+                    self._abandoned.extend(futures)
+            raise DeadlineExceeded(f"{self.prefix}.{op} took longer than {deadline:g} s")
+        finally:
+            METRICS.record(f"{self.prefix}.{op}", time.perf_counter() - start)
+
+    def call(self, op, fn, deadline, retry=True, hedge=None, settle=False):
+        # settle: a write; waits for abandoned ones first and is abandoned itself on a timeout
+        self.budget.earn()
+        if not self.breaker.allow():
+            raise CircuitOpen(f"{self.prefix} unavailable, retrying in a moment")
+        if settle:
+            deadline -= self._settle(deadline)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = self._attempt(op, fn, deadline, hedge, settle)
+            except Exception as ex:
+                if not is_transient(ex):
+                    self.breaker.success()  # it answered
+                    raise
+                self.breaker.failure()
+                if (not retry or attempt >= MAX_ATTEMPTS or not self.breaker.allow()
+                        or not self.budget.spend()):
+                    raise
+                time.sleep(RETRY_BASE * 2 ** (attempt - 1) * (0.5 + random.random()))
+                continue
+            self.breaker.success()
+            return result
+
+
+class ResilientStorage(StorageBackend):
+    # wraps a StorageBackend; `offline(path, shallow)` -> cached value or MISS, used while it's down
+    def __init__(self, backend, offline=None, breaker=None, budget=None):
+        self.backend = backend
+        self.name = backend.name
+        self.offline = offline
+        self._caller = _Caller("db", breaker, budget)
+        self.breaker = self._caller.breaker
+        self.stale_reads = 0
+
+    def child(self, *args):
+        return Ref(self).child(*args)
+
+    def _hedge_after(self):
+        p95 = METRICS.percentile("db.read", 0.95)
+        return min(HEDGE_MAX, max(HEDGE_MIN, 1.5 * p95)) if p95 else HEDGE_MIN * 4
+
+    def read(self, path, token=None, shallow=False):
+        try:
+            return self._caller.call("read", lambda: self.backend.read(path, token, shallow=shallow),
+                                     READ_DEADLINE, hedge=self._hedge_after())
+        except Exception as ex:
+            if self.offline is None or not is_transient(ex):
+                raise
+            value = self.offline(path, shallow)
+            if value is MISS:
+                raise
+            self.stale_reads += 1
+            return value
+
+    def write(self, path, data, token=None):
+        return self._caller.call("write", lambda: self.backend.write(path, data, token), WRITE_DEADLINE,
+                                 retry=False, settle=True)
+
+    def patch(self, path, data, token=None):
+        return self._caller.call("patch", lambda: self.backend.patch(path, data, token), WRITE_DEADLINE,
+                                 retry=False, settle=True)
+
+    def delete(self, path, token=None):
+        return self._caller.call("delete", lambda: self.backend.delete(path, token), WRITE_DEADLINE,
+                                 retry=False, settle=True)
+
+    def stream(self, path, handler, token=None):
+        # long-lived; livesync.py supervises it
+        if not self.breaker.allow():
+            raise CircuitOpen("db unavailable")
+        try:
+            stream = self.backend.stream(path, handler, token)
+        except Exception as ex:
+            # report back like call() does, or a half-open trial would never end
+            if is_transient(ex):
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+            raise
+        self.breaker.success()
+        return stream
+
+
+class ResilientAuth:
+    # wraps pyrebase's Auth / LocalAuth: deadline on every call; only refresh is retried
+    RETRIED = ("refresh", "get_account_info")
+
+    def __init__(self, auth, breaker=None, budget=None):
+        self.auth = auth
+        self._caller = _Caller("auth", breaker, budget)
+        self.breaker = self._caller.breaker
+
+    def __getattr__(self, name):
+        attr = getattr(self.auth, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self._caller.call(name, lambda: attr(*args, **kwargs), AUTH_DEADLINE,
+                                     retry=name in self.RETRIED)
+        return call
@@ -0,0 +1,164 @@
+# shared.py
+# One copy of each signed-in user's ledger state per process, shared by all
+# of that user's sessions (phone + tablet, several tabs).
+#
+# Sessions keep the shared objects in their own session state by reference,
+# so a second tab costs a few dict slots instead of another full ledger.
+# Writes are copy-on-write: before changing anything in place a session asks
+# for private copies of whatever is still shared (persistence.before_write),
+# changes those, saves, and publishes them as the new shared state. The other
+# sessions pick up the new objects on their next run and the old ones are
+# freed once nobody holds them. A session that is its user's only one skips
+# the copies.
+#
+# Sessions are counted per uid: attach() on every run, detach() on logout.
+# Tabs that just go away are dropped once is_alive(session_id) says so, or
+# after SESSION_IDLE_TTL without a run; a user with no sessions left is
+# forgotten.
+import threading
+import time
+
+from columnar import LedgerTable
+from persistence import LEDGER_VERSION, WRITE_HOOK
+
+SESSION_IDLE_TTL = 30 * 60  # seconds without a run before a session stops counting
+SHARED_SEEN = "_shared_seen"  # session state: (generation, ledger version) at the last pull/publish
+
+
+def _clone(v):
+    # deep enough that nothing the session mutates in place is shared
+    if isinstance(v, LedgerTable):
+        return v.copy()
+    if isinstance(v, dict):
+        return {k: _clone(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_clone(x) for x in v]
+    if isinstance(v, set):
+        return set(v)
+    return v
+
+
+class _User:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.data = {}       # key -> shared object
+        self.gen = 0         # bumped on every publish
+        self.sessions = {}   # session id -> last run (monotonic)
+
+
+class SharedStore:
+    def __init__(self, keys, is_alive=None, idle_ttl=SESSION_IDLE_TTL):
+        self.keys = tuple(keys)
+        self.is_alive = is_alive
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._users = {}
+
+    # ---- reference counting ----
+    def _live(self, sid, seen, now):
+        if self.is_alive is not None:
+            try:
+                return self.is_alive(sid)
+            except Exception:
+                pass
+        return now - seen < self.idle_ttl
+
+    def _prune(self, u, now):
+        for sid, seen in list(u.sessions.items()):
+            if not self._live(sid, seen, now):
+                del u.sessions[sid]
+
+    def _user(self, uid):
+        with self._lock:
+            u = self._users.get(uid)
+            if u is None:
+                u = self._users[uid] = _User()
+            return u
+
+    def attach(self, uid, sid, state):
+        # every run of an authenticated session; installs the copy-on-write hook
+        u = self._user(uid)
+        with u.lock:
+            u.sessions[sid] = time.monotonic()
+        state[WRITE_HOOK] = lambda s, uid=uid, sid=sid: self._before_write(uid, sid, s)
+        self._collect()
+
+    def detach(self, uid, sid):
+        with self._lock:
+            u = self._users.get(uid)
+            if u is None:
+                return
+            with u.lock:
+                u.sessions.pop(sid, None)
+                if not u.sessions:
+                    del self._users[uid]
+
+    def _collect(self):
+        # forget users whose sessions are all gone
+        now = time.monotonic()
+        with self._lock:
+            for uid, u in list(self._users.items()):
+                with u.lock:
+                    self._prune(u, now)
+                    if not u.sessions:
+                        del self._users[uid]
+
+    def sessions(self, uid):
+        with self._lock:
+            u = self._users.get(uid)
+        return len(u.sessions) if u else 0
+
+    # ---- state ----
+    def has_data(self, uid):
+        with self._lock:
+            u = self._users.get(uid)
+        return bool(u and u.data)
+
+    def publish(self, uid, state):
+        # this session's state becomes the shared one
+        u = self._user(uid)
+        with u.lock:
+            u.data = {k: state[k] for k in self.keys if k in state}
+            u.gen += 1
+            state[SHARED_SEEN] = (u.gen, state.get(LEDGER_VERSION))
+
+    def pull(self, uid, state):
+        # adopt the shared objects; -> False if there is nothing to adopt
+        u = self._user(uid)
+        with u.lock:
+            if not u.data:
+                return False
+            for k in self.keys:
+                if k in u.data:
+                    state[k] = u.data[k]
+                else:
+                    state.pop(k, None)
+            state[SHARED_SEEN] = (u.gen, state.get(LEDGER_VERSION))
+            return True
+
+    def sync(self, uid, state):
+        # start of a run: publish what this session changed, else pick up what others did
+        # -> "published" | "pulled" | None
+        u = self._user(uid)
+        with u.lock:
+            gen, version = state.get(SHARED_SEEN) or (None, None)
+            if gen is None and not u.data:
+                self.publish(uid, state)  # first session of this user
+                return "published"
+            if gen is not None and state.get(LEDGER_VERSION) != version:
+                self.publish(uid, state)  # last writer wins if two tabs changed the same run
+                return "published"
+            if u.data and u.gen != gen:
+                self.pull(uid, state)
+                return "pulled"
+        return None
+
+    def _before_write(self, uid, sid, state):
+        u = self._user(uid)
+        with u.lock:
+            self._prune(u, time.monotonic())
+            if not any(s != sid for s in u.sessions):
+                return  # nobody else holds these objects
+            for k in self.keys:
+                if k in u.data and state.get(k) is u.data[k]:
+                    state[k] = _clone(state[k])
@@ -0,0 +1,551 @@
+# storage.py
+# Storage backends behind the `db` handle used by streamlit_app.py.
+#
+# Every backend speaks the same pyrebase-style path API the app already uses:
+#     db.child("users").child(uid).child("app").get(token).val()
+#     db.child("users").child(uid).child("app").update({"log/3": {...}}, token)
+#     ...set(data, token) / ...remove(token)
+#
+#   FirebaseStorage - the pyrebase Realtime Database (production)
+#   SQLiteStorage   - one local file, for self-hosting and fast local reads
+#   MemoryStorage   - in-process stand-in, for offline runs and benchmarks
+#
+# The two local engines reproduce what the Firebase REST API does with JSON:
+# lists are stored as {"0": .., "1": ..} objects, None / empty containers
+# delete the node, integral floats read back as ints, and dense integer-keyed
+# objects read back as lists.
+#
+# ref.stream(handler, token) follows a node like pyrebase's stream(): the
+# handler gets {"event": "put"|"patch"|"keep-alive"|..., "path", "data"} on a
+# background thread, starting with a "put" of the whole node. The local
+# engines deliver their own writes the same way.
+import copy
+import hashlib
+import json
+import queue
+import secrets
+import sqlite3
+import threading
+
+
+# ------------------------- Paths & JSON tree -------------------------
+def _split(path):
+    return [p for p in str(path or "").split("/") if p]
+
+
+def _join(*parts):
+    return "/".join(p for p in (str(x).strip("/") for x in parts) if p)
+
+
+def _normalize(v):
+    # Python value -> stored tree (dicts with str keys + scalars), None if empty
+    if isinstance(v, (list, tuple)):
+        v = {str(i): x for i, x in enumerate(v)}
+    if isinstance(v, dict):
+        out = {}
+        for k, x in v.items():
+            x = _normalize(x)
+            if x is not None:
+                out[str(k)] = x
+        return out or None
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return v
+
+
+def _denormalize(node):
+    # stored tree -> what a Firebase REST read returns
+    if not isinstance(node, dict):
+        return node
+    out = {k: _denormalize(x) for k, x in node.items()}
+    if out and all(k.isdigit() for k in out):
+        idx = [int(k) for k in out]
+        if max(idx) < 2 * len(idx):
+            arr = [None] * (max(idx) + 1)
+            for k, x in out.items():
+                arr[int(k)] = x
+            return arr
+    return out
+
+
+# ------------------------- pyrebase-style handle -------------------------
+class Response:
+    # Subset of pyrebase.PyreResponse the app relies on
+    def __init__(self, value, key=None):
+        self._value = value
+        self._key = key
+
+    def val(self):
+        return self._value
+
+    def key(self):
+        return self._key
+
+
+class Ref:
+    # Immutable path reference; unlike pyrebase's Database builder it is safe to
+    # share between threads because child() returns a new object.
+    def __init__(self, backend, path="", shallow=False):
+        self._backend = backend
+        self.path = path
+        self._shallow = shallow
+
+    def child(self, *args):
+        return Ref(self._backend, _join(self.path, *args), self._shallow)
+
+    def shallow(self):
+        return Ref(self._backend, self.path, True)
+
+    def get(self, token=None):
+        key = self.path.split("/")[-1] if self.path else None
+        return Response(self._backend.read(self.path, token, shallow=self._shallow), key)
+
+    def set(self, data, token=None):
+        self._backend.write(self.path, data, token)
+        return data
+
+    def update(self, data, token=None):
+        self._backend.patch(self.path, data, token)
+        return data
+
+    def remove(self, token=None):
+        self._backend.delete(self.path, token)
+
+    def stream(self, handler, token=None):
+        # -> object with close()
+        return self._backend.stream(self.path, handler, token)
+
+
+class StorageBackend:
+    name = "base"
+
+    def child(self, *args):
+        return Ref(self).child(*args)
+
+    def read(self, path, token=None, shallow=False):
+        raise NotImplementedError
+
+    def write(self, path, data, token=None):
+        raise NotImplementedError
+
+    def patch(self, path, data, token=None):
+        # multi-path update: every key is a relative path
+        for k, v in (data or {}).items():
+            self.write(_join(path, k), v, token)
+
+    def delete(self, path, token=None):
+        self.write(path, None, token)
+
+    # -- local streams (MemoryStorage, SQLiteStorage); call _emit with the write lock held --
+    def stream(self, path, handler, token=None):
+        s = _LocalStream(self, _join(path), handler)
+        with self._lock:
+            self.__dict__.setdefault("_streams", []).append(s)
+            s.send({"event": "put", "path": "/", "data": self.read(s.path)})
+        s.thread.start()
+        return s
+
+    def _unlisten(self, s):
+        with self._lock:
+            streams = self.__dict__.get("_streams") or []
+            if s in streams:
+                streams.remove(s)
+
+    def _emit(self, path, event, data):
+        for s in self.__dict__.get("_streams") or ():
+            for msg in _stream_events(s.path, _join(path), event, data):
+                s.send(msg)
+
+
+# ------------------------- Streaming -------------------------
+STREAM_KEEPALIVE = 30.0  # seconds between keep-alive events, as the Firebase server sends them
+
+
+def _wire(v):
+    # what a Firebase stream would carry for `v`
+    return _denormalize(_normalize(v))
+
+
+def _relative(base, path):
+    # `path` relative to `base` ("" if equal), None if it is not under it
+    if not base or path == base:
+        return path if not base else ""
+    return path[len(base) + 1:] if path.startswith(base + "/") else None
+
+
+def _pick(value, rel):
+    for p in _split(rel):
+        value = value.get(p) if isinstance(value, dict) else None
+    return value
+
+
+def _stream_events(listen, path, event, data):
+    # events a stream on `listen` sees for a put of `data` at `path` / a patch of `data` under `path`
+    rel = _relative(listen, path)
+    if rel is not None:
+        if event == "patch":
+            return [{"event": "patch", "path": "/" + rel, "data": {k: _wire(v) for k, v in data.items()}}]
+        return [{"event": "put", "path": "/" + rel, "data": _wire(data)}]
+    below = _relative(path, listen)
+    if below is None:
+        return []
+    if event == "put":
+        return [{"event": "put", "path": "/", "data": _wire(_pick(_normalize(data), below))}]
+    out, puts = {}, []
+    for k, v in data.items():
+        full = _join(path, k)
+        r = _relative(listen, full)
+        if r:
+            out[r] = _wire(v)
+        elif _relative(full, listen) is not None:
+            puts.append({"event": "put", "path": "/", "data": _wire(_pick(_normalize(v), _relative(full, listen)))})
+    return ([{"event": "patch", "path": "/", "data": out}] if out else []) + puts
+
+
+class _LocalStream:
+    # delivers events in order on its own thread, with keep-alives while idle
+    def __init__(self, backend, path, handler):
+        self.path = path
+        self._backend = backend
+        self._handler = handler
+        self._queue = queue.Queue()
+        self._closed = False
+        self.thread = threading.Thread(target=self._run, name=f"stream-{path}", daemon=True)
+
+    def send(self, msg):
+        self._queue.put(msg)
+
+    def _run(self):
+        while not self._closed:
+            try:
+                msg = self._queue.get(timeout=STREAM_KEEPALIVE)
+            except queue.Empty:
+                msg = {"event": "keep-alive", "path": None, "data": None}
+            if msg is None or self._closed:
+                break
+            try:
+                self._handler(msg)
+            except Exception:
+                pass  # like a server stream: one bad handler call doesn't end it
+
+    def close(self):
+        self._closed = True
+        self._backend._unlisten(self)
+        self._queue.put(None)
+        return self
+
+
+class _FirebaseStream:
+    # pyrebase's Stream loop, without its crash on keep-alive events (their
+    # data is JSON null); a dropped connection is reported as "error"/"closed"
+    def __init__(self, url, handler, build_headers):
+        self._closed = False
+        self.sse = None
+        self._url = url
+        self._handler = handler
+        self._build_headers = build_headers
+        self.thread = threading.Thread(target=self._run, name="firebase-stream", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        from pyrebase.pyrebase import ClosableSSEClient, KeepAuthSession
+        try:
+            self.sse = ClosableSSEClient(self._url, session=KeepAuthSession(), build_headers=self._build_headers)
+            for msg in self.sse:
+                if self._closed:
+                    return
+                if not msg:
+                    continue
+                body = json.loads(msg.data) if msg.data else None
+                if not isinstance(body, dict):
+                    body = {"path": None, "data": body}
+                body["event"] = msg.event
+                self._handler(body)
+        except Exception as ex:
+            if not self._closed:
+                self._handler({"event": "error", "path": None, "data": str(ex)})
+            return
+        if not self._closed:
+            self._handler({"event": "closed", "path": None, "data": None})
+
+    def close(self):
+        self._closed = True
+        try:
+            if self.sse is not None:
+                self.sse.close()
+        except Exception:
+            pass
+        return self
+
+
+# ------------------------- Firebase -------------------------
+class FirebaseStorage(StorageBackend):
+    name = "firebase"
+
+    def __init__(self, db):
+        self._db = db  # pyrebase Database
+
+    def _ref(self, path):
+        # pyrebase keeps path/query on the Database object; work on a copy
+        ref = copy.copy(self._db)
+        ref.path = ""
+        ref.build_query = {}
+        return ref.child(path) if path else ref
+
+    def read(self, path, token=None, shallow=False):
+        ref = self._ref(path)
+        if shallow:
+            ref = ref.shallow()
+        val = ref.get(token).val()
+        return list(val) if shallow and val is not None else val
+
+    def write(self, path, data, token=None):
+        if data is None:
+            return self._ref(path).remove(token)
+        return self._ref(path).set(data, token)
+
+    def patch(self, path, data, token=None):
+        return self._ref(path).update(data, token)
+
+    def delete(self, path, token=None):
+        return self._ref(path).remove(token)
+
+    def stream(self, path, handler, token=None):
+        return _FirebaseStream(self._ref(path).build_request_url(token), handler, self._db.build_headers)
+
+
+# ------------------------- In-memory stand-in -------------------------
+class MemoryStorage(StorageBackend):
+    name = "memory"
+
+    def __init__(self, data=None):
+        self._lock = threading.RLock()
+        self._root = _normalize(data) or {}
+
+    def _node(self, parts):
+        node = self._root
+        for p in parts:
+            if not isinstance(node, dict) or p not in node:
+                return None
+            node = node[p]
+        return node
+
+    def read(self, path, token=None, shallow=False):
+        with self._lock:
+            node = self._node(_split(path))
+            if shallow and isinstance(node, dict):
+                return list(node)
+            return _denormalize(copy.deepcopy(node))
+
+    def _write(self, path, data):
+        value = _normalize(data)
+        parts = _split(path)
+        if not parts:
+            self._root = value if isinstance(value, dict) else {}
+            return
+        if value is None:
+            self._prune(parts)
+            return
+        node = self._root
+        for p in parts[:-1]:
+            if not isinstance(node.get(p), dict):
+                node[p] = {}
+            node = node[p]
+        node[parts[-1]] = value
+
+    def write(self, path, data, token=None):
+        with self._lock:
+            self._write(path, data)
+            self._emit(path, "put", data)
+
+    def patch(self, path, data, token=None):
+        with self._lock:
+            for k, v in (data or {}).items():
+                self._write(_join(path, k), v)
+            self._emit(path, "patch", data or {})
+
+    def _prune(self, parts):
+        # remove the leaf, then any ancestors left empty (Firebase has no empty nodes)
+        trail = [self._root]
+        for p in parts[:-1]:
+            nxt = trail[-1].get(p) if isinstance(trail[-1], dict) else None
+            if not isinstance(nxt, dict):
+                return
+            trail.append(nxt)
+        trail[-1].pop(parts[-1], None)
+        for i in range(len(trail) - 1, 0, -1):
+            if trail[i]:
+                break
+            trail[i - 1].pop(parts[i - 1], None)
+
+    def dump(self):
+        with self._lock:
+            return _denormalize(copy.deepcopy(self._root))
+
+
+# ------------------------- SQLite -------------------------
+class SQLiteStorage(StorageBackend):
+    # One row per leaf value, keyed by its full path ("users/<uid>/app/log/3/amount").
+    # A subtree read is a primary-key range scan; writes replace the subtree.
+    name = "sqlite"
+
+    def __init__(self, filename="balls_logistics.db"):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS nodes (path TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID")
+
+    @staticmethod
+    def _range(path):
+        # all descendants of `path`: '/' sorts right before '0'
+        return (path + "/", path + "0") if path else ("", "\U0010ffff")
+
+    def _rows(self, path):
+        lo, hi = self._range(path)
+        return self._conn.execute(
+            "SELECT path, value FROM nodes WHERE path = ? OR (path >= ? AND path < ?)", (path, lo, hi)
+        ).fetchall()
+
+    def read(self, path, token=None, shallow=False):
+        path = _join(path)
+        with self._lock:
+            rows = self._rows(path)
+        if not rows:
+            return None
+        skip = len(path) + 1 if path else 0
+        root = {}
+        for p, raw in rows:
+            if p == path:
+                return json.loads(raw)
+            parts = p[skip:].split("/")
+            node = root
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            node[parts[-1]] = json.loads(raw)
+        if shallow:
+            return list(root)
+        return _denormalize(root)
+
+    def _delete_subtree(self, path):
+        lo, hi = self._range(path)
+        self._conn.execute("DELETE FROM nodes WHERE path = ? OR (path >= ? AND path < ?)", (path, lo, hi))
+        # a scalar stored at an ancestor is replaced by the new object
+        parts = _split(path)
+        for i in range(1, len(parts)):
+            self._conn.execute("DELETE FROM nodes WHERE path = ?", ("/".join(parts[:i]),))
+
+    def _insert(self, path, value):
+        rows = []
+
+        def walk(prefix, v):
+            if isinstance(v, dict):
+                for k, x in v.items():
+                    walk(f"{prefix}/{k}" if prefix else k, x)
+            else:
+                rows.append((prefix, json.dumps(v)))
+
+        walk(path, value)
+        self._conn.executemany("INSERT OR REPLACE INTO nodes (path, value) VALUES (?, ?)", rows)
+
+    def _write(self, path, data):
+        self._delete_subtree(path)
+        value = _normalize(data)
+        if value is not None:
+            self._insert(path, value)
+
+    def write(self, path, data, token=None):
+        path = _join(path)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._write(path, data)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._emit(path, "put", data)
+
+    def patch(self, path, data, token=None):
+        # one transaction, like Firebase's atomic multi-path update
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for k, v in (data or {}).items():
+                    self._write(_join(path, k), v)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._emit(path, "patch", data or {})
+
+
+# ------------------------- Local auth stand-in -------------------------
+class LocalAuthError(Exception):
+    pass
+
+
+class LocalAuth:
+    # Enough of pyrebase's Auth for the login/register/reset/cookie flows.
+    # Accounts live in the same backend under "_auth" so a SQLite file is self-contained.
+    EXPIRES_IN = 3600
+
+    def __init__(self, backend):
+        self._db = backend
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _email_key(email):
+        return hashlib.sha256((email or "").strip().lower().encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _hash(password, salt):
+        return hashlib.pbkdf2_hmac("sha256", (password or "").encode("utf-8"), salt.encode("utf-8"), 100_000).hex()
+
+    def _issue(self, uid, email):
+        refresh = secrets.token_urlsafe(32)
+        self._db.child("_auth", "refresh", refresh).set({"uid": uid, "email": email})
+        return {
+            "localId": uid,
+            "email": email,
+            "idToken": secrets.token_urlsafe(32),
+            "refreshToken": refresh,
+            "expiresIn": str(self.EXPIRES_IN),
+        }
+
+    def create_user_with_email_and_password(self, email, password):
+        if not password or len(password) < 6:
+            raise LocalAuthError("WEAK_PASSWORD : Password should be at least 6 characters")
+        key = self._email_key(email)
+        with self._lock:
+            if self._db.child("_auth", "users", key).get().val():
+                raise LocalAuthError("EMAIL_EXISTS")
+            uid = secrets.token_hex(14)
+            salt = secrets.token_hex(8)
+            self._db.child("_auth", "users", key).set(
+                {"uid": uid, "email": email, "salt": salt, "hash": self._hash(password, salt)}
+            )
+        return {"localId": uid, "email": email}
+
+    def sign_in_with_email_and_password(self, email, password):
+        rec = self._db.child("_auth", "users", self._email_key(email)).get().val()
+        if not rec or not secrets.compare_digest(rec.get("hash", ""), self._hash(password, rec.get("salt", ""))):
+            raise LocalAuthError("INVALID_LOGIN_CREDENTIALS")
+        return self._issue(rec["uid"], rec.get("email", email))
+
+    def refresh(self, refresh_token):
+        rec = self._db.child("_auth", "refresh", refresh_token).get().val() if refresh_token else None
+        if not rec:
+            raise LocalAuthError("INVALID_REFRESH_TOKEN")
+        return {
+            "userId": rec["uid"],
+            "idToken": secrets.token_urlsafe(32),
+            "refreshToken": refresh_token,
+            "expiresIn": str(self.EXPIRES_IN),
+        }
+
+    def send_password_reset_email(self, email):
+        # nothing to send locally; behave like Firebase for unknown accounts
+        if not self._db.child("_auth", "users", self._email_key(email)).get().val():
+            raise LocalAuthError("EMAIL_NOT_FOUND")
+        return {"email": email}
@@ -1,14 +1,18 @@
 # streamlit_app.py — iPhone-optimized (compact, responsive)
+import importlib
 import json
+import os
+import threading
+import time
 from datetime import datetime
 from io import StringIO
+from pathlib import Path
 
-import altair as alt
-import pandas as pd
 import streamlit as st
+import streamlit.components.v1 as components
 
 
-# ------------------------- Page & Global Styles -------------------------
+# ------------------------- Page Config -------------------------
 st.set_page_config(
     page_title="🚛 Real Balls Logistics Management",
     page_icon="🚛",
@@ -16,107 +20,231 @@ st.set_page_config(
     initial_sidebar_state="collapsed",
 )
 # Now it's safe to import things that might use st.*
-from firebase_config import get_firebase_clients     # <-- changed
-
-# Initialize Firebase clients after page_config is set
-firebase_app, auth, db = get_firebase_clients()
-
-
-st.markdown(
-    """
-    <style>
-      /* Global reset to avoid sideways overflow on iPhone */
-      * { box-sizing: border-box; }
-      html, body { max-width: 100%; overflow-x: hidden; touch-action: pan-y; }
-      [data-testid="stAppViewContainer"], [data-testid="stSidebar"], [data-testid="stToolbar"] { overflow-x: hidden; }
-
-      /* Base scale down; tighten paddings; mobile-first tweaks */
-      :root { --scale: .90; }
-      html, body, [data-testid="stAppViewContainer"] { font-size: calc(16px * var(--scale)); }
-
-      .block-container { padding: .6rem .6rem 2rem; max-width: 720px; width: 100%; margin: 0 auto; }
-      .stButton button, .stDownloadButton button { padding: .45rem .7rem; font-size: .92rem; border-radius: .6rem; }
-      .stTextInput input, .stNumberInput input { height: 36px; font-size: .95rem; }
-      [data-testid="stMetric"] { padding: .25rem .5rem; }
-      [data-testid="stMetricLabel"] p { font-size: .78rem; margin-bottom: 0; }
-      [data-testid="stMetricValue"] div { font-size: 1.05rem; }
-      [data-testid="stMetricDelta"] { font-size: .75rem; }
-
-      /* Horizontal nav: compact chips */
-      .nav-chip { display:inline-flex; align-items:center; gap:.35rem; padding:.45rem .6rem; border:1px solid var(--accent,#ddd); border-radius:.75rem; margin-right:.4rem; cursor:pointer; font-size:.95rem; background: white; }
-      .nav-chip.active { background: #eff6ff; border-color:#93c5fd; }
-      .nav-bar { overflow-x:auto; white-space:nowrap; padding-bottom:.25rem; margin-bottom:.35rem; }
-
-      /* Media elements & charts never overflow */
-      img, svg, canvas, video { max-width: 100%; height: auto; display: block; }
-      [data-testid="stHorizontalBlock"], [data-testid="stColumns"], .element-container { overflow-x: hidden; max-width: 100%; }
-
-      /* Inputs: remove number spinners */
-      input[type=number]::-webkit-outer-spin-button,
-      input[type=number]::-webkit-inner-spin-button { -webkit-appearance: none; margin: 0; }
-      input[type=number] { appearance: textfield; }
-
-      /* Headings smaller */
-      h1 { font-size: 1.6rem; margin:.45rem 0 .35rem; }
-      h2 { font-size: 1.05rem; margin:.45rem 0 .3rem; }
-      h3 { font-size: .95rem; margin:.4rem 0 .25rem; }
-
-      /* Mobile breakpoint */
-      @media (max-width: 430px) {
-        :root { --scale: .84; }
-        .block-container { max-width: 520px; padding:.5rem .5rem 2rem; }
-        .stButton button, .stDownloadButton button { padding:.4rem .55rem; font-size:.88rem; }
-        .stTextInput input, .stNumberInput input { height: 34px; font-size:.9rem; }
-      }
-    </style>
-    """,
-    unsafe_allow_html=True,
+from columnar import LEDGER_KEYS, LedgerTable, ledger_table
+from firebase_config import get_storage_backend_name, get_storage_clients
+from persistence import (
+    DEFAULT_PARTS_ROOT, LEDGER_VERSION, PARTS_ROOT, TRACKING_KEYS, WRITE_HOOK, apply_delta, before_write,
+    build_delta, mark_all_dirty, mark_dirty, mark_record, mark_synced, parts_root,
 )
+from backup import EXPORT_FORMATS, IMPORT_KEY, export_backup, import_backup
+from bootstrap import run_steps
+from doccache import MISS, VERSION_KEY, DocCache, new_version, stamp
+from events import EVENT_KEYS, maybe_snapshot, rebase, restore, take_snapshot
+from instrument import METRICS, begin, finish_profile, start_profile, timed
+from journal import Journal
+from resilient import ResilientAuth, ResilientStorage
+from livesync import LIVE_APPLIED, LIVE_POLL_SECONDS, LiveSync
+from shared import SHARED_SEEN, SharedStore
+from sync import WriteBehindQueue
+from tokens import TokenManager
+from viewcache import ViewCache
+from ledger import (
+    LAST_TRIP, add_earning, add_expense, add_trip, aggregates, delete_expense,
+    delete_log_entry, empty_aggregates, rebuild_expense_index,
+    ensure_aggregates, ensure_rollups, first_data_month, first_index_on_or_after, last_index_on_or_before,
+    latest_expense, month_from_index, month_index, page_back, rollup_window, trip_drift, update_expense,
+    update_trip,
+)
+
+# ------------------------- Instrumentation -------------------------
+# Named sections are timed into a process-wide registry (see instrument.py);
+# admins see p50/p95 under Settings. With "Profile reruns" on, a session's
+# reruns are captured with cProfile as well.
+_rerun_done = begin("rerun")
+_profiler = None
+_interrupted = st.session_state.pop("_profiler", None)
+if _interrupted is not None:
+    # the last capture was cut short by st.stop()/st.rerun(): keep what it saw
+    st.session_state.last_profile = finish_profile(_interrupted)
+if st.session_state.get("profile_reruns"):
+    _profiler = start_profile()
+    if _profiler is not None:
+        st.session_state._profiler = _profiler
+
+
+def _metrics_textfile():
+    # BL_METRICS_TEXTFILE (env) wins over METRICS_TEXTFILE (secrets); unset = no file
+    try:
+        return os.environ.get("BL_METRICS_TEXTFILE") or st.secrets.get("METRICS_TEXTFILE")
+    except Exception:
+        return None
 
 
-# --- Account bar styles (email without parentheses + wide Logout) ---
-st.markdown(
-    """
-    <style>
-      .account-row{
-        display:flex; align-items:center; justify-content:space-between;
-        gap:.5rem; margin:.25rem 0 .35rem 0; overflow:hidden;
-      }
-
-      /* container takes remaining width */
-      .account-row .email{
-        flex:1; min-width:0; display:flex; align-items:center;
-      }
-
-      /* clamp the actual text; no horizontal scroll on iOS */
-      .account-row .email .email-text{
-        display:block; max-width:100%;
-        overflow:hidden; text-overflow:ellipsis; white-space:nowrap;
-        overscroll-behavior-x: contain;           /* prevent sideways panning */
-        -webkit-overflow-scrolling: auto;         /* disable momentum scroll */
-      }
-      /* if Streamlit ever injects a <p>, clamp that too */
-      .account-row .email p{
-        margin:0; max-width:100%;
-        overflow:hidden; text-overflow:ellipsis; white-space:nowrap;
-      }
-
-      .account-row .logout-link{
-        flex:0 0 auto; display:inline-flex; align-items:center;
-        padding:.35rem .6rem; border:1px solid #e5e7eb; border-radius:10px; text-decoration:none;
-      }
-      @media (prefers-color-scheme: dark){
-        .account-row .logout-link{ border-color:#374151; color:#e5e7eb; }
-      }
-    </style>
-    """,
-    unsafe_allow_html=True,
-)
+def finish_rerun():
+    # end-of-run bookkeeping; also called before st.stop() on the login screen
+    _rerun_done()
+    if _profiler is not None and st.session_state.get("_profiler") is _profiler:
+        del st.session_state["_profiler"]
+        st.session_state.last_profile = finish_profile(_profiler)
+    path = _metrics_textfile()
+    if path:
+        try:
+            METRICS.write_textfile(path)
+        except OSError:
+            pass  # a scrape target must never break the app
+
+
+def _is_admin():
+    # ADMIN_EMAILS in secrets: a list or a comma-separated string
+    try:
+        admins = st.secrets.get("ADMIN_EMAILS", [])
+    except Exception:
+        return False
+    if isinstance(admins, str):
+        admins = admins.split(",")
+    email = ((st.session_state.get("user") or {}).get("email") or "").strip().lower()
+    return bool(email) and email in {str(a).strip().lower() for a in admins}
+
+
+@st.cache_resource
+def get_doc_cache():
+    # last-read /app and partitions per uid, reused while /users/<uid>/version is unchanged
+    return DocCache()
+
+
+@st.cache_resource
+def get_clients():
+    # deadlines, retries, hedged reads and a circuit breaker around every call
+    # (see resilient.py); during an outage reads come from the doc cache
+    app, auth, db = get_storage_clients()
+    return app, ResilientAuth(auth), ResilientStorage(db, offline=get_doc_cache().stale)
+
+
+# Initialize storage clients after page_config is set.
+# `db` is a storage backend (Firebase, SQLite or in-memory) with the pyrebase path API.
+firebase_app, auth, db = get_clients()
+
+
+@st.cache_resource
+def get_token_manager():
+    # cached ID tokens per uid, refreshed in the background before they expire
+    return TokenManager(auth)
+
+
+def _journal_dir():
+    # BL_JOURNAL_DIR (env) wins over JOURNAL_DIR (secrets)
+    try:
+        return os.environ.get("BL_JOURNAL_DIR") or st.secrets.get("JOURNAL_DIR", "journal")
+    except Exception:
+        return "journal"
+
+
+@st.cache_resource
+def get_write_queue():
+    # one background writer per uid, shared by every session in this process.
+    # Unsent changes are journaled to disk (see journal.py); the in-memory
+    # backend would not outlive a restart anyway.
+    journal = Journal(_journal_dir()) if get_storage_backend_name() != "memory" else None
+    queue = WriteBehindQueue(db, tokens=get_token_manager(), doc_cache=get_doc_cache(), journal=journal)
+    queue.resume()  # what a previous run left unsent, whether or not its users come back
+    return queue
+
+
+get_write_queue()  # replay the journal when the server starts, not on the next sign-in
+
+
+def _session_alive(session_id):
+    # a tab that was closed is gone from the runtime; off-server (tests) fall back to idle time
+    from streamlit import runtime
+    if not runtime.exists():
+        raise LookupError("no runtime")
+    return runtime.get_instance().is_active_session(session_id)
+
+
+def _session_id():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else "local"
+
+
+@st.cache_resource
+def get_shared_store():
+    # one copy of each user's ledgers for all of their sessions (see shared.py)
+    return SharedStore(SHARED_KEYS, is_alive=_session_alive)
+
+
+RECENT_PARTITIONS = 3  # newest monthly partitions fetched at login
+
+
+@st.cache_resource
+def get_live_sync():
+    # one database stream per uid with live sync on, feeding the doc cache (see livesync.py)
+    return LiveSync(db, tokens=get_token_manager(), doc_cache=get_doc_cache())
+
+
+@st.cache_resource
+def get_view_cache():
+    # chart specs / formatted tables per uid, reused until the ledger version changes
+    return ViewCache()
+
+
+# pandas / altair / numpy cost ~0.7 s to import and only the expenses and
+# earnings pages need them, so those pages import them on first use. This
+# warms them in the background at server start so the first visit finds them
+# in sys.modules instead of paying for it on the script thread.
+PREWARM_MODULES = ("numpy", "pandas", "altair")
+
+
+@st.cache_resource
+def prewarm_heavy_modules():
+    def _warm():
+        for name in PREWARM_MODULES:
+            try:
+                importlib.import_module(name)
+            except Exception:
+                pass  # the page import reports it properly
+    t = threading.Thread(target=_warm, name="prewarm-imports", daemon=True)
+    t.start()
+    return t
+
+
+prewarm_heavy_modules()
+
+
+# ------------------------- Styles -------------------------
+# Style sheets live in static/ and are pushed into the page <head> once per
+# browser session instead of being re-sent as <style> markdown on every rerun.
+# (Streamlit's static server sends .css as text/plain with nosniff, so a
+# <link> to app/static/... is ignored by the browser.)
+STYLE_DIR = Path(__file__).parent / "static"
+
+
+@st.cache_resource
+def _style_sheet(name):
+    return (STYLE_DIR / name).read_text(encoding="utf-8")
+
+
+def use_style_sheet(name, enabled=True):
+    # installs (or removes, with enabled=False) <style id="bl-<name>"> in the parent document
+    flag = f"_style_{name}"
+    if st.session_state.get(flag, False) == enabled:
+        return
+    st.session_state[flag] = enabled
+    css = _style_sheet(name) if enabled else None
+    components.html(
+        f"""<script>
+        (function() {{
+          const doc = window.parent.document;
+          const id = {json.dumps("bl-" + name.replace(".", "-"))};
+          const css = {json.dumps(css)};
+          let el = doc.getElementById(id);
+          if (css === null) {{ if (el) el.remove(); return; }}
+          if (!el) {{ el = doc.createElement("style"); el.id = id; doc.head.appendChild(el); }}
+          el.textContent = css;
+        }})();
+        </script>""",
+        height=0,
+    )
+
 
+use_style_sheet("app.css")
 
 
 # ------------------------- Secrets Check -------------------------
-if not all(k in st.secrets for k in ["FIREBASE_API_KEY", "FIREBASE_APP_ID", "cookie_password"]):
+_required_secrets = ["cookie_password"]
+if get_storage_backend_name() == "firebase":
+    _required_secrets += ["FIREBASE_API_KEY", "FIREBASE_APP_ID"]
+if not all(k in st.secrets for k in _required_secrets):
     st.stop()
 
 
@@ -196,37 +324,62 @@ def _forget_persisted_user_in_browser():
 
 
 # ------------------------- Auth -------------------------
-def ensure_user_profile():
-    uid = st.session_state.user.get("localId")
-    token = st.session_state.user.get("idToken")
-    email = (st.session_state.user.get("email") or "").strip()
+def _id_token():
+    # current ID token for the signed-in user; the token manager refreshes it before it expires
+    user = st.session_state.get("user") or {}
+    return get_token_manager().token(user.get("localId")) or user.get("idToken")
+
+
+def _remember_tokens(user):
+    get_token_manager().register(user.get("localId"), user.get("idToken"), user.get("refreshToken"),
+                                 user.get("expiresIn"))
+
+
+def _profile_update(user, token):
+    # the write as a closure, so the bootstrap can run it off the script thread
+    uid = user.get("localId")
+    email = (user.get("email") or "").strip()
     display = (email.split("@")[0] if email else "User")[:100]
-    try:
-        # Only touches the top-level profile keys; app data is under /app
-        db.child("users").child(uid).update(
-            {"displayName": display, "email": email},
-            token
-        )
-    except Exception:
-        # non-fatal; app will still run, and we'll try again later
-        pass
+    # Only touches the top-level profile keys; app data is under /app
+    return lambda: db.child("users").child(uid).update({"displayName": display, "email": email}, token)
 
 APP_KEYS = [
     "baseline", "last_mileage", "total_miles", "total_cost", "total_gallons",
-    "last_trip_summary", "log", "expenses", "earnings"
+    "last_trip_summary", "log", "expenses", "earnings",
+    "aggregates",   # derived totals kept current on every write (see ledger.py)
+    "rollups",      # per-month sums for the Income chart (see ledger.py)
+    *EVENT_KEYS,    # log sequence numbers, snapshot of the trip totals, corrections (see events.py)
+    PARTS_ROOT,     # node the partitions live under, when not /parts (see persistence.py)
 ]
 # --- App-state clearing (prevents cross-user data bleed) ---
 APP_STATE_KEYS = set([
     # persisted data
     "baseline","last_mileage","total_miles","total_cost","total_gallons",
     "last_trip_summary","log","expenses","earnings","pending_changes",
+    "aggregates","rollups", PARTS_ROOT,
+    "expense_index",      # expense id -> (expense idx, log idx), rebuilt by load_data()
+    *EVENT_KEYS,          # event sequence / snapshot / corrections
+    LAST_TRIP,            # index of the newest Trip record (see ledger.py)
     # ui/ephemeral
     "income_chart_end_idx","trip_reset","exp_reset","earn_reset",
     "edit_expense_index","mileage","gallons","fuel_cost",
     "log_edit_expense_index","page","initialized",
     "nav_page_sel",       # left nav selection cache
     "reset_requested",    # confirmation state on Settings page
+    "log_page_size", "log_cursor", "log_cursor_hist", "exp_cursor", "exp_cursor_hist",  # Log page pagers
+    "log_date_range",
+    "bootstrap_timings",  # per-step seconds of the last sign-in
+    "profile_reruns", "last_profile", "admin_histogram",  # admin panel: cProfile toggle / last report / section
+    "live_sync", "live_sync_toggle", LIVE_APPLIED,  # live sync switch / last remote change applied
+    "save_error",         # last save_data() failure, shown in the sync status
+    "load_error",         # last load_data() failure, ditto
+    "import_pending", "import_result",  # unfinished backup import (marker) / outcome of the last one
+    "backup_format",      # Settings export: chosen format
+    *TRACKING_KEYS,       # dirty-key / dirty-record marks for save_data()
+    WRITE_HOOK, SHARED_SEEN,  # copy-on-write hook / last pull of the shared state
 ])
+# what the sessions of one user share (see shared.py); the rest is per tab
+SHARED_KEYS = [*APP_KEYS, "expense_index", LAST_TRIP, LIVE_APPLIED, *TRACKING_KEYS]
 
 def _clear_app_state():
     # remove all app-related keys; init_session will recreate defaults
@@ -235,6 +388,22 @@ def _clear_app_state():
 
 
 def _force_logout():
+    # make sure queued writes for this user reach the cloud before we forget them
+    user = st.session_state.get("user") or {}
+    uid = user.get("localId") or _read_persisted_user_from_browser().get("localId")
+    if uid:
+        try:
+            if user and st.session_state.get("pending_changes"):
+                save_data()
+            get_write_queue().flush(uid)
+            get_view_cache().drop(uid)
+            get_shared_store().detach(uid, _session_id())
+            if not get_shared_store().sessions(uid):
+                # last session of this user: other tabs still need the token
+                get_token_manager().forget(uid)
+                get_live_sync().stop(uid)
+        except Exception:
+            pass
     _clear_app_state()  # <<< wipe app data first
     st.session_state.user = None
     try: _forget_persisted_user_in_browser()
@@ -267,22 +436,143 @@ else:
 
 
 
+@timed("save_data")
 def save_data():
+    # Queue only what changed since the last load/save (see persistence.py);
+    # the per-user writer thread sends it (see sync.py)
     uid = st.session_state.user['localId']
-    token = st.session_state.user['idToken']
-    data = {k: st.session_state.get(k) for k in APP_KEYS}
-    db.child("users").child(uid).child("app").set(data, token)
-
-def load_data():
+    token = _id_token()
+    maybe_snapshot(st.session_state)
+    delta = build_delta(st.session_state, APP_KEYS)
+    if delta:
+        get_write_queue().submit(uid, delta, token)
+    mark_synced(st.session_state, APP_KEYS)
+
+
+def _partition_loader(uid, root):
+    # LedgerTable loader: one month of one ledger, fetched when it is first touched
+    cache = get_doc_cache()
+
+    def load(kind, mk):
+        path = f"{root}/{mk}/{kind}"
+        hit = cache.get(uid, path)
+        if hit is not MISS:
+            return hit
+        version = cache.current(uid)  # read before the fetch, so the doc is at least this new
+        token = _id_token()
+        with timed("db.partition"):
+            value = db.child("users").child(uid).child(root).child(mk).child(kind).get(token).val()
+        cache.put(uid, path, value, version)
+        return value
+    return load
+
+
+def _read_version(uid, users, token):
+    # the small node every queued write restamps; cached docs are valid while it is unchanged
+    with timed("db.version"):
+        version = users.child(VERSION_KEY).get(token).val()
+    get_doc_cache().check(uid, version)
+    return version
+
+
+def _doc_reader(cache, uid, users, token, version, path):
+    # network read of /users/<uid>/<path>, remembered under the version read before it
+    def read():
+        value = users.child(*path.split("/")).get(token).val()
+        cache.put(uid, path, value, version)
+        return value
+    return read
+
+
+_NOT_FETCHED = object()
+
+
+@timed("bootstrap")
+def bootstrap_session(profile=True):
+    # Sign-in / cookie restore. The version node is read first; whatever the
+    # doc cache holds for it is used as is. The profile write, the rest of
+    # /app + the partitions of the last few calendar months (the usual newest
+    # ones) and, if /app may be empty, the legacy probe then go out together;
+    # load_data() only reads what was missed. If another session of this user
+    # already holds the state at that version, it is shared instead of loaded.
+    user = st.session_state.user
+    uid, token = user["localId"], _id_token()
+    get_write_queue().flush(uid)
+    users = db.child("users").child(uid)
+    cache = get_doc_cache()
+    store = get_shared_store()
+    store.attach(uid, _session_id(), st.session_state)
+    started = time.perf_counter()
+    version = _read_version(uid, users, token)
+    version_secs = time.perf_counter() - started
+    if cache.current(uid) == version and store.pull(uid, st.session_state):
+        results, timings = run_steps({"profile": _profile_update(user, token)} if profile else {})
+        timings["version"] = version_secs
+        timings["total"] += version_secs
+        timings["shared"] = True
+        st.session_state.bootstrap_timings = timings
+        st.session_state.initialized = True
+        return
+    cur = month_index(datetime.now().strftime("%Y-%m"))
+    cached, steps = {}, {}
+    app = cache.get(uid, "app")
+    root = parts_root(app) if isinstance(app, dict) else DEFAULT_PARTS_ROOT  # a guess until /app is read
+    for path in ["app"] + [f"{root}/{month_from_index(cur - k)}" for k in range(RECENT_PARTITIONS)]:
+        hit = cache.get(uid, path)
+        if hit is MISS:
+            steps[path] = _doc_reader(cache, uid, users, token, version, path)
+        else:
+            cached[path] = hit
+    if not cached.get("app"):
+        steps["legacy"] = lambda: users.shallow().get(token).val()
+    if profile:
+        steps["profile"] = _profile_update(user, token)
+    results, timings = run_steps(steps)
+    results.update(cached)
+    timings["version"] = version_secs
+    timings["total"] += version_secs
+    timings["cached"] = len(cached)
+    for name, secs in timings.items():
+        if name not in ("total", "cached") and secs is not None:
+            METRICS.record("bootstrap." + name.split("/")[0], secs)
+    load_data(prefetched=results, version=version)
+    st.session_state.bootstrap_timings = timings
+    st.session_state.initialized = True  # the rerun that follows must not load again
+
+
+@timed("load_data")
+def load_data(prefetched=None, version=None):
     uid = st.session_state.user['localId']
-    token = st.session_state.user['idToken']
+    token = _id_token()
+    users = db.child("users").child(uid)
+    cache = get_doc_cache()
+    pre = prefetched or {}
+
+    def _fetch(name, read=None):
+        # the bootstrap's result if it got one, then the doc cache, otherwise read now
+        v = pre.get(name, _NOT_FETCHED)
+        if v is not _NOT_FETCHED and not isinstance(v, Exception):
+            return v
+        if read is not None:
+            return read()
+        hit = cache.get(uid, name)
+        return hit if hit is not MISS else _doc_reader(cache, uid, users, token, version, name)()
+
+    st.session_state.pop("load_error", None)
     try:
-        data = db.child("users").child(uid).child("app").get(token).val()
+        if prefetched is None:
+            # read our own queued writes back, not the state from before them
+            # (not while the database is down: they can't land, the cache has them)
+            if db.breaker.state == "closed":
+                get_write_queue().flush(uid)
+            version = _read_version(uid, users, token)
+        data = _fetch("app")
 
         # Fallback: load legacy (old location) and migrate
         if not data:
-            legacy = db.child("users").child(uid).get(token).val() or {}
-            legacy_app = {k: legacy.get(k) for k in APP_KEYS if k in legacy}
+            keys = _fetch("legacy", lambda: users.shallow().get(token).val()) or []
+            found, _ = run_steps({k: (lambda k=k: users.child(k).get(token).val()) for k in APP_KEYS if k in keys})
+            legacy_app = {k: v for k, v in found.items() if not isinstance(v, Exception)}
             if legacy_app:
                 data = legacy_app
                 # migrate to /app
@@ -290,12 +580,57 @@ def load_data():
                     db.child("users").child(uid).child("app").set(data, token)
                 except Exception:
                     pass
+                cache.drop(uid)
+
+        data = data or {}
+        # left behind by a backup import that didn't finish (see backup.py)
+        st.session_state.import_pending = data.pop(IMPORT_KEY, None)
+        for k in EVENT_KEYS:
+            if k not in data:
+                st.session_state.pop(k, None)  # saved before snapshots (see events.py)
+        st.session_state.pop(LAST_TRIP, None)
+        st.session_state.pop(PARTS_ROOT, None)
+        index = data.pop("part_index", None) or {}
+        flat = {k: data.pop(k) for k in LEDGER_KEYS if k in data}
+        for k, v in data.items():
+            st.session_state[k] = v
 
-        if data:
-            for k, v in data.items():
-                st.session_state[k] = v
-    except Exception:
-        pass
+        # Ledgers live in /users/<uid>/parts/<YYYY-MM>/<kind> (or under parts_root);
+        # only the newest partitions are fetched now, older ones when a pager reaches them.
+        root = parts_root(st.session_state)
+        loader = _partition_loader(uid, root)
+        if index:
+            months = sorted(index)
+            recent = {mk: _fetch(f"{root}/{mk}") or {} for mk in months[-RECENT_PARTITIONS:]}
+            for k in LEDGER_KEYS:
+                counts = [(mk, (index[mk] or {}).get(k)) for mk in months if (index[mk] or {}).get(k)]
+                st.session_state[k] = LedgerTable.from_parts(k, counts, {mk: node.get(k) for mk, node in recent.items()},
+                                                             loader)
+            if flat:
+                # leftovers of an interrupted migration
+                get_write_queue().submit(uid, {f"app/{k}": None for k in flat}, token)
+        else:
+            for k in LEDGER_KEYS:
+                st.session_state[k] = ledger_table(k, flat.get(k))
+                st.session_state[k].attach(loader)
+        mark_synced(st.session_state, APP_KEYS, data)
+        if flat and not index:
+            # one-time move of the flat lists into monthly partitions
+            mark_all_dirty(st.session_state, LEDGER_KEYS)
+            st.session_state.pending_changes = True
+        # data saved before aggregates/rollups existed: build them once
+        for k in ("aggregates", "rollups"):
+            if not data.get(k):
+                st.session_state.pop(k, None)
+        ensure_aggregates(st.session_state)
+        ensure_rollups(st.session_state)
+        restore(st.session_state)  # trip totals: snapshot + the events after it
+        rebuild_expense_index(st.session_state)
+        # fresh from the cloud: this is now what every session of the user sees
+        get_shared_store().publish(uid, st.session_state)
+    except Exception as ex:
+        # keep whatever this session already had; render_sync_status() says why
+        st.session_state.load_error = str(ex) or type(ex).__name__
 
 
 
@@ -320,17 +655,24 @@ if st.session_state.user is None:
     persisted = _read_persisted_user_from_browser()
     if persisted and persisted.get("refreshToken"):
         try:
-            refreshed = auth.refresh(persisted["refreshToken"])
+            if persisted.get("localId"):
+                # another tab of this user may already hold a fresh token: no round trip then
+                with timed("auth.restore"):
+                    refreshed = get_token_manager().restore(persisted["localId"], persisted["refreshToken"])
+            else:
+                with timed("auth.restore"):
+                    refreshed = auth.refresh(persisted["refreshToken"])
             st.session_state.user = {
-                "localId": persisted.get("localId"),
+                "localId": persisted.get("localId") or refreshed.get("userId"),
                 "idToken": refreshed.get("idToken"),
-                "refreshToken": refreshed.get("refreshToken", persisted["refreshToken"]),
+                "refreshToken": refreshed.get("refreshToken") or persisted["refreshToken"],
                 "email": persisted.get("email"),
             }
-            _persist_user_to_browser(st.session_state.user)
-            ensure_user_profile()
+            if refreshed.get("refreshToken") != persisted["refreshToken"]:
+                _persist_user_to_browser(st.session_state.user)
+            # the profile was written at sign-in; a restore only needs the data
             _clear_app_state()
-            load_data()
+            bootstrap_session(profile=False)
             rerun()
         except Exception:
             _forget_persisted_user_in_browser()
@@ -338,6 +680,8 @@ if st.session_state.user is None:
 # Login / Register / Reset (compact)
 if st.session_state.user is None:
     st.title("🔐 Login to Real Balls Logistics Management")
+    # the nav grid styling targets every horizontal radio; drop it after an in-session logout
+    use_style_sheet("nav.css", enabled=False)
 
     mode = (
         st.segmented_control("", options=["Login", "Register", "Reset"], default="Login", key="auth_mode")
@@ -383,7 +727,8 @@ if st.session_state.user is None:
                 st.error("Please enter a valid email address.")
             else:
                 try:
-                    user = auth.sign_in_with_email_and_password(e, p)
+                    with timed("auth.sign_in"):
+                        user = auth.sign_in_with_email_and_password(e, p)
                     _clear_app_state()  # <<< important: new session, blank app state
                     st.session_state.user = {
                         "localId": user["localId"],
@@ -391,12 +736,12 @@ if st.session_state.user is None:
                         "refreshToken": user["refreshToken"],
                         "email": e,
                     }
+                    _remember_tokens(user)
                     _persist_user_to_browser(st.session_state.user)  # no-op in fallback mode
-                    ensure_user_profile()
                     # Optional: clear the inputs next run so they don't stay filled
                     st.session_state.pop("login_email", None)
                     st.session_state.pop("login_password", None)
-                    load_data()
+                    bootstrap_session()
                     rerun()
                 except Exception as ex:
                     msg = str(ex)
@@ -419,8 +764,9 @@ if st.session_state.user is None:
                 st.error("Passwords do not match.")
             else:
                 try:
-                    auth.create_user_with_email_and_password(email, password)
-                    user = auth.sign_in_with_email_and_password(email, password)
+                    with timed("auth.register"):
+                        auth.create_user_with_email_and_password(email, password)
+                        user = auth.sign_in_with_email_and_password(email, password)
                     _clear_app_state()  # <<< important: new session, blank app state
                     st.session_state.user = {
                         "localId": user["localId"],
@@ -428,9 +774,9 @@ if st.session_state.user is None:
                         "refreshToken": user["refreshToken"],
                         "email": email,
                     }
+                    _remember_tokens(user)
                     _persist_user_to_browser(st.session_state.user)
-                    ensure_user_profile()
-                    load_data()
+                    bootstrap_session()
                     rerun()
                 except Exception as e:
                     st.error("❌ " + str(e))
@@ -445,6 +791,7 @@ if st.session_state.user is None:
             except Exception as e:
                 st.error("❌ " + str(e))
 
+    finish_rerun()
     st.stop()
 
 
@@ -468,6 +815,25 @@ def render_account_bar(email: str | None):
 
 
 # ------------------------- Session Init -------------------------
+LOG_PAGE_SIZES = [10, 25, 50, 100]
+
+
+def _secret_flag(name):
+    try:
+        return str(st.secrets.get(name, "")).strip().lower() in ("1", "true", "yes", "on")
+    except Exception:
+        return False
+
+
+def _check_trip_totals():
+    # debug mode (DEBUG_TOTALS in secrets, or BL_DEBUG_TOTALS=1): after every trip change the
+    # running totals must match a full recompute of the log; loads every partition, so off by default
+    if not (os.environ.get("BL_DEBUG_TOTALS") == "1" or _secret_flag("DEBUG_TOTALS")):
+        return
+    drift = trip_drift(st.session_state)
+    if drift:
+        raise AssertionError(f"trip totals drifted from a full recompute: {drift}")
+
 
 def init_session():
     defaults = {
@@ -477,15 +843,15 @@ def init_session():
         "earn_reset": 0,
         "edit_expense_index": None,
         "baseline": None,
-        "log": [],
+        "log": ledger_table("log"),
         "total_miles": 0.0,
         "total_cost": 0.0,
         "total_gallons": 0.0,
         "last_mileage": None,
         "page": "mileage",
         "last_trip_summary": {},
-        "expenses": [],
-        "earnings": [],
+        "expenses": ledger_table("expenses"),
+        "earnings": ledger_table("earnings"),
         "pending_changes": False,
         # input buffers for Trip form
         "mileage": "",
@@ -493,6 +859,14 @@ def init_session():
         "fuel_cost": "",
         # log-page editing index
         "log_edit_expense_index": None,
+        # follow writes from the user's other devices (Settings; LIVE_SYNC in secrets sets the default)
+        "live_sync": _secret_flag("LIVE_SYNC"),
+        # Log page pagers: cursor = record index a page starts from (None = newest)
+        "log_page_size": LOG_PAGE_SIZES[1],
+        "log_cursor": None,
+        "log_cursor_hist": [],
+        "exp_cursor": None,
+        "exp_cursor_hist": [],
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -517,8 +891,50 @@ if "initialized" not in st.session_state:
     load_data()
 
 if st.session_state.get("pending_changes"):
-    save_data()
-    st.session_state.pending_changes = False
+    # a failed save keeps its dirty marks and pending_changes, so the next rerun tries again
+    try:
+        save_data()
+        st.session_state.pending_changes = False
+        st.session_state.pop("save_error", None)
+    except Exception as ex:
+        st.session_state.save_error = str(ex) or type(ex).__name__
+
+# Other sessions of this user share the same ledger objects (see shared.py):
+# what this one changed (and just saved) becomes theirs, or theirs becomes ours.
+get_shared_store().attach(st.session_state.user["localId"], _session_id(), st.session_state)
+get_shared_store().sync(st.session_state.user["localId"], st.session_state)
+
+
+def _apply_remote(deltas):
+    # fold the other devices' writes into the state record by record; -> False
+    # if one can't be (see persistence.apply_delta) and the state must be reloaded
+    for delta in deltas:
+        if not apply_delta(st.session_state, delta, APP_KEYS):
+            return False
+    st.session_state.pop(LAST_TRIP, None)
+    st.session_state.pop("expense_index", None)  # rebuilt when next needed
+    restore(st.session_state)  # trip totals: snapshot + the events after it
+    return True
+
+
+# Live sync (opt-in, see livesync.py): writes from the user's other devices
+# arrive as the records they changed and are applied to the shared state in
+# place (LIVE_APPLIED is shared too, so only one session applies them); a
+# full reload only when that isn't possible.
+if st.session_state.get("live_sync"):
+    _uid = st.session_state.user["localId"]
+    _live_seq = get_live_sync().watch(_uid, _id_token())
+    _applied = st.session_state.get(LIVE_APPLIED)
+    st.session_state[LIVE_APPLIED] = _live_seq
+    if _applied not in (None, _live_seq):
+        _deltas = get_live_sync().changes(_uid, _applied)
+        with timed("live.apply"):
+            _ok = _deltas is not None and _apply_remote(_deltas)
+        if _ok:
+            get_shared_store().publish(_uid, st.session_state)
+        else:
+            with timed("live.reload"):
+                load_data()
 
 # ------------------------- Navigation (compact) -------------------------
 NAV = [
@@ -535,33 +951,7 @@ NAV_KEYS = [k for k, _ in NAV]
 NAV_LABELS = {k: v for k, v in NAV}
 
 # Style the radio as a 3×2 button grid and highlight the active choice
-st.markdown(
-    '''
-    <style>
-      [data-testid="stRadio"] > label{ display:none !important; }
-      [data-testid="stRadio"] [role="radiogroup"]{
-        display:grid !important;
-        grid-template-columns: repeat(3, 1fr) !important;
-        gap:.4rem !important;
-      }
-      [data-testid="stRadio"] label{
-        border:1px solid #e5e7eb; border-radius:.8rem; padding:.6rem .7rem; min-height:44px;
-        display:flex; align-items:center; justify-content:center; text-align:center; margin:0 !important;
-        background:#fff; color:inherit;
-      }
-      [data-testid="stRadio"] input{ position:absolute; opacity:0; width:0; height:0; }
-      [data-testid="stRadio"] label:has(input:checked){
-        background:#2563eb; color:#fff; border-color:#2563eb;
-      }
-      @media (prefers-color-scheme: dark){
-        [data-testid="stRadio"] label{ background:#111827; border-color:#374151; color:#e5e7eb; }
-        [data-testid="stRadio"] label:has(input:checked){ background:#3b82f6; border-color:#3b82f6; color:#fff; }
-      }
-    </style>
-    '''
-    ,
-    unsafe_allow_html=True,
-)
+use_style_sheet("nav.css")
 
 # Keep the radio in sync with session_state.page
 if "nav_page_sel" not in st.session_state:
@@ -574,6 +964,56 @@ def _on_nav_change():
 
 st.title("🚛 Real Balls Logistics Management")
 
+
+def render_sync_status():
+    queue = get_write_queue()
+    uid = st.session_state.user["localId"]
+    status = queue.status(uid)
+    label = {"syncing": "⏳ Syncing…", "synced": "✅ Synced", "error": "⚠️ Offline — retrying"}[status]
+    depth = queue.depth(uid)
+    if status != "synced" and depth:
+        label += f" · {depth} change{'s' if depth != 1 else ''} queued"
+    retry_at = queue.retry_at(uid)
+    if status == "error" and retry_at:
+        label += f" · next try in {max(0, int(retry_at - time.time()))} s"
+    if st.session_state.get("save_error"):
+        label = f"⚠️ Couldn't queue your last change ({st.session_state.save_error}); it will be retried."
+    if "open" in (db.breaker.state, auth.breaker.state):
+        # circuit breaker (resilient.py): reads come from the doc cache until it closes again
+        st.warning("📴 Can't reach the database right now. Showing your last synced data; "
+                   "new changes are kept and will sync when it's back.")
+    elif st.session_state.get("load_error"):
+        label = f"⚠️ Couldn't load your latest data ({st.session_state.load_error}); showing what this session has."
+    st.caption(label)
+
+
+def cached_view(key, build):
+    # build() once per ledger version (and key), then reuse across reruns
+    user = st.session_state.get("user") or {}
+    name = key if isinstance(key, str) else key[0]
+
+    def _build():
+        with timed(f"view.{name}"):
+            return build()
+    return get_view_cache().get(user.get("localId"), key, st.session_state.get(LEDGER_VERSION), _build)
+
+
+@st.experimental_fragment(run_every=LIVE_POLL_SECONDS)
+def render_live_status():
+    # reruns on its own every few seconds; a full rerun picks up remote changes
+    uid = st.session_state.user["localId"]
+    seq = get_live_sync().watch(uid, _id_token())
+    label = {"live": "📡 Live", "connecting": "📡 Connecting…", "reconnecting": "📡 Reconnecting…",
+             "off": "📡 Starting…"}[get_live_sync().status(uid)]
+    st.caption(label)
+    if seq != st.session_state.get(LIVE_APPLIED):
+        rerun()
+
+
+render_sync_status()
+if st.session_state.get("live_sync"):
+    render_live_status()
+
 st.radio(
     label="",
     options=NAV_KEYS,
@@ -586,6 +1026,7 @@ st.radio(
 )
 
 page = st.session_state.page
+_page_done = begin(f"page.{page}")
 
 # ------------------------- PAGE: Mileage (Fuel) -------------------------
 if page == "mileage":
@@ -596,21 +1037,14 @@ if page == "mileage":
         last_trip_gallons = float(st.session_state["last_trip_summary"].get("gallons", 0.0) or 0.0)
 
     # Most recent Fuel expense (as "last trip's" fuel cost)
-    last_fuel_cost = 0.0
-    if st.session_state.get("expenses"):
-        for _e in sorted(
-                st.session_state.expenses,
-                key=lambda x: (x.get("date", ""), x.get("id", 0)),
-                reverse=True,
-        ):
-            if _e.get("type") == "Fuel":
-                last_fuel_cost = float(_e.get("amount", 0.0) or 0.0)
-                break
+    agg = aggregates(st.session_state)
+    _last_fuel = latest_expense(st.session_state, "Fuel")
+    last_fuel_cost = float(_last_fuel.get("amount", 0.0) or 0.0) if _last_fuel else 0.0
 
     # Owner / Worker totals and Owner's net
-    total_worker_income = sum(float(e.get("worker", 0.0) or 0.0) for e in st.session_state.earnings)
-    total_owner_gross = sum(float(e.get("owner", 0.0) or 0.0) for e in st.session_state.earnings)
-    total_expenses_amt = sum(float(e.get("amount", 0.0) or 0.0) for e in st.session_state.expenses)
+    total_worker_income = float(agg["worker"] or 0.0)
+    total_owner_gross = float(agg["owner"] or 0.0)
+    total_expenses_amt = float(agg["expenses"] or 0.0)
     total_owner_net = total_owner_gross - total_expenses_amt
 
     st.markdown(f"""
@@ -624,29 +1058,6 @@ if page == "mileage":
     </div>
     """, unsafe_allow_html=True)
 
-    st.markdown(
-        """
-        <style>
-          .metric-grid{
-            display:grid;
-            grid-template-columns:repeat(3,1fr);  /* 3 columns now */
-            gap:.5rem;
-          }
-          .metric{
-            border:1px solid var(--border-color, #e5e7eb);
-            border-radius:.6rem;
-            padding:.55rem .7rem;
-            background: var(--metric-bg, #ffffff);
-          }
-          .metric-label{ font-size:.78rem; opacity:.75; margin-bottom:.15rem; }
-          .metric-value{ font-size:1.05rem; font-weight:600; }
-          @media (prefers-color-scheme: dark){
-            .metric{ background:#0b1220; border-color:#2a3342; }
-          }
-        </style>
-        """,
-        unsafe_allow_html=True,
-    )
 
     # ---- Baseline & Trip ----
     st.subheader("📍 Baseline & Trip")
@@ -662,6 +1073,8 @@ if page == "mileage":
             if val and val > 0:
                 st.session_state.baseline = val
                 st.session_state.last_mileage = val
+                mark_dirty(st.session_state, "baseline")
+                take_snapshot(st.session_state)
                 st.session_state.pending_changes = True
                 st.session_state["baseline_input"] = ""
                 st.session_state.trip_reset += 1
@@ -725,10 +1138,6 @@ if page == "mileage":
                 st.error("Trip distance is zero. Enter a higher odometer value.")
             else:
                 mpg = distance / gallons if gallons and gallons > 0 else 0
-                st.session_state.total_miles += distance
-                st.session_state.total_gallons += (gallons or 0)
-                st.session_state.last_mileage = new_mileage
-
                 entry = {
                     "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                     "type": "Trip",
@@ -737,8 +1146,8 @@ if page == "mileage":
                     "mpg": mpg,
                     "note": "Mileage + Fuel",
                 }
-                st.session_state.log.append(entry)
-                st.session_state.last_trip_summary = entry
+                add_trip(st.session_state, entry)  # totals and last trip move with it
+                _check_trip_totals()
                 st.session_state.pending_changes = True
                 st.session_state.trip_reset += 1
                 rerun()
@@ -765,6 +1174,9 @@ if page == "mileage":
 
 # ------------------------- PAGE: Expenses -------------------------
 elif page == "expenses":
+    import altair as alt
+    import pandas as pd
+
     st.subheader("💸 Expenses")
 
     # --- Add (or edit) form ---
@@ -788,8 +1200,7 @@ elif page == "expenses":
             exp_id = int(datetime.now().timestamp() * 1000)
             exp = {"id": exp_id, "date": today, "type": expense_type,
                    "description": description, "amount": amount or 0.0}
-            st.session_state.expenses.append(exp)
-            st.session_state.log.append({
+            add_expense(st.session_state, exp, {
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "type": "Expense", "amount": amount or 0.0,
                 "note": f"{expense_type}: {description}", "expense_id": exp_id
@@ -815,15 +1226,9 @@ elif page == "expenses":
                 if st.button("💾 Save", use_container_width=True):
                     # preserve id & date
                     exp_id = exp.get("id")
-                    st.session_state.expenses[idx] = {"id": exp_id, "date": exp.get("date", today), "type": new_type,
-                                                      "description": new_desc, "amount": new_amt}
-                    # update linked log entry if exists
-                    if exp_id:
-                        for le in reversed(st.session_state.log):
-                            if le.get("type") == "Expense" and le.get("expense_id") == exp_id:
-                                le["amount"] = new_amt
-                                le["note"] = f"{new_type}: {new_desc}"
-                                break
+                    # also updates the linked log entry if it exists
+                    update_expense(st.session_state, idx, {"id": exp_id, "date": exp.get("date", today), "type": new_type,
+                                                           "description": new_desc, "amount": new_amt})
                     st.session_state.edit_expense_index = None
                     st.session_state.pending_changes = True
                     rerun()
@@ -834,42 +1239,38 @@ elif page == "expenses":
 
     # --- Statistics (ONLY Expenses by Category), placed below +Add ---
     if st.session_state.expenses:
-        df_exp = pd.DataFrame(st.session_state.expenses)
-        # guard for legacy entries without amount/type
-        if not df_exp.empty and set(["type", "amount"]).issubset(df_exp.columns):
-            df_grp = df_exp.groupby("type")["amount"].sum().reset_index()
-            st.altair_chart(
-                alt.Chart(df_grp).mark_arc().encode(theta="amount", color="type",
-                                                    tooltip=["type", "amount"]).properties(title="📊 Expenses by Category",
-                                                                                           height=180),
-                use_container_width=True,
-            )
-        total_expense_amount = float(df_exp.get("amount", pd.Series(dtype=float)).sum())
+        agg = aggregates(st.session_state)
+        # per-category sums are kept in the aggregate store; legacy entries without a type are left out
+        if agg["by_type"]:
+            def _expense_pie():
+                df_grp = pd.DataFrame({"type": list(agg["by_type"]), "amount": list(agg["by_type"].values())})
+                return alt.Chart(df_grp).mark_arc().encode(theta="amount", color="type",
+                                                           tooltip=["type", "amount"]).properties(title="📊 Expenses by Category",
+                                                                                                  height=180)
+
+            st.altair_chart(cached_view("expense_pie", _expense_pie), use_container_width=True)
+        total_expense_amount = float(agg["expenses"] or 0.0)
         st.markdown(f"**Total:** ${total_expense_amount:.2f}")
 
         # --- Recent → Older expense table (Cost / Type / Date) ---
         st.markdown("### 📋 Recent Expenses")  # ← Make sure this says “Recent”, not “Resent”
 
         if st.session_state.expenses:
-            entries = sorted(
-                st.session_state.expenses,
-                key=lambda e: (e.get("date", ""), e.get("id", 0)),
-                reverse=True,
-            )
+            def _recent_expenses():
+                # SHOW ONLY TOP 20 (newest first): straight from the time index, no sort
+                exps = st.session_state.expenses
+                newest = [i - exps.base for i in exps.newest(20)]
+                df_recent = exps.frame(["amount", "type", "date"]).iloc[newest]
+                df_recent = df_recent.rename(columns={"amount": "Cost", "type": "Type", "date": "Date"})
+                df_recent["Date"] = df_recent["Date"].dt.strftime("%Y-%m-%d").fillna("")
 
-            df_recent = pd.DataFrame(entries)[["amount", "type", "date"]]
-            df_recent = df_recent.rename(columns={"amount": "Cost", "type": "Type", "date": "Date"})
+                # Format cost column as currency
+                df_recent["Cost"] = df_recent["Cost"].map(lambda x: f"${x:,.2f}")
 
-            # SHOW ONLY TOP 20 (newest first)
-            df_recent = df_recent.head(20)
+                # Reset index to remove 0,1,2...
+                return df_recent.reset_index(drop=True)
 
-            # Format cost column as currency
-            df_recent["Cost"] = df_recent["Cost"].map(lambda x: f"${x:,.2f}")
-
-            # Reset index to remove 0,1,2...
-            df_recent = df_recent.reset_index(drop=True)
-
-            st.table(df_recent.style.hide(axis="index"))
+            st.table(cached_view("recent_expenses", _recent_expenses).style.hide(axis="index"))
         else:
             st.caption("No expenses yet.")
 
@@ -881,6 +1282,9 @@ elif page == "expenses":
 
 # ------------------------- PAGE: Earnings -------------------------
 elif page == "earnings":
+    import altair as alt
+    import pandas as pd
+
     st.subheader("💰 Income")
     c1, c2 = st.columns(2, gap="small")
     with c1:
@@ -892,7 +1296,7 @@ elif page == "earnings":
     owner = _to_float(owner_str)
 
     today = datetime.now().strftime("%Y-%m-%d")
-    total_expenses = sum(e.get("amount", 0.0) for e in st.session_state.expenses)
+    total_expenses = float(aggregates(st.session_state)["expenses"] or 0.0)
     owner_net = (owner or 0.0) - total_expenses
 
     confirm_disabled = (
@@ -901,8 +1305,7 @@ elif page == "earnings":
 
     if st.button("✅ Confirm", use_container_width=True, disabled=confirm_disabled):
         earning = {"date": today, "worker": worker or 0.0, "owner": owner or 0.0, "net_owner": owner_net}
-        st.session_state.earnings.append(earning)
-        st.session_state.log.append({
+        add_earning(st.session_state, earning, {
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "type": "Income",
             "amount": owner or 0.0,
@@ -912,193 +1315,185 @@ elif page == "earnings":
         st.session_state.earn_reset += 1
         rerun()
 
-    # ----- Chart: Worker vs Owner's net (last 7 months, grouped bars) -----
+    # ----- Chart: Worker vs Owner's net (6-month window over monthly rollups, grouped bars) -----
     if st.session_state.earnings:
-        inc = pd.DataFrame(st.session_state.earnings).copy()
-        exp = pd.DataFrame(st.session_state.expenses).copy() if st.session_state.expenses else pd.DataFrame(
-            columns=["date", "amount"]
-        )
-
-        # Parse + coerce
-        inc["date"] = pd.to_datetime(inc.get("date"), errors="coerce")
-        exp["date"] = pd.to_datetime(exp.get("date"), errors="coerce")
-        inc["worker"] = pd.to_numeric(inc.get("worker", 0.0), errors="coerce").fillna(0.0)
-        inc["owner"] = pd.to_numeric(inc.get("owner", 0.0), errors="coerce").fillna(0.0)
-        exp["amount"] = pd.to_numeric(exp.get("amount", 0.0), errors="coerce").fillna(0.0)
-
-        # ---- Build a 6-month window that starts at the first month with data ----
         N_MONTHS = 6  # you currently show 6 ticks; keep it explicit
 
-        # Monthly sums (same as before)
-        inc = inc[inc["date"].notna()]
-        inc["year_month"] = inc["date"].dt.to_period("M").dt.to_timestamp()
-        monthly_worker = inc.groupby("year_month")["worker"].sum()
-        monthly_owner_gross = inc.groupby("year_month")["owner"].sum()
-
-        if not exp.empty:
-            exp = exp[exp["date"].notna()]
-            exp["year_month"] = exp["date"].dt.to_period("M").dt.to_timestamp()
-            monthly_expenses = exp.groupby("year_month")["amount"].sum()
-        else:
-            monthly_expenses = pd.Series(dtype=float)
-
-        # Join and compute owner_net across all seen months
-        all_idx = sorted(set(monthly_worker.index) | set(monthly_owner_gross.index) | set(monthly_expenses.index))
-        if not all_idx:
-            # no data at all: fall back to a window ending today
-            today_ts = pd.Timestamp.today().normalize()
-            domain_months = pd.date_range(end=today_ts, periods=N_MONTHS, freq="MS")
-        else:
-            # first month that has any money in any series
-            df_any = pd.DataFrame(index=pd.Index(all_idx, name="year_month"))
-            df_any["worker"] = monthly_worker.reindex(df_any.index, fill_value=0.0)
-            df_any["owner_gross"] = monthly_owner_gross.reindex(df_any.index, fill_value=0.0)
-            df_any["expenses"] = monthly_expenses.reindex(df_any.index, fill_value=0.0)
-            df_any["owner_net"] = df_any["owner_gross"] - df_any["expenses"]
-
-            has_any = (df_any[["worker", "owner_net"]].sum(axis=1) != 0)
-            if has_any.any():
-                first_data_month = has_any.idxmax()  # earliest True
-                # start at first_data_month and roll forward N months (into future if needed)
-                domain_months = pd.date_range(start=first_data_month, periods=N_MONTHS, freq="MS")
-            else:
-                # everything is zero: show a window ending today
-                today_ts = pd.Timestamp.today().normalize()
-                domain_months = pd.date_range(end=today_ts, periods=N_MONTHS, freq="MS")
-
-        # Rebuild the monthly frame on this rotated domain
-        monthly = pd.DataFrame(index=domain_months)
-        monthly["worker"] = monthly_worker.reindex(domain_months, fill_value=0.0)
-        monthly["owner_gross"] = monthly_owner_gross.reindex(domain_months, fill_value=0.0)
-        monthly["expenses"] = monthly_expenses.reindex(domain_months, fill_value=0.0)
-        monthly["owner_net"] = monthly["owner_gross"] - monthly["expenses"]
-
+        # Default window starts at the first month with data (rolling forward into the
+        # future if needed) but never ends before the current month.
         today_ts = pd.Timestamp.today().normalize()
-        monthly = monthly.reset_index().rename(columns={"index": "year_month"})
-        monthly["is_current"] = (monthly["year_month"].dt.to_period("M") == today_ts.to_period("M"))
-
-        # Long format for grouped bars (unchanged below)
-        m = monthly.melt(
-            id_vars=["year_month", "is_current"],
-            value_vars=["worker", "owner_net"],
-            var_name="Series",
-            value_name="Amount",
-        )
-        m["Series"] = m["Series"].map({"worker": "Worker", "owner_net": "Owner's net"})
-
-        # Chronological domain for x-axis (rotated)
-        domain_months = list(pd.Index(domain_months).to_pydatetime())
-
-        # Build base with the final axis/scale ONCE (before creating layers)
-        base = alt.Chart(m).encode(
-            x=alt.X(
-                "yearmonth(year_month):T",
-                title=None,
-                axis=alt.Axis(labelAngle=0, labelPadding=8, tickSize=0, format="%b"),
-                scale=alt.Scale(domain=domain_months, paddingInner=0.6, paddingOuter=0.5),
-            ),
-            xOffset=alt.XOffset("Series:N"),
-            y=alt.Y("Amount:Q", title=None, axis=alt.Axis(format="~s")),
-            color=alt.Color(
-                "Series:N",
-                scale=alt.Scale(domain=["Worker", "Owner's net"], range=["#39d353", "#333333"]),
-                legend=alt.Legend(title=None, orient="top"),
-            ),
-            tooltip=[
-                alt.Tooltip("year_month:T", title="Month", format="%b %Y"),
-                alt.Tooltip("Series:N", title="Who"),
-                alt.Tooltip("Amount:Q", title="Amount", format="$.2f"),
-            ],
-        )
-
-        # Bars
-        bars = base.mark_bar(
-            size=18,
-            cornerRadiusTopLeft=10,
-            cornerRadiusTopRight=10
-        )
-
-        # Outline current month
-        outline = base.transform_filter(alt.datum.is_current == True).mark_bar(
-            size=22,
-            fillOpacity=0,
-            stroke="#6b7280",
-            strokeWidth=1.5,
-            cornerRadiusTopLeft=12,
-            cornerRadiusTopRight=12
-        )
+        cur_idx = month_index(today_ts.strftime("%Y-%m"))
+        first_idx = first_data_month(st.session_state)
+        latest_end = cur_idx if first_idx is None else max(first_idx + N_MONTHS - 1, cur_idx)
+        oldest_end = latest_end if first_idx is None else min(first_idx + N_MONTHS - 1, latest_end)
+
+        # Pager: income_chart_end_idx is the last month shown (None = latest window)
+        end_idx = st.session_state.income_chart_end_idx
+        if end_idx is None or not oldest_end <= end_idx <= latest_end:
+            end_idx = latest_end
+
+        def _income_chart():
+            # Only the months on screen are read from the rollups
+            window = rollup_window(st.session_state, end_idx, N_MONTHS)
+            domain_months = pd.DatetimeIndex([pd.Timestamp(mk + "-01") for mk, _ in window])
+            monthly = pd.DataFrame({
+                "year_month": domain_months,
+                "worker": [b["worker"] for _, b in window],
+                "owner_gross": [b["owner"] for _, b in window],
+                "expenses": [b["expenses"] for _, b in window],
+            })
+            monthly["owner_net"] = monthly["owner_gross"] - monthly["expenses"]
+            monthly["is_current"] = (monthly["year_month"].dt.to_period("M") == today_ts.to_period("M"))
+
+            # Long format for grouped bars (unchanged below)
+            m = monthly.melt(
+                id_vars=["year_month", "is_current"],
+                value_vars=["worker", "owner_net"],
+                var_name="Series",
+                value_name="Amount",
+            )
+            m["Series"] = m["Series"].map({"worker": "Worker", "owner_net": "Owner's net"})
 
-        # Value labels
-        labels = (
-            base.transform_filter(alt.datum.Amount > 0)
-            .mark_text(dy=-6, color="#111827")
-            .encode(text=alt.Text("Amount:Q", format="$.0f"))
-        )
+            # Chronological domain for x-axis (rotated)
+            domain_months = list(pd.Index(domain_months).to_pydatetime())
 
-        # >>> Center guide for each month (now actually layered)
-        guides = (
-            alt.Chart(monthly)
-            .mark_rule(strokeWidth=1, color="#9ca3af", opacity=0.35)
-            .encode(
+            # Build base with the final axis/scale ONCE (before creating layers)
+            base = alt.Chart(m).encode(
                 x=alt.X(
                     "yearmonth(year_month):T",
                     title=None,
+                    axis=alt.Axis(labelAngle=0, labelPadding=8, tickSize=0, format="%b"),
                     scale=alt.Scale(domain=domain_months, paddingInner=0.6, paddingOuter=0.5),
+                ),
+                xOffset=alt.XOffset("Series:N"),
+                y=alt.Y("Amount:Q", title=None, axis=alt.Axis(format="~s")),
+                color=alt.Color(
+                    "Series:N",
+                    scale=alt.Scale(domain=["Worker", "Owner's net"], range=["#39d353", "#333333"]),
+                    legend=alt.Legend(title=None, orient="top"),
+                ),
+                tooltip=[
+                    alt.Tooltip("year_month:T", title="Month", format="%b %Y"),
+                    alt.Tooltip("Series:N", title="Who"),
+                    alt.Tooltip("Amount:Q", title="Amount", format="$.2f"),
+                ],
+            )
+
+            # Bars
+            bars = base.mark_bar(
+                size=18,
+                cornerRadiusTopLeft=10,
+                cornerRadiusTopRight=10
+            )
+
+            # Outline current month
+            outline = base.transform_filter(alt.datum.is_current == True).mark_bar(
+                size=22,
+                fillOpacity=0,
+                stroke="#6b7280",
+                strokeWidth=1.5,
+                cornerRadiusTopLeft=12,
+                cornerRadiusTopRight=12
+            )
+
+            # Value labels
+            labels = (
+                base.transform_filter(alt.datum.Amount > 0)
+                .mark_text(dy=-6, color="#111827")
+                .encode(text=alt.Text("Amount:Q", format="$.0f"))
+            )
+
+            # >>> Center guide for each month (now actually layered)
+            guides = (
+                alt.Chart(monthly)
+                .mark_rule(strokeWidth=1, color="#9ca3af", opacity=0.35)
+                .encode(
+                    x=alt.X(
+                        "yearmonth(year_month):T",
+                        title=None,
+                        scale=alt.Scale(domain=domain_months, paddingInner=0.6, paddingOuter=0.5),
+                    )
                 )
             )
-        )
 
-        title_txt = "Income — 6-month window"
-        chart_income_grouped = (bars + outline + guides + labels).properties(
-            title=title_txt,
-            height=220,
-        ).configure_axis(grid=False, domain=False).configure_view(strokeWidth=0)
+            title_txt = "Income — 6-month window"
+            chart_income_grouped = (bars + outline + guides + labels).properties(
+                title=title_txt,
+                height=220,
+            ).configure_axis(grid=False, domain=False).configure_view(strokeWidth=0)
+            return chart_income_grouped
 
+        # same window + same data -> same spec; the current month matters for the outline
+        chart_income_grouped = cached_view(("income_chart", end_idx, cur_idx), _income_chart)
         st.altair_chart(chart_income_grouped, use_container_width=True)
 
-    if st.session_state.earnings:
-        # Sort newest first (by date string)
-        entries = sorted(st.session_state.earnings, key=lambda e: e.get("date", ""), reverse=True)
-        df = pd.DataFrame(entries)
+        pc1, pc2, pc3 = st.columns([.3, .4, .3], gap="small")
+        with pc1:
+            if st.button("◀ Older", key="income_chart_older", use_container_width=True,
+                         disabled=end_idx <= oldest_end):
+                st.session_state.income_chart_end_idx = max(oldest_end, end_idx - N_MONTHS)
+                rerun()
+        with pc2:
+            st.caption(f"{pd.Timestamp(month_from_index(end_idx - N_MONTHS + 1) + '-01'):%b %Y} – "
+                       f"{pd.Timestamp(month_from_index(end_idx) + '-01'):%b %Y}")
+        with pc3:
+            if st.button("Newer ▶", key="income_chart_newer", use_container_width=True,
+                         disabled=end_idx >= latest_end):
+                st.session_state.income_chart_end_idx = min(latest_end, end_idx + N_MONTHS)
+                rerun()
 
+    if st.session_state.earnings:
         # Always recompute Owner's net using CURRENT total expenses
-        current_total_expenses = sum(float(e.get("amount", 0.0) or 0.0) for e in st.session_state.expenses)
-        df["owner"] = pd.to_numeric(df["owner"], errors="coerce").fillna(0.0)
-        df["worker"] = pd.to_numeric(df["worker"], errors="coerce").fillna(0.0)
-        df["net_owner"] = df["owner"] - float(current_total_expenses)
+        agg = aggregates(st.session_state)
+        current_total_expenses = float(agg["expenses"] or 0.0)
+
+        def _recent_income():
+            # Newest first from the time index (columnar.py); the CSV covers all history, so load it all
+            earnings = st.session_state.earnings
+            order = earnings.newest(len(earnings))
+            df = earnings.frame(["worker", "owner", "net_owner", "date"]).iloc[order]
+            df["date"] = df["date"].dt.strftime("%Y-%m-%d").fillna("")
+
+            df["owner"] = pd.to_numeric(df["owner"], errors="coerce").fillna(0.0)
+            df["worker"] = pd.to_numeric(df["worker"], errors="coerce").fillna(0.0)
+            df["net_owner"] = df["owner"] - float(current_total_expenses)
+
+            # Build display table: Worker's | Owner's gross | Owner's net | Date
+            df_recent = df[["worker", "owner", "net_owner", "date"]].copy()
+            df_recent = df_recent.rename(columns={
+                "worker": "Worker",
+                "owner": "Owner's gross",
+                "net_owner": "Owner's net",
+                "date": "Date",
+            })
 
-        st.markdown("### 📋 Recent Income")  # ← Title
+            # SHOW ONLY TOP 20 (newest first)
+            df_recent = df_recent.head(20)
 
-        # Build display table: Worker's | Owner's gross | Owner's net | Date
-        df_recent = df[["worker", "owner", "net_owner", "date"]].copy()
-        df_recent = df_recent.rename(columns={
-            "worker": "Worker",
-            "owner": "Owner's gross",
-            "net_owner": "Owner's net",
-            "date": "Date",
-        })
+            # Ensure numeric then format as currency for the three money columns (guarded)
+            for col in ["Worker", "Owner's gross", "Owner's net"]:
+                if col in df_recent.columns:
+                    df_recent[col] = pd.to_numeric(df_recent[col], errors="coerce").fillna(0.0)
+                    df_recent[col] = df_recent[col].map(lambda x: f"${x:,.2f}")
+
+            # Reset index to remove 0,1,2...
+            df_recent = df_recent.reset_index(drop=True)
 
-        # SHOW ONLY TOP 20 (newest first)
-        df_recent = df_recent.head(20)
+            # CSV (all rows, raw numbers)
+            df_csv = df[["worker", "owner", "net_owner", "date"]]
+            return df_recent, df_csv.to_csv(index=False).encode("utf-8")
 
-        # Ensure numeric then format as currency for the three money columns (guarded)
-        for col in ["Worker", "Owner's gross", "Owner's net"]:
-            if col in df_recent.columns:
-                df_recent[col] = pd.to_numeric(df_recent[col], errors="coerce").fillna(0.0)
-                df_recent[col] = df_recent[col].map(lambda x: f"${x:,.2f}")
+        # Owner's net depends on total expenses, which also bump the ledger version
+        df_recent, csv = cached_view("recent_income", _recent_income)
 
-        # Reset index and render without the index column
-        df_recent = df_recent.reset_index(drop=True)
+        st.markdown("### 📋 Recent Income")  # ← Title
         st.table(df_recent.style.hide(axis="index"))
-
-        # CSV (all rows, raw numbers)
-        df_csv = df[["worker", "owner", "net_owner", "date"]]
-        csv = df_csv.to_csv(index=False).encode("utf-8")
         st.download_button("Download CSV", csv, "income.csv", "text/csv", use_container_width=True)
 
         # Totals (all rows)
         st.caption(
-            f"Totals — Worker: ${df['worker'].sum():.2f} | Owner's gross: ${df['owner'].sum():.2f} | Owner's net: ${df['net_owner'].sum():.2f}"
+            f"Totals — Worker: ${float(agg['worker'] or 0.0):.2f} | Owner's gross: ${float(agg['owner'] or 0.0):.2f} | "
+            f"Owner's net: ${float(agg['owner'] or 0.0) - len(st.session_state.earnings) * current_total_expenses:.2f}"
         )
     else:
         st.info("No income yet.")
@@ -1113,55 +1508,66 @@ elif page == "log":
     # Helper: delete expense along with its linked log record if present
     def _delete_expense_at(idx: int):
         if 0 <= idx < len(st.session_state.expenses):
-            exp = st.session_state.expenses[idx]
-            exp_id = exp.get("id")
-            # remove expense
-            del st.session_state.expenses[idx]
-            # remove matching log entry (prefer by id; otherwise best-effort by note+amount)
-            for j in range(len(st.session_state.log) - 1, -1, -1):
-                le = st.session_state.log[j]
-                if le.get("type") == "Expense":
-                    if (exp_id and le.get("expense_id") == exp_id) or (
-                            le.get("amount") == exp.get("amount") and le.get(
-                        "note") == f"{exp.get('type')}: {exp.get('description')}"):
-                        del st.session_state.log[j]
-                        break
+            delete_expense(st.session_state, idx)
             st.session_state.pending_changes = True
 
 
-    # Recompute totals and last-trip summary from the current log
-    def _recompute_from_log():
-        trips = [e for e in st.session_state.log if e.get("type") == "Trip"]
-        # totals
-        st.session_state.total_miles = sum(float(t.get("distance", 0.0) or 0.0) for t in trips)
-        st.session_state.total_gallons = sum(float(t.get("gallons", 0.0) or 0.0) for t in trips)
+    # --- Paging: page size + date range shared by the timeline and the expense editor ---
+    def _reset_log_pagers():
+        for k in ("log_cursor", "exp_cursor"):
+            st.session_state[k] = None
+        for k in ("log_cursor_hist", "exp_cursor_hist"):
+            st.session_state[k] = []
 
-        # last_mileage = baseline + sum(distances) if baseline exists
-        if st.session_state.baseline is not None:
-            try:
-                st.session_state.last_mileage = float(st.session_state.baseline) + float(st.session_state.total_miles)
-            except Exception:
-                st.session_state.last_mileage = None
-        else:
-            st.session_state.last_mileage = None
 
-        # last trip summary → most recent Trip entry (if any)
-        if trips:
-            st.session_state.last_trip_summary = trips[-1]
-        else:
-            st.session_state.last_trip_summary = {}
+    def _pager(prefix: str, next_cursor):
+        # Newer / Older over a stack of previous cursors; only the visible page is rendered
+        hist = st.session_state[f"{prefix}_cursor_hist"]
+        pc1, pc2 = st.columns(2, gap="small")
+        with pc1:
+            if st.button("⬆ Newer", key=f"{prefix}_newer", disabled=not hist, use_container_width=True):
+                st.session_state[f"{prefix}_cursor"] = hist.pop()
+                rerun()
+        with pc2:
+            if st.button("Older ⬇", key=f"{prefix}_older", disabled=next_cursor is None, use_container_width=True):
+                hist.append(st.session_state[f"{prefix}_cursor"])
+                st.session_state[f"{prefix}_cursor"] = next_cursor
+                rerun()
+
+
+    lc1, lc2 = st.columns([.35, .65], gap="small")
+    with lc1:
+        page_size = st.selectbox("Rows per page", LOG_PAGE_SIZES, key="log_page_size", on_change=_reset_log_pagers)
+    with lc2:
+        date_range = st.date_input("Jump to dates", value=(), key="log_date_range", on_change=_reset_log_pagers)
+
+    # Date range → index bounds (bisect on the time-ordered lists)
+    date_range = tuple(date_range) if isinstance(date_range, (list, tuple)) else (date_range,)
+    range_from = date_range[0].strftime("%Y-%m-%d") if len(date_range) >= 1 else None
+    range_to = date_range[-1].strftime("%Y-%m-%d") if len(date_range) >= 1 else None
+
+
+    def _bounds(records, field, cursor):
+        lo = first_index_on_or_after(records, range_from, field) if len(date_range) == 2 else 0
+        if cursor is None and range_to is not None:
+            cursor = last_index_on_or_before(records, range_to, field)
+        return lo, cursor
 
 
     # --- Timeline for Trips & Income (exclude Expenses to avoid duplication) ---
     if st.session_state.log:
         st.markdown("### 🕒 Timeline (Trips & Income)")
 
-        # Build list with original indexes so we can edit/delete correctly
-        items = [(i, e) for i, e in enumerate(st.session_state.log) if e.get("type") != "Expense"]
+        # One page of original indexes (newest first) so we can edit/delete correctly
+        lo, cursor = _bounds(st.session_state.log, "timestamp", st.session_state.log_cursor)
+        page_idx, next_log_cursor = (
+            page_back(st.session_state.log, cursor, page_size, lo=lo, skip_type="Expense")
+            if cursor is None or cursor >= 0 else ([], None)
+        )
 
-        if items:
-            # Iterate newest first
-            for pos, (orig_idx, entry) in enumerate(reversed(items)):
+        if page_idx:
+            for orig_idx in page_idx:
+                entry = st.session_state.log[orig_idx]
                 etype = entry.get("type")
 
                 # Row label
@@ -1179,9 +1585,9 @@ elif page == "log":
                 with c1:
                     st.write(label)
 
-                edit_key = f"edit_timeline_{pos}"
-                del_key = f"del_timeline_{pos}"
-                open_key = f"open_editor_{pos}"
+                edit_key = f"edit_timeline_{orig_idx}"
+                del_key = f"del_timeline_{orig_idx}"
+                open_key = f"open_editor_{orig_idx}"
 
                 with c2:
                     if st.button("✏️", key=edit_key):
@@ -1191,9 +1597,11 @@ elif page == "log":
                         st.experimental_rerun()
                 with c3:
                     if st.button("🗑", key=del_key):
-                        # Delete this entry and recompute derived totals
-                        del st.session_state.log[orig_idx]
-                        _recompute_from_log()
+                        # Delete this entry; a Trip takes itself off the totals
+                        delete_log_entry(st.session_state, orig_idx)
+                        if (st.session_state.log_cursor or -1) > orig_idx:
+                            st.session_state.log_cursor -= 1
+                        _check_trip_totals()
                         st.session_state.pending_changes = True
                         st.experimental_rerun()
 
@@ -1219,11 +1627,10 @@ elif page == "log":
                             cc1, cc2 = st.columns(2, gap="small")
                             with cc1:
                                 if st.button("💾 Save", key=f"{open_key}_save"):
-                                    entry["distance"] = float(new_distance)
-                                    entry["gallons"] = float(new_gallons)
-                                    entry["mpg"] = float(new_mpg)
-                                    st.session_state.log[orig_idx] = entry
-                                    _recompute_from_log()
+                                    update_trip(st.session_state, orig_idx,
+                                                {**entry, "distance": float(new_distance),
+                                                 "gallons": float(new_gallons), "mpg": float(new_mpg)})
+                                    _check_trip_totals()
                                     st.session_state["log_edit_entry_index"] = None
                                     st.session_state["log_edit_entry_type"] = None
                                     st.session_state.pending_changes = True
@@ -1273,7 +1680,9 @@ elif page == "log":
                                 if st.button("💾 Save", key=f"{open_key}_save_income"):
                                     entry["amount"] = float(new_owner)
                                     entry["note"] = new_note
+                                    before_write(st.session_state)
                                     st.session_state.log[orig_idx] = entry
+                                    mark_record(st.session_state, "log", orig_idx)
                                     # No need to recompute fuel totals; but mark changes for saving
                                     st.session_state["log_edit_entry_index"] = None
                                     st.session_state["log_edit_entry_type"] = None
@@ -1284,8 +1693,9 @@ elif page == "log":
                                     st.session_state["log_edit_entry_index"] = None
                                     st.session_state["log_edit_entry_type"] = None
                                     st.experimental_rerun()
+            _pager("log", next_log_cursor)
         else:
-            st.caption("No trip/income events yet.")
+            st.caption("No trip/income events in this range." if date_range else "No trip/income events yet.")
     else:
         st.info("Empty log.")
 
@@ -1293,8 +1703,16 @@ elif page == "log":
     # --- Expenses management now lives here (edit/delete mechanics moved from Expenses page) ---
     st.markdown("### 💸 Expenses — edit here")
     if st.session_state.expenses:
-        for i, entry in enumerate(reversed(st.session_state.expenses)):
-            idx = len(st.session_state.expenses) - 1 - i
+        lo, cursor = _bounds(st.session_state.expenses, "date", st.session_state.exp_cursor)
+        exp_page, next_exp_cursor = (
+            page_back(st.session_state.expenses, cursor, page_size, lo=lo)
+            if cursor is None or cursor >= 0 else ([], None)
+        )
+        if not exp_page:
+            st.caption("No expenses in this range.")
+        for idx in exp_page:
+            entry = st.session_state.expenses[idx]
+            i = idx  # widget keys follow the record, not its position on the page
             label = f"{entry.get('date', '')} – ${entry.get('amount', 0.0):.2f} – {entry.get('type', '')} ({entry.get('description', '')})"
             c1, c2, c3 = st.columns([0.75, 0.125, 0.125], gap="small")
             with c1:
@@ -1307,7 +1725,8 @@ elif page == "log":
             with c3:
                 if st.button("🗑", key=f"log_del_expense_{i}"):
                     _delete_expense_at(idx)
-                    _recompute_from_log()
+                    if (st.session_state.exp_cursor or -1) > idx:
+                        st.session_state.exp_cursor -= 1
                     rerun()
 
             # Inline editor under the row
@@ -1326,15 +1745,9 @@ elif page == "log":
                         if st.button("💾 Save", key=f"log_save_{i}", use_container_width=True):
                             exp = st.session_state.expenses[idx]
                             exp_id = exp.get("id")
-                            st.session_state.expenses[idx] = {"id": exp_id, "date": entry.get("date"), "type": new_type,
-                                                              "description": new_desc, "amount": new_amt}
-                            # update linked log entry
-                            if exp_id:
-                                for le in reversed(st.session_state.log):
-                                    if le.get("type") == "Expense" and le.get("expense_id") == exp_id:
-                                        le["amount"] = new_amt
-                                        le["note"] = f"{new_type}: {new_desc}"
-                                        break
+                            # also updates the linked log entry
+                            update_expense(st.session_state, idx, {"id": exp_id, "date": entry.get("date"), "type": new_type,
+                                                                   "description": new_desc, "amount": new_amt})
                             st.session_state.log_edit_expense_index = None
                             st.session_state.pending_changes = True
                             rerun()
@@ -1342,6 +1755,8 @@ elif page == "log":
                         if st.button("❌ Cancel", key=f"log_cancel_{i}", use_container_width=True):
                             st.session_state.log_edit_expense_index = None
                             rerun()
+        if exp_page:
+            _pager("exp", next_exp_cursor)
     else:
         st.caption("No expenses yet — add some on the Expenses page.")
 
@@ -1368,6 +1783,66 @@ elif page == "settings":
         except Exception as e:
             st.error(f"Reload failed: {e}")
 
+    def _on_live_toggle():
+        st.session_state.live_sync = st.session_state.live_sync_toggle
+        st.session_state.pop(LIVE_APPLIED, None)
+
+    st.toggle("📡 Live sync with my other devices", value=bool(st.session_state.get("live_sync")),
+              key="live_sync_toggle", on_change=_on_live_toggle,
+              help="Changes made on another phone or computer show up here within a few seconds.")
+
+    timings = st.session_state.get("bootstrap_timings")
+    if timings:
+        steps = " · ".join(f"{k} {v * 1000:.0f} ms" if v is not None else f"{k} timed out"
+                           for k, v in timings.items() if k not in ("total", "cached", "shared"))
+        from_cache = f", {timings['cached']} from cache" if timings.get("cached") else ""
+        if timings.get("shared"):
+            from_cache = ", data shared with your other open session"
+        st.caption(f"Sign-in took {timings['total'] * 1000:.0f} ms ({steps}{from_cache})")
+
+    if _is_admin():
+        with st.expander("⏱️ Instrumentation (all sessions on this server)"):
+            st.toggle("Profile my reruns with cProfile", key="profile_reruns",
+                      help="Adds overhead; only one capture runs at a time per server.")
+            rows = METRICS.summary()
+            if rows:
+                def _ms(v):
+                    return None if v is None else round(v * 1000, 1)
+                st.dataframe(
+                    [{"section": r["section"], "count": r["count"], "p50 ms": _ms(r["p50"]),
+                      "p95 ms": _ms(r["p95"]), "max ms": _ms(r["max"]), "total s": round(r["total"], 2)}
+                     for r in rows],
+                    hide_index=True, use_container_width=True,
+                )
+            else:
+                st.caption("No timings yet.")
+            names = sorted(r["section"] for r in rows if r["section"].split(".")[0] in ("db", "auth"))
+            if names:
+                name = st.selectbox("Latency histogram", names, key="admin_histogram")
+                hist = METRICS.histogram(name)  # cumulative
+                st.dataframe(
+                    [{"up to": f"{b * 1000:g} ms" if b != float("inf") else "slower",
+                      "calls": n - (hist[i - 1][1] if i else 0)} for i, (b, n) in enumerate(hist)],
+                    hide_index=True, use_container_width=True,
+                )
+            st.caption(f"Database breaker: {db.breaker.state} (opened {db.breaker.opened}×), "
+                       f"{db.stale_reads} reads served from cache · "
+                       f"auth breaker: {auth.breaker.state} (opened {auth.breaker.opened}×)")
+            dc = get_doc_cache().stats()
+            st.caption(f"Doc cache: {dc['users']} users, {dc['bytes'] / 1e6:.1f} MB, "
+                       f"{dc['hits']} hits / {dc['misses']} misses")
+            uid = st.session_state.user["localId"]
+            st.caption(f"Shared state: {get_shared_store().sessions(uid)} open session(s) of this account")
+            path = _metrics_textfile()
+            st.caption(f"Prometheus text file: {path}" if path else
+                       "Set METRICS_TEXTFILE (secrets) or BL_METRICS_TEXTFILE to export these for scraping.")
+            if st.session_state.get("last_profile"):
+                st.caption("Last captured rerun (cumulative time):")
+                st.code(st.session_state.last_profile, language="text")
+            if st.button("Reset timings", use_container_width=True):
+                METRICS.reset()
+                rerun()
+
     if st.session_state.get("allow_cookie_fallback"):
         if st.button("Try enabling cookies again", use_container_width=True):
             st.session_state.allow_cookie_fallback = False
@@ -1385,26 +1860,38 @@ elif page == "settings":
         if st.button("⚠️ Confirm Reset", use_container_width=True):
             try:
                 uid = st.session_state.user.get('localId') if st.session_state.get('user') else None
-                token = st.session_state.user.get('idToken') if st.session_state.get('user') else None
+                token = _id_token() if st.session_state.get('user') else None
                 # remove data from Firebase (best-effort)
                 if uid and token:
                     try:
-                        db.child("users").child(uid).child("app").remove(token)
+                        get_write_queue().flush(uid)
+                        # one multi-path write; the new stamp invalidates every server's doc cache
+                        wipe = {"app": None, "parts": None, **stamp(new_version())}
+                        wipe[parts_root(st.session_state)] = None
+                        pending = st.session_state.get("import_pending")
+                        staged = pending.get("root") if isinstance(pending, dict) else None
+                        if staged:
+                            wipe[staged] = None  # records of an unfinished import
+                        db.child("users").child(uid).update(wipe, token)
+                        get_doc_cache().drop(uid)
                     except Exception:
                         pass
                 # reset in-memory state to defaults (preserve auth)
                 defaults = {
                     "edit_expense_index": None,
                     "baseline": None,
-                    "log": [],
+                    "log": ledger_table("log"),
                     "total_miles": 0.0,
                     "total_cost": 0.0,
                     "total_gallons": 0.0,
                     "last_mileage": None,
                     "page": "mileage",
                     "last_trip_summary": {},
-                    "expenses": [],
-                    "earnings": [],
+                    "expenses": ledger_table("expenses"),
+                    "earnings": ledger_table("earnings"),
+                    "aggregates": empty_aggregates(),
+                    "rollups": {},
+                    "income_chart_end_idx": None,
                     "pending_changes": False,
                     "mileage": "",
                     "gallons": "",
@@ -1414,6 +1901,12 @@ elif page == "settings":
                 }
                 for k, v in defaults.items():
                     st.session_state[k] = v
+                rebuild_expense_index(st.session_state)
+                st.session_state.pop(LAST_TRIP, None)
+                st.session_state.pop(PARTS_ROOT, None)
+                st.session_state.pop("import_pending", None)
+                rebase(st.session_state)
+                mark_all_dirty(st.session_state, APP_KEYS)
                 # persist cleared payload
                 if uid and token:
                     try:
@@ -1431,33 +1924,58 @@ elif page == "settings":
     st.markdown("### 📁 Backup & Restore")
 
 
-    def _export_data_bytes():
-        data = {k: st.session_state[k] for k in [
-            "baseline", "last_mileage", "total_miles", "total_cost", "total_gallons",
-            "last_trip_summary", "log", "expenses", "earnings"
-        ]}
-        return json.dumps(data, indent=2).encode("utf-8")
-
-
-    st.download_button(
-        label="📥 Download JSON",
-        data=_export_data_bytes(),
-        file_name="balls_logistics_backup.json",
-        mime="application/json",
-        use_container_width=True,
-    )
+    # Built only when asked for and handed to the download button of that run;
+    # nothing is kept in session state, so the next rerun lets it go (see backup.py)
+    fmt = st.radio("Backup format", list(EXPORT_FORMATS), horizontal=True, key="backup_format",
+                   format_func={"ndjson.gz": "Compressed (.ndjson.gz)", "json": "Readable JSON"}.get)
+    if st.button("📦 Prepare backup", use_container_width=True):
+        with timed("export_backup"):
+            data = b"".join(export_backup(st.session_state, fmt))
+        file_name, mime = EXPORT_FORMATS[fmt]
+        st.download_button(
+            label=f"📥 Download backup ({len(data) / 1024:,.0f} KB)",
+            data=data,
+            file_name=file_name,
+            mime=mime,
+            use_container_width=True,
+        )
 
-    up = st.file_uploader("Upload backup JSON", type="json")
-    if up:
+    # Streamed straight into the database in batches (see backup.py); the
+    # session then reloads like a fresh sign-in, newest partitions only.
+    result = st.session_state.pop("import_result", None)
+    if result is not None:
+        n = sum(result.records.values())
+        skipped = f", skipped {result.skipped}" if result.skipped else ""
+        st.success(f"{'Resumed & finished' if result.resumed else 'Imported'} {n} record{'s' if n != 1 else ''}{skipped}.")
+        if result.skipped:
+            st.warning(f"Skipped {result.skipped} invalid entr{'ies' if result.skipped != 1 else 'y'}:\n\n"
+                       + "\n".join(f"- {e}" for e in result.errors))
+    pending = st.session_state.get("import_pending")
+    if isinstance(pending, dict):
+        done = sum(int(n or 0) for n in (pending.get("done") or {}).values())
+        st.warning(f"A backup import stopped after {done} records. Upload the same file again to resume it.")
+
+    up = st.file_uploader("Upload backup (.ndjson.gz or .json)", type=["gz", "ndjson", "json"])
+    if up and st.button("📤 Import backup", use_container_width=True):
+        uid = st.session_state.user["localId"]
+        bar = st.progress(0.0, text="Importing…")
         try:
-            content = up.read()
-            data = json.loads(content)
-            for k, v in data.items():
-                st.session_state[k] = v
-            save_data()
-            st.success("Imported & saved.")
+            get_write_queue().flush(uid)
+            with timed("import_backup"):
+                result = import_backup(up, db.child("users").child(uid), _id_token,
+                                       progress=lambda f: bar.progress(f, text=f"Importing… {f:.0%}"))
+        except ValueError as e:
+            st.error(f"Can't import this file: {e}")  # nothing was changed
         except Exception as e:
-            st.error(f"Import failed: {e}")
+            st.error(f"Import failed: {e}. Upload the same file again to resume.")
+        else:
+            get_doc_cache().drop(uid)
+            for k in (*APP_KEYS, "expense_index", LAST_TRIP):
+                st.session_state.pop(k, None)
+            init_session()
+            load_data()
+            st.session_state.import_result = result
+            rerun()
 
     # --------------------- Quick Report (Settings only) ---------------------
     st.divider()
@@ -1472,11 +1990,7 @@ elif page == "settings":
         lines.append(f"Current: {st.session_state.last_mileage}")
         lines.append(f"Miles: {st.session_state.total_miles:.2f}")
         lines.append(f"Gallons: {st.session_state.total_gallons:.2f}")
-        fuel_total = sum(
-            e.get("amount", 0.0)
-            for e in st.session_state.expenses
-            if e.get("type") == "Fuel"
-        )
+        fuel_total = float(aggregates(st.session_state)["by_type"].get("Fuel", 0.0) or 0.0)
         lines.append(f"Fuel $: ${fuel_total:.2f}")  # CHANGED
         if st.session_state.total_gallons > 0:
             lines.append(f"Avg MPG: {st.session_state.total_miles / st.session_state.total_gallons:.2f}")
@@ -1496,3 +2010,8 @@ if page == "settings":
 
 # NOTE: Former Mileage statistics block removed per request.
 # Statistics now lives on the Expenses page and shows ONLY "Expenses by Category".
+
+
+# ------------------------- End of run -------------------------
+_page_done()
+finish_rerun()
@@ -0,0 +1,249 @@
+# sync.py
+# Write-behind queue for the /users/<uid> node (app data + monthly partitions).
+#
+# save_data() hands its multi-path delta to the writer for that uid and returns
+# straight away. The writer thread waits a short window so bursts of taps
+# coalesce, then sends one update() off the render path. Writers are process
+# wide (one per uid), so every tab/session of a user shares the same queue and
+# ordering is preserved. With a TokenManager (tokens.py) the ID token is taken
+# at send time, not when the change was queued. With a DocCache (doccache.py)
+# every send stamps /users/<uid>/version and /changed (doccache.stamp(), for
+# live sync); with a DocCache (doccache.py) the old stamp is read first so
+# the cache can tell whether someone else wrote in between. With a Journal
+# (journal.py) every delta is on disk before it is queued and acknowledged
+# after it was sent; a new writer first replays what its uid left unsent, and
+# resume() starts one at startup for every uid the journal still has entries
+# for (with the refresh token recorded there).
+import atexit
+import copy
+import threading
+import time
+
+from doccache import VERSION_KEY, new_version, stamp
+from instrument import timed
+
+WRITE_BEHIND_WINDOW = 0.75   # seconds to collect changes before a flush
+RETRY_BACKOFF_MAX = 30.0     # seconds between retries after a failed flush
+
+
+def _set_in(tree, rel, value):
+    # deep-set `value` at relative path `rel` inside a JSON value (dict/list)
+    parts = [p for p in rel.split("/") if p]
+    if isinstance(tree, list):
+        tree = {str(i): x for i, x in enumerate(tree) if x is not None}
+    elif not isinstance(tree, dict):
+        tree = {}
+    node = tree
+    for p in parts[:-1]:
+        nxt = node.get(p)
+        if isinstance(nxt, list):
+            nxt = {str(i): x for i, x in enumerate(nxt) if x is not None}
+        elif not isinstance(nxt, dict):
+            nxt = {}
+        node[p] = nxt
+        node = nxt
+    node[parts[-1]] = value
+    return tree
+
+
+def merge_delta(base, new):
+    # Fold multi-path update `new` into `base` as if `new` were sent after it.
+    # Paths in one Firebase update() must not overlap, so a newer parent path
+    # swallows older children and a newer child is written into an older parent.
+    out = dict(base)
+    for path, value in new.items():
+        prefix = path + "/"
+        for k in [k for k in out if k.startswith(prefix)]:
+            del out[k]
+        parent = next((k for k in out if k != path and path.startswith(k + "/")), None)
+        if parent is None:
+            out[path] = value
+        else:
+            out[parent] = _set_in(copy.deepcopy(out[parent]), path[len(parent) + 1:], value)
+    return out
+
+
+def _is_auth_error(ex):
+    msg = str(ex).lower()
+    return "401" in msg or "auth token" in msg or "permission denied" in msg or "token_expired" in msg
+
+
+class UserWriter:
+    def __init__(self, db, uid, window=WRITE_BEHIND_WINDOW, tokens=None, doc_cache=None, journal=None):
+        self.db = db
+        self.uid = uid
+        self.window = window
+        self.tokens = tokens
+        self.doc_cache = doc_cache
+        self.journal = journal
+        self._cv = threading.Condition()
+        self._pending = {}
+        self._seq = None        # journal entry the pending payload goes up to
+        self._token = None
+        self._inflight = False
+        self._failures = 0
+        self.retry_at = None
+        self.last_error = None
+        self.last_synced_at = None
+        if journal is not None:
+            # left unsent by an earlier run of the server
+            for seq, delta in journal.pending(uid):
+                self._pending = merge_delta(self._pending, delta)
+                self._seq = seq
+        self._thread = threading.Thread(target=self._run, name=f"writer-{uid}", daemon=True)
+        self._thread.start()
+
+    def submit(self, delta, token):
+        if not delta:
+            return
+        delta = copy.deepcopy(delta)  # session objects keep changing after this
+        with self._cv:
+            if self.journal is not None:
+                refresh = self.tokens.refresh_token(self.uid) if self.tokens is not None else None
+                # raises if it can't be made durable
+                self._seq = self.journal.append(self.uid, delta, refresh)
+            self._pending = merge_delta(self._pending, delta)
+            self._token = token or self._token
+            self._cv.notify_all()
+
+    def status(self):
+        # "synced" | "syncing" | "error"
+        with self._cv:
+            if self.last_error is not None and (self._pending or self._inflight):
+                return "error"
+            return "syncing" if (self._pending or self._inflight) else "synced"
+
+    def depth(self):
+        # changes waiting to be sent (journal entries, or 1 for an unjournaled batch)
+        if self.journal is not None:
+            return self.journal.depth(self.uid)
+        with self._cv:
+            return int(bool(self._pending or self._inflight))
+
+    def flush(self, timeout=15.0):
+        # Block until everything submitted so far has been written (or timeout)
+        deadline = time.monotonic() + timeout
+        with self._cv:
+            self._failures = 0  # retry right away instead of waiting out a backoff
+            self._cv.notify_all()
+            while self._pending or self._inflight:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cv.wait(left)
+            return True
+
+    def _run(self):
+        while True:
+            with self._cv:
+                while not self._pending:
+                    self._cv.wait()
+            # let a burst of taps land in the same flush
+            time.sleep(self.window)
+            with self._cv:
+                payload, token, seq = self._pending, self._token, self._seq
+                self._pending = {}
+                self._inflight = True
+            try:
+                if self.tokens is not None:
+                    token = self.tokens.token(self.uid) or token
+                user = self.db.child("users").child(self.uid)
+                with timed("sync.write"):
+                    after = new_version()
+                    payload.update(stamp(after, payload))
+                    if self.doc_cache is not None:
+                        before = user.child(VERSION_KEY).get(token).val()
+                        self.doc_cache.own(self.uid, after)
+                    user.update(payload, token)
+                if self.doc_cache is not None:
+                    self.doc_cache.committed(self.uid, before, after)
+                if self.journal is not None and seq is not None:
+                    self.journal.ack(self.uid, seq)
+            except Exception as ex:
+                if self.tokens is not None and _is_auth_error(ex):
+                    self.tokens.expire(self.uid)
+                with self._cv:
+                    # keep the failed paths, with anything newer layered on top
+                    self._pending = merge_delta(payload, self._pending)
+                    self._inflight = False
+                    self._failures += 1
+                    self.last_error = ex
+                    backoff = min(RETRY_BACKOFF_MAX, 2 ** self._failures)
+                    self.retry_at = time.time() + backoff
+                    self._cv.notify_all()
+                    self._cv.wait(backoff)
+                    self.retry_at = None
+                continue
+            with self._cv:
+                self._inflight = False
+                self._failures = 0
+                self.retry_at = None
+                self.last_error = None
+                self.last_synced_at = time.time()
+                self._cv.notify_all()
+
+
+class WriteBehindQueue:
+    # uid -> UserWriter, created on first use
+    def __init__(self, db, window=WRITE_BEHIND_WINDOW, tokens=None, doc_cache=None, journal=None):
+        self.db = db
+        self.window = window
+        self.tokens = tokens
+        self.doc_cache = doc_cache
+        self.journal = journal
+        self._lock = threading.Lock()
+        self._writers = {}
+        atexit.register(self.flush_all)
+
+    def writer(self, uid):
+        with self._lock:
+            w = self._writers.get(uid)
+            if w is None:
+                w = self._writers[uid] = UserWriter(self.db, uid, self.window, self.tokens, self.doc_cache,
+                                                    self.journal)
+            return w
+
+    def resume(self):
+        # after a restart: send what earlier runs left in the journal, signed in or not
+        if self.journal is None:
+            return
+        for uid, refresh in self.journal.recover():
+            if self.tokens is not None:
+                self.tokens.adopt(uid, refresh)
+            self.writer(uid)
+
+    def submit(self, uid, delta, token):
+        if self.doc_cache is not None and delta:
+            self.doc_cache.apply(uid, delta)
+        try:
+            self.writer(uid).submit(delta, token)
+        except Exception:
+            if self.doc_cache is not None:
+                self.doc_cache.drop(uid)  # it holds a change that was not queued
+            raise
+
+    def status(self, uid):
+        with self._lock:
+            w = self._writers.get(uid)
+        return w.status() if w else "synced"
+
+    def depth(self, uid):
+        with self._lock:
+            w = self._writers.get(uid)
+        return w.depth() if w else 0
+
+    def retry_at(self, uid):
+        # unix time of the next attempt after a failed send, or None
+        with self._lock:
+            w = self._writers.get(uid)
+        return w.retry_at if w else None
+
+    def flush(self, uid, timeout=15.0):
+        with self._lock:
+            w = self._writers.get(uid)
+        return w.flush(timeout) if w else True
+
+    def flush_all(self, timeout=15.0):
+        with self._lock:
+            writers = list(self._writers.values())
+        return all(w.flush(timeout) for w in writers)
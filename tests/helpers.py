@@ -0,0 +1,103 @@
+# tests/helpers.py
+# What streamlit_app.py does around the modules under test, without Streamlit:
+# a fresh session state, save_data() (one multi-path update per save) and
+# load_data() (the ledgers from their partitions, older months on demand).
+import random
+from datetime import datetime, timedelta
+
+from columnar import LEDGER_KEYS, LedgerTable, ledger_table
+from events import EVENT_KEYS, maybe_snapshot, restore
+from ledger import (
+    add_earning, add_expense, add_trip, build_aggregates, build_rollups, delete_expense,
+    delete_log_entry, ensure_aggregates, ensure_rollups, update_expense, update_trip,
+)
+from persistence import PARTS_ROOT, build_delta, mark_synced, parts_root
+
+APP_KEYS = [
+    "baseline", "last_mileage", "total_miles", "total_cost", "total_gallons",
+    "last_trip_summary", *LEDGER_KEYS, "aggregates", "rollups", *EVENT_KEYS, PARTS_ROOT,
+]
+
+
+def new_state(baseline=1000.0):
+    state = {"baseline": baseline, "last_mileage": baseline, "total_miles": 0.0, "total_cost": 0.0,
+             "total_gallons": 0.0, "last_trip_summary": {},
+             "aggregates": build_aggregates([], []), "rollups": build_rollups([], [])}
+    for k in LEDGER_KEYS:
+        state[k] = ledger_table(k)
+    mark_synced(state, APP_KEYS)
+    return state
+
+
+def save(state, users):
+    # save_data(); -> the delta that was written
+    maybe_snapshot(state)
+    delta = build_delta(state, APP_KEYS)
+    if delta:
+        users.update(delta)
+    mark_synced(state, APP_KEYS)
+    return delta
+
+
+def load(users):
+    # load_data(): /app, then every ledger from its partitions
+    data = users.child("app").get().val() or {}
+    index = data.pop("part_index", None) or {}
+    state = {k: v for k, v in data.items() if k not in LEDGER_KEYS}
+    root = parts_root(state)
+    months = sorted(index)
+    for k in LEDGER_KEYS:
+        counts = [(mk, (index[mk] or {}).get(k)) for mk in months if (index[mk] or {}).get(k)]
+        recent = {mk: users.child(root).child(mk).child(k).get().val() for mk in months[-2:]}
+        state[k] = LedgerTable.from_parts(
+            k, counts, recent, lambda kind, mk: users.child(root).child(mk).child(kind).get().val())
+    mark_synced(state, APP_KEYS, data)
+    ensure_aggregates(state)
+    ensure_rollups(state)
+    restore(state)
+    return state
+
+
+class Session:
+    # random adds, edits and deletes through ledger.py, the way the app makes them
+    def __init__(self, state, seed=0):
+        self.state = state
+        self.rng = random.Random(seed)
+        self.now = datetime(2024, 1, 1, 8)
+        self.next_id = 1
+
+    def step(self):
+        rng, state = self.rng, self.state
+        self.now += timedelta(hours=rng.randint(1, 60))
+        ts, day = self.now.strftime("%Y-%m-%d %H:%M:%S"), self.now.strftime("%Y-%m-%d")
+        op = rng.random()
+        if op < 0.3:
+            distance = round(rng.uniform(10, 500), 1)
+            gallons = round(distance / rng.uniform(5, 9), 2)
+            add_trip(state, {"timestamp": ts, "type": "Trip", "distance": distance, "gallons": gallons,
+                             "mpg": distance / gallons, "note": "Mileage + Fuel"})
+        elif op < 0.5:
+            amount = round(rng.uniform(5, 900), 2)
+            etype = rng.choice(["Fuel", "Repairs", "Tolls"])
+            add_expense(state, {"id": self.next_id, "date": day, "type": etype, "description": "",
+                                "amount": amount},
+                        {"timestamp": ts, "type": "Expense", "amount": amount, "note": f"{etype}: ",
+                         "expense_id": self.next_id})
+            self.next_id += 1
+        elif op < 0.6:
+            add_earning(state, {"date": day, "worker": 100.0, "owner": round(rng.uniform(200, 900), 2),
+                                "net_owner": 0.0},
+                        {"timestamp": ts, "type": "Earning", "amount": 100.0, "note": "Income"})
+        elif op < 0.7 and len(state["expenses"]):
+            i = rng.randrange(len(state["expenses"]))
+            update_expense(state, i, dict(state["expenses"][i], amount=round(rng.uniform(5, 900), 2)))
+        elif op < 0.8 and len(state["expenses"]):
+            delete_expense(state, rng.randrange(len(state["expenses"])))
+        elif op < 0.9 and len(state["log"]):
+            j = rng.randrange(len(state["log"]))
+            if state["log"][j].get("type") == "Trip":
+                update_trip(state, j, dict(state["log"][j], distance=round(rng.uniform(10, 500), 1)))
+        elif len(state["log"]):
+            j = rng.randrange(len(state["log"]))
+            if state["log"][j].get("type") != "Expense":
+                delete_log_entry(state, j)
@@ -0,0 +1,92 @@
+# tests/test_backup.py
+# export_backup() -> import_backup() into another account: the same ledgers,
+# the totals rebuilt, the old partitions gone, bad records skipped.
+import gzip
+import io
+import json
+
+import pytest
+
+import backup
+from columnar import LEDGER_KEYS
+from storage import MemoryStorage
+from tests.helpers import Session, load, new_state
+
+
+@pytest.fixture(scope="module")
+def state():
+    session = Session(new_state(baseline=2500.0), seed=11)
+    for _ in range(400):
+        session.step()
+    return session.state
+
+
+def _users(old=True):
+    # an account with data of its own, which the import replaces
+    data = {"app": {"baseline": 5, "part_index": {"1999-01": {"log": 1}}},
+            "parts": {"1999-01": {"log": [{"timestamp": "1999-01-01 00:00:00", "type": "Trip"}]}}}
+    return MemoryStorage({"users": {"u": data if old else {}}}).child("users").child("u")
+
+
+def _import(raw, users, **kw):
+    return backup.import_backup(io.BytesIO(raw), users, lambda: None, **kw)
+
+
+@pytest.mark.parametrize("fmt", list(backup.EXPORT_FORMATS))
+def test_round_trip(state, fmt):
+    raw = b"".join(backup.export_backup(state, fmt))
+    users = _users()
+    result = _import(raw, users, batch=50)
+    assert result.skipped == 0 and not result.resumed
+    assert result.records == {k: len(state[k]) for k in LEDGER_KEYS}
+
+    node = users.get().val()
+    root = node["app"]["parts_root"]
+    assert set(node) == {"app", root, "version", "changed"}  # /parts and the marker are gone
+    loaded = load(users)
+    for k in LEDGER_KEYS:
+        assert loaded[k].to_json() == state[k].to_json()
+    assert loaded["baseline"] == state["baseline"]
+    for k in ("total_miles", "total_gallons", "last_mileage"):
+        assert loaded[k] == pytest.approx(state[k])
+    for k in ("worker", "owner", "expenses"):
+        assert loaded["aggregates"][k] == pytest.approx(state["aggregates"][k])
+    assert loaded["rollups"].keys() == state["rollups"].keys()
+
+
+def test_legacy_records_are_kept_broken_ones_skipped(state):
+    doc = json.loads(b"".join(backup.export_backup(state, "json")))
+    doc["expenses"].append({"id": 9001, "date": "2024/06/01", "type": "Fuel", "amount": "12.50"})
+    doc["expenses"].append({"id": 9002, "bad.key": 1})
+    doc["log"].append(["not", "a", "record"])
+    users = _users()
+    result = _import(json.dumps(doc).encode(), users)
+    assert result.skipped == 2 and len(result.errors) == 2
+    assert result.records["expenses"] == len(state["expenses"]) + 1
+    assert load(users)["expenses"].to_json()[-1]["amount"] == "12.50"
+
+
+def test_damaged_file_changes_nothing(state):
+    raw = b"".join(backup.export_backup(state, "ndjson.gz"))
+    users = _users()
+    before = users.get().val()
+    with pytest.raises(ValueError):
+        _import(gzip.compress(gzip.decompress(raw)[:-200]), users)
+    assert users.get().val() == before
+
+
+def test_interrupted_import_resumes(state):
+    raw = b"".join(backup.export_backup(state, "ndjson.gz"))
+    users = _users()
+
+    def stop(fraction):
+        if fraction > 0.3:
+            raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        _import(raw, users, batch=50, progress=stop)
+    assert users.child("app").child("baseline").get().val() == 5  # still the old data
+    result = _import(raw, users, batch=50)
+    assert result.resumed and result.written < sum(result.records.values())
+    loaded = load(users)
+    for k in LEDGER_KEYS:
+        assert loaded[k].to_json() == state[k].to_json()
@@ -0,0 +1,52 @@
+# tests/test_columnar.py
+# LedgerTable holds records in typed columns; what goes in must come back out
+# exactly, through to_json() and through the monthly partitions.
+import json
+
+from columnar import LedgerTable
+
+EXPENSES = [
+    {"id": 1, "date": "2024-01-05", "type": "Fuel", "description": "", "amount": 10.5},
+    {"id": 2, "date": "2024-01-09", "type": "Tolls", "amount": 7},                # int amount, no description
+    {"id": 2 ** 60, "date": "2024-02-01", "type": "Fuel", "amount": 2 ** 60},    # past float64
+    {"id": 4, "date": "2024/02/03", "type": "Repairs", "amount": "12.50"},      # legacy date and amount
+    {"id": 5, "date": "2024-02-04", "type": None, "amount": None, "vendor": "Pilot", "tags": ["a", "b"]},
+    {"id": "x-6", "date": "2024-03-01", "type": "Fuel", "amount": 1.0, "nested": {"k": 1}},
+]
+
+
+def test_json_round_trip_keeps_values_and_types():
+    table = LedgerTable("expenses", EXPENSES)
+    out = table.to_json()
+    assert out == EXPENSES
+    assert [type(r.get("amount")) for r in out] == [type(r.get("amount")) for r in EXPENSES]
+    assert [type(r["id"]) for r in out] == [type(r["id"]) for r in EXPENSES]
+    assert json.loads(json.dumps(out)) == EXPENSES
+
+
+def test_edits_keep_extras_and_ints():
+    table = LedgerTable("expenses", EXPENSES)
+    table[1] = dict(table[1], amount=8)
+    table[4] = dict(table[4], vendor="Love's")
+    del table[0]
+    assert table[0]["amount"] == 8 and isinstance(table[0]["amount"], int)
+    assert table[3]["vendor"] == "Love's" and table[3]["tags"] == ["a", "b"]
+    assert table.to_json() == [dict(EXPENSES[1], amount=8), EXPENSES[2], EXPENSES[3],
+                               dict(EXPENSES[4], vendor="Love's"), EXPENSES[5]]
+
+
+def test_partitions_round_trip():
+    table = LedgerTable("expenses", EXPENSES)
+    assert [mk for mk, _ in table.parts] == ["2024-01", "2024-02", "2024-03"]
+    rows = {mk: table.partition_rows(mk) for mk, _ in table.parts}
+    # only the newest month in memory, the others fetched when reached
+    fetched = []
+
+    def loader(kind, mk):
+        fetched.append(mk)
+        return rows[mk]
+    lazy = LedgerTable.from_parts("expenses", table.parts, {"2024-03": rows["2024-03"]}, loader)
+    assert len(lazy) == len(EXPENSES) and lazy.base == 5 and not fetched
+    assert lazy[-1] == EXPENSES[-1]
+    assert lazy.to_json() == EXPENSES
+    assert fetched == ["2024-02", "2024-01"]
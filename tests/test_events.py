@@ -0,0 +1,78 @@
+# tests/test_events.py
+# restore() rebuilds the trip totals from the snapshot, the log records after
+# it and the corrections; it has to agree with a full recompute of the log.
+import pytest
+
+from events import CORRECTIONS, EVENT_SEQ, SNAPSHOT, restore, take_snapshot
+from ledger import add_trip, delete_log_entry, trip_totals, update_trip
+from persistence import mark_synced
+from tests.helpers import APP_KEYS, Session, new_state
+
+DERIVED = ("total_miles", "total_gallons", "last_mileage")
+
+
+def _trip(ts, distance, gallons=10.0):
+    return {"timestamp": ts, "type": "Trip", "distance": distance, "gallons": gallons, "note": "Mileage + Fuel"}
+
+
+def _restored(state):
+    # what load_data() would rebuild from the persisted keys alone
+    fresh = {k: state.get(k) for k in APP_KEYS}
+    for k in (*DERIVED, "last_trip_summary"):
+        fresh[k] = (state.get(SNAPSHOT) or {}).get(k, fresh[k])
+    mark_synced(fresh, APP_KEYS)
+    restore(fresh)
+    return fresh
+
+
+def _assert_matches_log(state):
+    fresh = _restored(state)
+    full = trip_totals(state)
+    for k in DERIVED:
+        assert fresh[k] == pytest.approx(full[k])
+    assert fresh["last_trip_summary"] == full["last_trip_summary"]
+
+
+def test_restore_replays_events_after_the_snapshot():
+    state = new_state(baseline=500.0)
+    add_trip(state, _trip("2024-01-01 08:00:00", 100.0))
+    add_trip(state, _trip("2024-01-02 08:00:00", 200.0))
+    take_snapshot(state)
+    add_trip(state, _trip("2024-01-03 08:00:00", 50.0))
+    _assert_matches_log(state)
+    assert _restored(state)["last_mileage"] == pytest.approx(850.0)
+
+
+def test_restore_applies_corrections_to_snapshotted_trips():
+    state = new_state(baseline=500.0)
+    for day, miles in ((1, 100.0), (2, 200.0), (3, 300.0)):
+        add_trip(state, _trip(f"2024-01-0{day} 08:00:00", miles))
+    take_snapshot(state)
+    update_trip(state, 0, _trip("2024-01-01 08:00:00", 150.0))
+    delete_log_entry(state, 2)  # the newest trip, which the snapshot's summary points at
+    assert len(state[CORRECTIONS]) == 2
+    add_trip(state, _trip("2024-01-04 08:00:00", 20.0))
+    _assert_matches_log(state)
+    delete_log_entry(state, 2)
+    fresh = _restored(state)
+    assert fresh["last_trip_summary"]["distance"] == 200.0
+    _assert_matches_log(state)
+
+
+def test_restore_without_a_snapshot_uses_the_saved_totals():
+    # data saved before snapshots: no seq on the records, the persisted keys are the totals
+    state = {"baseline": 0.0, "log": [_trip("2024-01-01 08:00:00", 40.0)], "total_miles": 40.0,
+             "total_gallons": 10.0, "last_mileage": 40.0, "last_trip_summary": _trip("2024-01-01 08:00:00", 40.0)}
+    restore(state)
+    assert (state["total_miles"], state["total_gallons"], state["last_mileage"]) == (40.0, 10.0, 40.0)
+    assert EVENT_SEQ not in state
+
+
+@pytest.mark.parametrize("seed", [7, 8])
+def test_restore_matches_the_log_after_random_edits(seed):
+    session = Session(new_state(), seed=seed)
+    for i in range(250):
+        session.step()
+        if i == 120:
+            take_snapshot(session.state)
+    _assert_matches_log(session.state)
@@ -0,0 +1,94 @@
+# tests/test_persistence.py
+# The deltas save_data() sends, checked against the node a full rewrite of the
+# same state produces, and apply_delta() following them on a second device.
+import pytest
+
+from columnar import LEDGER_KEYS, LedgerTable
+from events import restore, take_snapshot
+from persistence import apply_delta, build_delta, mark_all_dirty, parts_root
+from storage import MemoryStorage
+from tests.helpers import APP_KEYS, Session, load, new_state, save
+
+STEPS = 300
+
+
+def _users():
+    return MemoryStorage().child("users").child("u")
+
+
+def _run(seed, on_save=None):
+    users = _users()
+    session = Session(new_state(), seed=seed)
+    for i in range(STEPS):
+        session.step()
+        if i % 3 == 0 or i == STEPS - 1:
+            delta = save(session.state, users)
+            if on_save is not None and delta:
+                on_save(delta)
+    return session.state, users
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_deltas_match_a_full_rebuild(seed):
+    state, users = _run(seed)
+    assert len({mk for mk, _ in state["log"].parts}) > 3  # the ops spread over several months
+
+    # the same ledgers written whole into an empty database
+    fresh = {k: LedgerTable(k, state[k].to_json()) for k in LEDGER_KEYS}
+    mark_all_dirty(fresh, LEDGER_KEYS)
+    rebuilt = _users()
+    rebuilt.update(build_delta(fresh, APP_KEYS))
+
+    root = parts_root(state)
+    assert users.child(root).get().val() == rebuilt.child(root).get().val()
+    assert users.child("app").child("part_index").get().val() == rebuilt.child("app").child("part_index").get().val()
+
+    loaded = load(users)
+    for k in LEDGER_KEYS:
+        assert loaded[k].to_json() == state[k].to_json()
+    assert loaded["aggregates"] == state["aggregates"]
+    assert loaded["rollups"] == state["rollups"]
+    for k in ("total_miles", "total_gallons", "last_mileage"):
+        assert loaded[k] == pytest.approx(state[k])
+    assert loaded["last_trip_summary"] == state["last_trip_summary"]
+
+
+def test_apply_delta_follows_another_device():
+    users = _users()
+    session = Session(new_state(), seed=4)
+    for _ in range(10):
+        session.step()
+    save(session.state, users)
+    follower = load(users)
+    for k in LEDGER_KEYS:
+        follower[k].load_all()
+    for i in range(STEPS):
+        session.step()
+        if i % 3 == 0 or i == STEPS - 1:
+            assert apply_delta(follower, save(session.state, users), APP_KEYS)
+            restore(follower)
+    state = session.state
+    for k in LEDGER_KEYS:
+        assert follower[k].to_json() == state[k].to_json()
+    assert follower["aggregates"] == state["aggregates"]
+    assert follower["rollups"] == state["rollups"]
+    assert follower["total_miles"] == pytest.approx(state["total_miles"])
+    assert follower["last_trip_summary"] == state["last_trip_summary"]
+
+
+def test_apply_delta_refuses_what_it_cant_follow():
+    state, users = _run(5)
+    take_snapshot(state)  # so load() has no older events to replay
+    save(state, users)
+    follower = load(users)  # only the newest months are in memory
+    oldest = state["log"].parts[0][0]
+    assert follower["log"].base > 0
+    assert not apply_delta(follower, {f"parts/{oldest}/log/0": {"type": "Trip"}}, APP_KEYS)
+
+    follower = load(users)
+    follower["dirty_keys"] = {"baseline"}  # unsent changes of its own
+    assert not apply_delta(follower, {"app/baseline": 1.0}, APP_KEYS)
+
+    follower = load(users)
+    assert not apply_delta(follower, {"app/parts_root": "parts-x"}, APP_KEYS)
+    assert not apply_delta(follower, {f"parts/{oldest}/log": None}, APP_KEYS)
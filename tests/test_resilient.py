@@ -0,0 +1,93 @@
+# tests/test_resilient.py
+# CircuitBreaker: closed -> open after a run of failures, one trial call once
+# the cooldown is over (half-open), closed again or re-opened by its outcome;
+# and every ResilientStorage entry point reporting back to it.
+import time
+
+import pytest
+
+from resilient import CircuitBreaker, CircuitOpen, ResilientStorage
+from storage import MemoryStorage
+
+COOLDOWN = 0.05
+
+
+def _opened(failures=3):
+    breaker = CircuitBreaker(failures=failures, cooldown=COOLDOWN)
+    for _ in range(failures):
+        assert breaker.allow()
+        breaker.failure()
+    return breaker
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failures=3, cooldown=COOLDOWN)
+    breaker.failure()
+    breaker.failure()
+    breaker.success()  # a success resets the streak
+    breaker.failure()
+    breaker.failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open" and breaker.opened == 1
+    assert not breaker.allow()
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = _opened()
+    time.sleep(COOLDOWN * 1.5)
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()  # one probe at a time
+
+
+def test_trial_success_closes():
+    breaker = _opened()
+    time.sleep(COOLDOWN * 1.5)
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_trial_failure_reopens():
+    breaker = _opened()
+    time.sleep(COOLDOWN * 1.5)
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open" and not breaker.allow()
+    assert breaker.opened == 1  # still the same outage
+
+
+class _Flaky(MemoryStorage):
+    def __init__(self):
+        super().__init__()
+        self.down = False
+
+    def stream(self, path, handler, token=None):
+        if self.down:
+            raise ConnectionError("down")
+        return super().stream(path, handler, token)
+
+
+def test_stream_reports_its_trial():
+    backend = _Flaky()
+    db = ResilientStorage(backend, breaker=_opened())
+    with pytest.raises(CircuitOpen):
+        db.child("users").stream(lambda msg: None)
+    time.sleep(COOLDOWN * 1.5)
+    backend.down = True
+    with pytest.raises(ConnectionError):
+        db.child("users").stream(lambda msg: None)
+    assert db.breaker.state == "open"
+    time.sleep(COOLDOWN * 1.5)
+    backend.down = False
+    stream = db.child("users").stream(lambda msg: None)
+    stream.close()
+    assert db.breaker.state == "closed"
+
+
+def test_reads_report_their_trial():
+    db = ResilientStorage(MemoryStorage({"users": {"u": {"version": "v1"}}}), breaker=_opened())
+    time.sleep(COOLDOWN * 1.5)
+    assert db.child("users").child("u").child("version").get().val() == "v1"
+    assert db.breaker.state == "closed"
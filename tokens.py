@@ -0,0 +1,157 @@
+# tokens.py
+# Process-wide ID token cache, one entry per uid.
+#
+# Sign-in / refresh results are registered here with their expiry. token(uid)
+# hands out the cached ID token and only goes to the network when it is about
+# to expire; concurrent callers for the same uid share one refresh. A
+# background thread refreshes tokens TOKEN_REFRESH_MARGIN seconds before they
+# expire, so the write-behind queue never sends a stale one. A new tab that
+# restores from its cookie reuses the cached token when it presents a refresh
+# token this entry has seen.
+import threading
+import time
+
+DEFAULT_TOKEN_TTL = 3600      # Firebase ID tokens live an hour
+TOKEN_REFRESH_MARGIN = 300    # refresh this many seconds before expiry
+TOKEN_IDLE_TTL = 2 * 3600     # stop refreshing users nobody asked for in this long
+RETRY_AFTER_FAILURE = 30.0
+
+
+class _Entry:
+    def __init__(self):
+        self.lock = threading.Lock()   # single flight per uid
+        self.id_token = None
+        self.refresh_tokens = []       # newest last; Firebase may rotate them
+        self.expires_at = 0.0
+        self.last_used = time.monotonic()
+        self.retry_at = 0.0
+
+    @property
+    def refresh_token(self):
+        return self.refresh_tokens[-1] if self.refresh_tokens else None
+
+
+class TokenManager:
+    def __init__(self, auth, margin=TOKEN_REFRESH_MARGIN):
+        self.auth = auth
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._cv = threading.Condition(self._lock)
+        self._entries = {}
+        self._thread = threading.Thread(target=self._run, name="token-refresh", daemon=True)
+        self._thread.start()
+
+    def _entry(self, uid):
+        with self._lock:
+            e = self._entries.get(uid)
+            if e is None:
+                e = self._entries[uid] = _Entry()
+            return e
+
+    def _store(self, e, id_token, refresh_token, expires_in):
+        try:
+            ttl = float(expires_in or DEFAULT_TOKEN_TTL)
+        except (TypeError, ValueError):
+            ttl = DEFAULT_TOKEN_TTL
+        with self._cv:
+            e.id_token = id_token
+            if refresh_token and refresh_token not in e.refresh_tokens:
+                e.refresh_tokens = (e.refresh_tokens + [refresh_token])[-3:]
+            e.expires_at = time.monotonic() + ttl
+            e.retry_at = 0.0
+            self._cv.notify_all()  # reschedule the background refresh
+
+    def register(self, uid, id_token, refresh_token, expires_in=None):
+        # after sign-in / sign-up
+        if uid and id_token:
+            self._store(self._entry(uid), id_token, refresh_token, expires_in)
+
+    def adopt(self, uid, refresh_token):
+        # a refresh token kept from an earlier run (journal.py); token() refreshes with it
+        if uid and refresh_token:
+            e = self._entry(uid)
+            with self._cv:
+                if refresh_token not in e.refresh_tokens:
+                    e.refresh_tokens = ([refresh_token] + e.refresh_tokens)[-3:]  # older than any we have
+                    self._cv.notify_all()
+
+    def refresh_token(self, uid):
+        with self._lock:
+            e = self._entries.get(uid)
+            return e.refresh_token if e else None
+
+    def _fresh(self, e):
+        return e.id_token and time.monotonic() < e.expires_at - self.margin
+
+    def _refresh(self, uid, e, refresh_token=None):
+        # caller does not hold e.lock; whoever gets it first refreshes for everyone
+        with e.lock:
+            if self._fresh(e):
+                return e.id_token
+            r = self.auth.refresh(refresh_token or e.refresh_token)
+            self._store(e, r.get("idToken"), r.get("refreshToken") or refresh_token or e.refresh_token,
+                        r.get("expiresIn"))
+            return e.id_token
+
+    def restore(self, uid, refresh_token):
+        # cookie restore: {"idToken", "refreshToken"} for this uid, refreshing only if needed
+        e = self._entry(uid)
+        e.last_used = time.monotonic()
+        if refresh_token not in e.refresh_tokens:
+            # unknown to this entry: prove it with a real refresh
+            r = self.auth.refresh(refresh_token)
+            self._store(e, r.get("idToken"), r.get("refreshToken") or refresh_token, r.get("expiresIn"))
+        else:
+            self._refresh(uid, e)
+        return {"idToken": e.id_token, "refreshToken": e.refresh_token}
+
+    def token(self, uid):
+        # current ID token for uid (None if it never signed in here)
+        with self._lock:
+            e = self._entries.get(uid)
+        if e is None or not e.refresh_token:
+            return e.id_token if e else None
+        e.last_used = time.monotonic()
+        if not self._fresh(e):
+            try:
+                self._refresh(uid, e)
+            except Exception:
+                pass  # keep the old token; the caller's request reports the failure
+        return e.id_token
+
+    def expire(self, uid):
+        # the backend rejected the token: next token() refreshes
+        with self._lock:
+            e = self._entries.get(uid)
+            if e is not None:
+                e.expires_at = 0.0
+                self._cv.notify_all()
+
+    def forget(self, uid):
+        with self._lock:
+            self._entries.pop(uid, None)
+
+    def _run(self):
+        while True:
+            with self._cv:
+                now = time.monotonic()
+                due, wait = None, None
+                for uid, e in list(self._entries.items()):
+                    if not e.refresh_token:
+                        continue
+                    if now - e.last_used > TOKEN_IDLE_TTL:
+                        continue  # refreshed again on demand if the user comes back
+                    at = max(e.expires_at - self.margin, e.retry_at)
+                    if at <= now:
+                        due = (uid, e)
+                        break
+                    wait = at - now if wait is None else min(wait, at - now)
+                if due is None:
+                    self._cv.wait(wait)
+                    continue
+            uid, e = due
+            try:
+                self._refresh(uid, e)
+            except Exception:
+                with self._cv:
+                    e.retry_at = time.monotonic() + RETRY_AFTER_FAILURE
@@ -0,0 +1,40 @@
+# viewcache.py
+# Memoized chart specs and display tables, keyed by the ledger version.
+#
+# Every ledger mutation goes through the mark_* helpers in persistence.py,
+# which stamp session state with a new LEDGER_VERSION. A view built for one
+# version is reused on every rerun (nav switches, pager clicks elsewhere, ...)
+# until the version moves on. One small LRU per uid keeps memory bounded.
+import threading
+from collections import OrderedDict
+
+VIEW_CACHE_SIZE = 16  # cached views per user
+
+
+class ViewCache:
+    def __init__(self, size=VIEW_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._users = {}  # uid -> OrderedDict(key -> (version, value))
+
+    def get(self, uid, key, version, build):
+        # build() runs only on a miss; callers must treat the result as read-only
+        if uid is None or version is None:
+            return build()
+        with self._lock:
+            hit = self._users.get(uid, {}).get(key)
+            if hit is not None and hit[0] == version:
+                self._users[uid].move_to_end(key)
+                return hit[1]
+        value = build()
+        with self._lock:
+            entries = self._users.setdefault(uid, OrderedDict())
+            entries[key] = (version, value)
+            entries.move_to_end(key)
+            while len(entries) > self.size:
+                entries.popitem(last=False)
+        return value
+
+    def drop(self, uid):
+        with self._lock:
+            self._users.pop(uid, None)